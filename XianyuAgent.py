@@ -1,21 +1,31 @@
-import re
-from typing import List, Dict
+import json
+import time
+from collections import deque
+from typing import List, Dict, Tuple
 import os
-from openai import OpenAI
 from loguru import logger
+from llm_client import LLMClient
+from intent_matcher import IntentMatcher
+from intent_classifier import IntentClassifier, DEFAULT_MODEL_PATH
+
+
+REPLY_MODE_TWO_STEP = "two_step"
+REPLY_MODE_COMBINED = "combined"
 
 
 class XianyuReplyBot:
-    def __init__(self):
-        # 初始化OpenAI客户端
-        self.client = OpenAI(
-            api_key=os.getenv("OPENAI_API_KEY"),
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
-        )
+    def __init__(self, client=None, classify_cache=None):
+        # 初始化大模型客户端（同步/异步共用，可由外部传入以共享连接池）
+        self.client = client or LLMClient()
         self._init_system_prompts()
         self._init_agents()
-        self.router = IntentRouter(self.agents['classify'])
-        self.last_intent = None  # 记录最后一次意图
+        self.router = IntentRouter(self.agents['classify'], cache=classify_cache)
+        # 回复模式：two_step先分类再回复，combined一次调用同时返回意图和回复。
+        # 合并调用时意图尚未确定：已有议价轮次时沿用PriceAgent的动态温度，否则使用0.4；
+        # 联网搜索按COMBINED_ENABLE_SEARCH开启（默认开启，与TechAgent一致）
+        self.reply_mode = os.getenv("REPLY_MODE", REPLY_MODE_TWO_STEP)
+        self.combined_fallbacks = 0
+        self.missed_latencies = deque(maxlen=1000)
 
 
     def _init_agents(self):
@@ -26,6 +36,14 @@ class XianyuReplyBot:
             'tech': TechAgent(self.client, self.tech_prompt, self._safe_filter),
             'default': DefaultAgent(self.client, self.default_prompt, self._safe_filter),
         }
+        self.combined_agent = CombinedAgent(self.client, {
+            'classify': self.classify_prompt,
+            'price': self.price_prompt,
+            'tech': self.tech_prompt,
+            'default': self.default_prompt,
+        }, self._safe_filter,
+            price_agent=self.agents['price'],
+            enable_search=os.getenv("COMBINED_ENABLE_SEARCH", "1") == "1")
 
     def _init_system_prompts(self):
         """初始化系统提示词"""
@@ -67,70 +85,110 @@ class XianyuReplyBot:
         return "[安全提醒]请通过平台沟通" if any(p in text for p in blocked_phrases) else text
 
     def format_history(self, context: List[Dict]) -> str:
-        """格式化对话历史，返回完整的对话记录"""
+        """格式化对话历史，较早对话的摘要在前，最近的对话原样保留"""
+        lines = [f"【之前对话摘要】{msg['content']}" for msg in context if msg['role'] == 'summary']
         # 过滤掉系统消息，只保留用户和助手的对话
-        user_assistant_msgs = [msg for msg in context if msg['role'] in ['user', 'assistant']]
-        return "\n".join([f"{msg['role']}: {msg['content']}" for msg in user_assistant_msgs])
+        lines.extend(f"{msg['role']}: {msg['content']}" for msg in context if msg['role'] in ['user', 'assistant'])
+        return "\n".join(lines)
 
-    def generate_reply(self, user_msg: str, item_desc: str, context: List[Dict]) -> str:
-        """生成回复主流程"""
-        # 记录用户消息
-        # logger.debug(f'用户所发消息: {user_msg}')
-        
+    def generate_reply(self, user_msg: str, item_desc: str, context: List[Dict], bargain_count: int = 0) -> Tuple[str, str]:
+        """生成回复主流程，返回(回复, 意图)"""
         formatted_context = self.format_history(context)
-        # logger.debug(f'对话历史: {formatted_context}')
-        
+        logger.info(f'议价次数: {bargain_count}')
+
         # 1. 路由决策
         detected_intent = self.router.detect(user_msg, item_desc, formatted_context)
 
-
-
         # 2. 获取对应Agent
+        intent, agent = self._select_agent(detected_intent)
 
-        internal_intents = {'classify'}  # 定义不对外开放的Agent
+        # 3. 生成回复
+        reply = agent.generate(
+            user_msg=user_msg,
+            item_desc=item_desc,
+            context=formatted_context,
+            bargain_count=bargain_count
+        )
+        return reply, intent
 
-        if detected_intent in self.agents and detected_intent not in internal_intents:
-            agent = self.agents[detected_intent]
-            logger.info(f'意图识别完成: {detected_intent}')
-            self.last_intent = detected_intent  # 保存当前意图
-        else:
-            agent = self.agents['default']
-            logger.info(f'意图识别完成: default')
-            self.last_intent = 'default'  # 保存当前意图
-        
-        # 3. 获取议价次数
-        bargain_count = self._extract_bargain_count(context)
+    async def generate_reply_async(self, user_msg: str, item_desc: str, context: List[Dict],
+                                   bargain_count: int = 0) -> Tuple[str, str]:
+        """异步生成回复主流程，供事件循环中使用，返回(回复, 意图)"""
+        formatted_context = self.format_history(context)
         logger.info(f'议价次数: {bargain_count}')
 
-        # 4. 生成回复
-        return agent.generate(
+        # 1. 路由决策（规则、本地模型、分类缓存）
+        detected_intent = self.router.match_cached(user_msg, item_desc)
+        started = None
+        if detected_intent is None:
+            started = time.monotonic()
+            # 合并模式：一次调用同时得到意图和回复，调用出错或解析失败时退回两步调用
+            if self.reply_mode == REPLY_MODE_COMBINED:
+                try:
+                    result = await self.combined_agent.agenerate(
+                        user_msg=user_msg,
+                        item_desc=item_desc,
+                        context=formatted_context,
+                        bargain_count=bargain_count
+                    )
+                except Exception as e:
+                    logger.warning(f"合并模式调用失败，改为分步调用: {e}")
+                    result = None
+                if result:
+                    detected_intent, reply = result
+                    self.router.remember(user_msg, item_desc, detected_intent)
+                    intent, _ = self._select_agent(detected_intent)
+                    self._record_missed_latency(started)
+                    return reply, intent
+                self.combined_fallbacks += 1
+            detected_intent = await self.router.aclassify(user_msg, item_desc, formatted_context)
+
+        # 2. 获取对应Agent
+        intent, agent = self._select_agent(detected_intent)
+
+        # 3. 生成回复
+        reply = await agent.agenerate(
             user_msg=user_msg,
             item_desc=item_desc,
             context=formatted_context,
             bargain_count=bargain_count
         )
-    
-    def _extract_bargain_count(self, context: List[Dict]) -> int:
-        """
-        从上下文中提取议价次数信息
-        
-        Args:
-            context: 对话历史
-            
-        Returns:
-            int: 议价次数，如果没有找到则返回0
-        """
-        # 查找系统消息中的议价次数信息
-        for msg in context:
-            if msg['role'] == 'system' and '议价次数' in msg['content']:
-                try:
-                    # 提取议价次数
-                    match = re.search(r'议价次数[:：]\s*(\d+)', msg['content'])
-                    if match:
-                        return int(match.group(1))
-                except Exception:
-                    pass
-        return 0
+        if started is not None:
+            self._record_missed_latency(started)
+        return reply, intent
+
+    def _record_missed_latency(self, started):
+        self.missed_latencies.append(time.monotonic() - started)
+
+    def stats(self):
+        """规则未命中（需要大模型判断意图）的回复耗时，用于对比两种回复模式"""
+        latencies = sorted(self.missed_latencies)
+        return {
+            "reply_mode": self.reply_mode,
+            "missed_count": len(latencies),
+            "missed_p50": latencies[len(latencies) // 2] if latencies else None,
+            "missed_p95": latencies[int(len(latencies) * 0.95)] if latencies else None,
+            "combined_fallbacks": self.combined_fallbacks,
+        }
+
+    def peek_intent(self, user_msg: str, item_desc: str):
+        """不调用大模型地预判意图（与_select_agent的归类一致），无法预判时返回None"""
+        detected_intent = self.router.peek(user_msg, item_desc)
+        if detected_intent is None:
+            return None
+        if detected_intent in self.agents and detected_intent != 'classify':
+            return detected_intent
+        return 'default'
+
+    def _select_agent(self, detected_intent):
+        """根据识别出的意图选择Agent，返回(意图, Agent)"""
+        internal_intents = {'classify'}  # 定义不对外开放的Agent
+
+        if detected_intent in self.agents and detected_intent not in internal_intents:
+            logger.info(f'意图识别完成: {detected_intent}')
+            return detected_intent, self.agents[detected_intent]
+        logger.info(f'意图识别完成: default')
+        return 'default', self.agents['default']
 
     def reload_prompts(self):
         """重新加载所有提示词"""
@@ -143,59 +201,95 @@ class XianyuReplyBot:
 class IntentRouter:
     """意图路由决策器"""
 
-    def __init__(self, classify_agent):
-        self.rules = {
-            'tech': {  # 技术类优先判定
-                'keywords': ['参数', '规格', '型号', '连接', '对比'],
-                'patterns': [
-                    r'和.+比'             
-                ]
-            },
-            'price': {
-                'keywords': ['便宜', '价', '砍价', '少点'],
-                'patterns': [r'\d+元', r'能少\d+']
-            }
-        }
+    def __init__(self, classify_agent, rules_path=None, classifier=None, cache=None):
+        # 规则从文件加载并编译，修改规则文件后自动生效
+        self.matcher = IntentMatcher(rules_path or os.getenv("INTENT_RULES_PATH", os.path.join("config", "intent_rules.json")))
+        # 本地意图分类器，规则未命中时优先使用，置信度不足再调用大模型
+        self.classifier = classifier or IntentClassifier(
+            os.getenv("INTENT_MODEL_PATH", DEFAULT_MODEL_PATH),
+            threshold=float(os.getenv("INTENT_MODEL_THRESHOLD", "0.8")),
+            min_features=int(os.getenv("INTENT_MODEL_MIN_FEATURES", "2"))
+        )
         self.classify_agent = classify_agent
+        # 大模型分类结果缓存，为None时每次都调用大模型
+        self.cache = cache
+        self.local_hits = 0
+        self.llm_fallbacks = 0
+
+    def match_rules(self, user_msg: str):
+        """规则匹配（技术优先），未命中返回None"""
+        return self.matcher.match(user_msg)
+
+    def match_local(self, user_msg: str):
+        """规则和本地模型依次匹配，都不确定时返回None"""
+        intent = self.match_rules(user_msg)
+        if intent:
+            return intent
+        intent = self.classifier.predict(user_msg)
+        if intent:
+            self.local_hits += 1
+        return intent
+
+    def match_cached(self, user_msg: str, item_desc):
+        """规则、本地模型、分类缓存依次匹配，都未命中时返回None（需要调用大模型）"""
+        intent = self.match_local(user_msg)
+        if intent is None and self.cache:
+            intent = self.cache.get(user_msg, item_desc)
+        return intent
+
+    def remember(self, user_msg: str, item_desc, intent):
+        """记录大模型给出的意图"""
+        if self.cache:
+            self.cache.put(user_msg, item_desc, intent)
+
+    def peek(self, user_msg: str, item_desc):
+        """不调用大模型、不计入统计地预判意图（规则、本地模型、分类缓存），无法预判时返回None"""
+        intent = self.match_rules(user_msg) or self.classifier.predict(user_msg)
+        if intent is None and self.cache:
+            intent = self.cache.peek(user_msg, item_desc)
+        return intent
 
     def detect(self, user_msg: str, item_desc, context) -> str:
         """三级路由策略（技术优先）"""
-        text_clean = re.sub(r'[^\w\u4e00-\u9fa5]', '', user_msg)
-        
-        # 1. 技术类关键词优先检查
-        if any(kw in text_clean for kw in self.rules['tech']['keywords']):
-            # logger.debug(f"技术类关键词匹配: {[kw for kw in self.rules['tech']['keywords'] if kw in text_clean]}")
-            return 'tech'
-            
-        # 2. 技术类正则优先检查
-        for pattern in self.rules['tech']['patterns']:
-            if re.search(pattern, text_clean):
-                # logger.debug(f"技术类正则匹配: {pattern}")
-                return 'tech'
-
-        # 3. 价格类检查
-        for intent in ['price']:
-            if any(kw in text_clean for kw in self.rules[intent]['keywords']):
-                # logger.debug(f"价格类关键词匹配: {[kw for kw in self.rules[intent]['keywords'] if kw in text_clean]}")
-                return intent
-            
-            for pattern in self.rules[intent]['patterns']:
-                if re.search(pattern, text_clean):
-                    # logger.debug(f"价格类正则匹配: {pattern}")
-                    return intent
+        intent = self.match_cached(user_msg, item_desc)
+        if intent:
+            return intent
         
         # 4. 大模型兜底
-        # logger.debug("使用大模型进行意图分类")
-        return self.classify_agent.generate(
+        self.llm_fallbacks += 1
+        intent = self.classify_agent.generate(
+            user_msg=user_msg,
+            item_desc=item_desc,
+            context=context
+        )
+        self.remember(user_msg, item_desc, intent)
+        return intent
+
+    async def aclassify(self, user_msg: str, item_desc, context) -> str:
+        """异步调用大模型识别意图"""
+        self.llm_fallbacks += 1
+        intent = await self.classify_agent.agenerate(
             user_msg=user_msg,
             item_desc=item_desc,
             context=context
         )
+        self.remember(user_msg, item_desc, intent)
+        return intent
+
+    def stats(self):
+        """本地模型接管与大模型兜底的次数"""
+        return {
+            "local_hits": self.local_hits,
+            "llm_fallbacks": self.llm_fallbacks,
+            "classify_cache": self.cache.stats() if self.cache else None,
+        }
 
 
 class BaseAgent:
     """Agent基类"""
 
+    model = "qwen-max"
+
     def __init__(self, client, system_prompt, safety_filter):
         self.client = client
         self.system_prompt = system_prompt
@@ -203,8 +297,14 @@ class BaseAgent:
 
     def generate(self, user_msg: str, item_desc: str, context: str, bargain_count: int = 0) -> str:
         """生成回复模板方法"""
-        messages = self._build_messages(user_msg, item_desc, context)
-        response = self._call_llm(messages)
+        messages = self._prepare_messages(user_msg, item_desc, context, bargain_count)
+        response = self._call_llm(messages, **self._llm_options(bargain_count))
+        return self.safety_filter(response)
+
+    async def agenerate(self, user_msg: str, item_desc: str, context: str, bargain_count: int = 0) -> str:
+        """异步生成回复模板方法"""
+        messages = self._prepare_messages(user_msg, item_desc, context, bargain_count)
+        response = await self._acall_llm(messages, **self._llm_options(bargain_count))
         return self.safety_filter(response)
 
     def _build_messages(self, user_msg: str, item_desc: str, context: str) -> List[Dict]:
@@ -214,35 +314,43 @@ class BaseAgent:
             {"role": "user", "content": user_msg}
         ]
 
-    def _call_llm(self, messages: List[Dict], temperature: float = 0.4) -> str:
-        """调用大模型"""
-        response = self.client.chat.completions.create(
-            model="qwen-max",
+    def _prepare_messages(self, user_msg: str, item_desc: str, context: str, bargain_count: int) -> List[Dict]:
+        """构建本次调用的消息链，子类可追加额外信息"""
+        return self._build_messages(user_msg, item_desc, context)
+
+    def _llm_options(self, bargain_count: int) -> Dict:
+        """本次调用的模型参数，子类可覆盖"""
+        return {"temperature": 0.4}
+
+    def _request_kwargs(self, messages: List[Dict], temperature: float = 0.4, **extra) -> Dict:
+        return dict(
+            model=self.model,
             messages=messages,
             temperature=temperature,
             max_tokens=500,
-            top_p=0.8
+            top_p=0.8,
+            **extra
         )
-        return response.choices[0].message.content
+
+    def _call_llm(self, messages: List[Dict], temperature: float = 0.4, **extra) -> str:
+        """调用大模型"""
+        return self.client.complete(**self._request_kwargs(messages, temperature, **extra))
+
+    async def _acall_llm(self, messages: List[Dict], temperature: float = 0.4, **extra) -> str:
+        """异步调用大模型"""
+        return await self.client.acomplete(**self._request_kwargs(messages, temperature, **extra))
 
 
 class PriceAgent(BaseAgent):
     """议价处理Agent"""
 
-    def generate(self, user_msg: str, item_desc: str, context: str, bargain_count: int=0) -> str:
-        """重写生成逻辑"""
-        dynamic_temp = self._calc_temperature(bargain_count)
+    def _prepare_messages(self, user_msg: str, item_desc: str, context: str, bargain_count: int) -> List[Dict]:
         messages = self._build_messages(user_msg, item_desc, context)
         messages[0]['content'] += f"\n▲当前议价轮次：{bargain_count}"
+        return messages
 
-        response = self.client.chat.completions.create(
-            model="qwen-max",
-            messages=messages,
-            temperature=dynamic_temp,
-            max_tokens=500,
-            top_p=0.8
-        )
-        return self.safety_filter(response.choices[0].message.content)
+    def _llm_options(self, bargain_count: int) -> Dict:
+        return {"temperature": self._calc_temperature(bargain_count)}
 
     def _calc_temperature(self, bargain_count: int) -> float:
         """动态温度策略"""
@@ -251,23 +359,15 @@ class PriceAgent(BaseAgent):
 
 class TechAgent(BaseAgent):
     """技术咨询Agent"""
-    def generate(self, user_msg: str, item_desc: str, context: str, bargain_count: int=0) -> str:
-        """重写生成逻辑"""
-        messages = self._build_messages(user_msg, item_desc, context)
-        # messages[0]['content'] += "\n▲知识库：\n" + self._fetch_tech_specs()
 
-        response = self.client.chat.completions.create(
-            model="qwen-max",
-            messages=messages,
-            temperature=0.4,
-            max_tokens=500,
-            top_p=0.8,
-            extra_body={
+    def _llm_options(self, bargain_count: int) -> Dict:
+        # messages[0]['content'] += "\n▲知识库：\n" + self._fetch_tech_specs()
+        return {
+            "temperature": 0.4,
+            "extra_body": {
                 "enable_search": True,
             }
-        )
-
-        return self.safety_filter(response.choices[0].message.content)
+        }
 
 
     # def _fetch_tech_specs(self) -> str:
@@ -282,11 +382,80 @@ class ClassifyAgent(BaseAgent):
         response = super().generate(**args)
         return response
 
+    async def agenerate(self, **args) -> str:
+        response = await super().agenerate(**args)
+        return response
+
 
 class DefaultAgent(BaseAgent):
     """默认处理Agent"""
 
-    def _call_llm(self, messages: List[Dict], *args) -> str:
+    def _llm_options(self, bargain_count: int) -> Dict:
         """限制默认回复长度"""
-        response = super()._call_llm(messages, temperature=0.7)
-        return response
\ No newline at end of file
+        return {"temperature": 0.7}
+
+
+class CombinedAgent(BaseAgent):
+    """意图识别与回复合并Agent：一次调用返回意图和对应Agent风格的回复"""
+
+    intents = ('price', 'tech', 'default')
+
+    def __init__(self, client, prompts, safety_filter, price_agent=None, enable_search=False):
+        """
+        Args:
+            prompts: 各Agent的提示词，{"classify": ..., "price": ..., "tech": ..., "default": ...}
+            price_agent: 提供议价动态温度的PriceAgent，为None时固定使用0.4
+            enable_search: 是否像TechAgent一样开启联网搜索
+        """
+        self.price_agent = price_agent
+        self.enable_search = enable_search
+        system_prompt = (
+            "请先判断客户最新消息的意图，再严格按该意图对应的要求直接回复客户。\n"
+            f"【意图识别要求】\n{prompts['classify']}\n"
+            f"【price：议价回复要求】\n{prompts['price']}\n"
+            f"【tech：技术咨询回复要求】\n{prompts['tech']}\n"
+            f"【default：其他问题回复要求】\n{prompts['default']}\n"
+            '只输出一个JSON对象，不要输出其他内容，格式为：{"intent": "price|tech|default", "reply": "给客户的回复"}'
+        )
+        super().__init__(client, system_prompt, safety_filter)
+
+    def _prepare_messages(self, user_msg: str, item_desc: str, context: str, bargain_count: int) -> List[Dict]:
+        messages = self._build_messages(user_msg, item_desc, context)
+        messages[0]['content'] += f"\n▲当前议价轮次：{bargain_count}"
+        return messages
+
+    def _llm_options(self, bargain_count: int) -> Dict:
+        options = {"temperature": 0.4, "response_format": {"type": "json_object"}}
+        # 已进入议价的会话沿用PriceAgent的动态温度
+        if bargain_count > 0 and self.price_agent:
+            options["temperature"] = self.price_agent._calc_temperature(bargain_count)
+        if self.enable_search:
+            options["extra_body"] = {"enable_search": True}
+        return options
+
+    def parse(self, response: str):
+        """解析模型输出，返回(意图, 过滤后的回复)，格式不符时返回None"""
+        text = (response or "").strip()
+        if text.startswith("```"):
+            text = text.strip("`").strip()
+            if text.startswith("json"):
+                text = text[4:]
+        try:
+            data = json.loads(text)
+            intent = str(data.get("intent", "")).strip().lower()
+            reply = str(data.get("reply") or "").strip()
+        except (ValueError, AttributeError):
+            logger.warning(f"合并模式输出无法解析: {response}")
+            return None
+        if intent not in self.intents or not reply:
+            logger.warning(f"合并模式输出缺少意图或回复: {response}")
+            return None
+        return intent, self.safety_filter(reply)
+
+    def generate(self, user_msg: str, item_desc: str, context: str, bargain_count: int = 0):
+        messages = self._prepare_messages(user_msg, item_desc, context, bargain_count)
+        return self.parse(self._call_llm(messages, **self._llm_options(bargain_count)))
+
+    async def agenerate(self, user_msg: str, item_desc: str, context: str, bargain_count: int = 0):
+        messages = self._prepare_messages(user_msg, item_desc, context, bargain_count)
+        return self.parse(await self._acall_llm(messages, **self._llm_options(bargain_count)))
@@ -1,80 +1,141 @@
+import asyncio
 import json
+import os
 import time
 
+import aiohttp
 import requests
 
 from utils.xianyu_utils import generate_sign, trans_cookies, generate_device_id
 
 
+API_BASE = 'https://h5api.m.goofish.com/h5/'
+
+HEADERS = {
+    'accept': 'application/json',
+    'accept-language': 'zh-CN,zh;q=0.9',
+    'cache-control': 'no-cache',
+    'origin': 'https://www.goofish.com',
+    'pragma': 'no-cache',
+    'priority': 'u=1, i',
+    'referer': 'https://www.goofish.com/',
+    'sec-ch-ua': '"Not(A:Brand";v="99", "Google Chrome";v="133", "Chromium";v="133"',
+    'sec-ch-ua-mobile': '?0',
+    'sec-ch-ua-platform': '"Windows"',
+    'sec-fetch-dest': 'empty',
+    'sec-fetch-mode': 'cors',
+    'sec-fetch-site': 'same-site',
+    'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36',
+}
+
+
+def build_mtop_request(api, data_val, cookies):
+    """构建mtop接口的请求地址、参数和表单数据"""
+    params = {
+        'jsv': '2.7.2',
+        'appKey': '34839810',
+        't': str(int(time.time()) * 1000),
+        'sign': '',
+        'v': '1.0',
+        'type': 'originaljson',
+        'accountSite': 'xianyu',
+        'dataType': 'json',
+        'timeout': '20000',
+        'api': api,
+        'sessionOption': 'AutoLoginOnly',
+        'spm_cnt': 'a21ybx.im.0.0',
+    }
+    token = cookies['_m_h5_tk'].split('_')[0]
+    params['sign'] = generate_sign(params['t'], token, data_val)
+    # XIANYU_API_BASE可指向本地替身服务用于测试
+    url = f"{os.getenv('XIANYU_API_BASE', API_BASE)}{api}/1.0/"
+    return url, params, {'data': data_val}
+
+
+def token_data(device_id):
+    return '{"appKey":"444e9908a51d1cb236a27862abc769c9","deviceId":"' + device_id + '"}'
+
+
+def item_data(item_id):
+    return '{"itemId":"' + item_id + '"}'
+
+
 class XianyuApis:
-    def __init__(self):
+    def __init__(self, timeout=20):
         self.url = 'https://h5api.m.goofish.com/h5/mtop.taobao.idlemessage.pc.login.token/1.0/'
-        self.headers = {
-            'accept': 'application/json',
-            'accept-language': 'zh-CN,zh;q=0.9',
-            'cache-control': 'no-cache',
-            'origin': 'https://www.goofish.com',
-            'pragma': 'no-cache',
-            'priority': 'u=1, i',
-            'referer': 'https://www.goofish.com/',
-            'sec-ch-ua': '"Not(A:Brand";v="99", "Google Chrome";v="133", "Chromium";v="133"',
-            'sec-ch-ua-mobile': '?0',
-            'sec-ch-ua-platform': '"Windows"',
-            'sec-fetch-dest': 'empty',
-            'sec-fetch-mode': 'cors',
-            'sec-fetch-site': 'same-site',
-            'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36',
-        }
-    def get_token(self, cookies, device_id):
+        self.headers = HEADERS
+        self.timeout = timeout
+        # 复用TCP/TLS连接
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
 
-        params = {
-            'jsv': '2.7.2',
-            'appKey': '34839810',
-            't': str(int(time.time()) * 1000),
-            'sign': '',
-            'v': '1.0',
-            'type': 'originaljson',
-            'accountSite': 'xianyu',
-            'dataType': 'json',
-            'timeout': '20000',
-            'api': 'mtop.taobao.idlemessage.pc.login.token',
-            'sessionOption': 'AutoLoginOnly',
-            'spm_cnt': 'a21ybx.im.0.0',
-        }
-        data_val = '{"appKey":"444e9908a51d1cb236a27862abc769c9","deviceId":"' + device_id + '"}'
-        data = {
-            'data': data_val,
-        }
-        token = cookies['_m_h5_tk'].split('_')[0]
-        sign = generate_sign(params['t'], token, data_val)
-        params['sign'] = sign
-        response = requests.post('https://h5api.m.goofish.com/h5/mtop.taobao.idlemessage.pc.login.token/1.0/', params=params, cookies=cookies, headers=self.headers, data=data)
-        res_json = response.json()
-        return res_json
+    def _post(self, api, data_val, cookies):
+        url, params, data = build_mtop_request(api, data_val, cookies)
+        response = self.session.post(url, params=params, cookies=cookies, data=data, timeout=self.timeout)
+        return response.json()
+
+    def get_token(self, cookies, device_id):
+        return self._post('mtop.taobao.idlemessage.pc.login.token', token_data(device_id), cookies)
 
     def get_item_info(self, cookies, item_id):
+        return self._post('mtop.taobao.idle.pc.detail', item_data(item_id), cookies)
+
+
+class AsyncXianyuApis:
+    """
+    异步版闲鱼接口客户端
+
+    使用aiohttp长连接池，支持单次调用超时和并发上限，可在事件循环中直接await。
+    cookie按调用传入且不写入会话，因此同一个实例可被多个账号共享。
+    """
+
+    def __init__(self, timeout=10, max_connections=20, max_concurrency=10):
+        """
+        初始化异步接口客户端
+
+        Args:
+            timeout: 单次请求的总超时（秒）
+            max_connections: 连接池最大连接数
+            max_concurrency: 同时进行的最大请求数
+        """
+        self.headers = HEADERS
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.max_connections = max_connections
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.session = None
+
+    def _get_session(self):
+        """延迟创建会话，确保在事件循环内创建"""
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                keepalive_timeout=60,
+                ttl_dns_cache=300
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                headers=self.headers,
+                timeout=self.timeout,
+                cookie_jar=aiohttp.DummyCookieJar()
+            )
+        return self.session
+
+    async def _post(self, api, data_val, cookies, timeout=None):
+        url, params, data = build_mtop_request(api, data_val, cookies)
+        session = self._get_session()
+        kwargs = {'timeout': aiohttp.ClientTimeout(total=timeout)} if timeout else {}
+        async with self.semaphore:
+            async with session.post(url, params=params, cookies=cookies, data=data, **kwargs) as response:
+                return await response.json(content_type=None)
+
+    async def get_token(self, cookies, device_id, timeout=None):
+        return await self._post('mtop.taobao.idlemessage.pc.login.token', token_data(device_id), cookies, timeout)
+
+    async def get_item_info(self, cookies, item_id, timeout=None):
+        return await self._post('mtop.taobao.idle.pc.detail', item_data(item_id), cookies, timeout)
 
-        params = {
-            'jsv': '2.7.2',
-            'appKey': '34839810',
-            't': str(int(time.time()) * 1000),
-            'sign': '',
-            'v': '1.0',
-            'type': 'originaljson',
-            'accountSite': 'xianyu',
-            'dataType': 'json',
-            'timeout': '20000',
-            'api': 'mtop.taobao.idle.pc.detail',
-            'sessionOption': 'AutoLoginOnly',
-            'spm_cnt': 'a21ybx.im.0.0',
-        }
-        data_val = '{"itemId":"' + item_id + '"}'
-        data = {
-            'data': data_val,
-        }
-        token = cookies['_m_h5_tk'].split('_')[0]
-        sign = generate_sign(params['t'], token, data_val)
-        params['sign'] = sign
-        response = requests.post('https://h5api.m.goofish.com/h5/mtop.taobao.idle.pc.detail/1.0/', params=params, cookies=cookies, headers=self.headers, data=data)
-        res_json = response.json()
-        return res_json
+    async def close(self):
+        """关闭连接池"""
+        if self.session and not self.session.closed:
+            await self.session.close()
+        self.session = None
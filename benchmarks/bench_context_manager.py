@@ -0,0 +1,131 @@
+"""
+ChatContextManager 读写性能对比
+
+对比旧实现（每次调用新建连接、默认回滚日志模式）与长连接 + WAL + 预编译语句缓存
+的add_message和get_context吞吐。两种实现各使用一个新建的临时数据库。
+
+用法:
+    python benchmarks/bench_context_manager.py [--ops 2000] [--conversations 50] [--synchronous NORMAL]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loguru import logger  # noqa: E402
+
+from context_manager import ChatContextManager  # noqa: E402
+
+
+# ---- 旧实现：每次调用新建连接 ----
+
+class LegacyContextManager:
+    def __init__(self, db_path, max_history=100):
+        self.db_path = db_path
+        self.max_history = max_history
+        # 消息表与新实现一致，只是不开启WAL，议价次数仍在旧的bargain_counts表中
+        ChatContextManager(max_history=max_history, db_path=db_path).close()
+        conn = sqlite3.connect(db_path)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS bargain_counts (user_id TEXT NOT NULL, item_id TEXT NOT NULL, "
+            "count INTEGER DEFAULT 0, last_updated DATETIME DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (user_id, item_id))"
+        )
+        conn.close()
+
+    def add_message(self, user_id, item_id, role, content, intent=None):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "INSERT INTO messages (user_id, item_id, role, content, timestamp, intent) VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, item_id, role, content, datetime.now().isoformat(), intent)
+            )
+            cursor.execute(
+                "SELECT id FROM messages WHERE user_id = ? AND item_id = ? ORDER BY timestamp DESC LIMIT ?, 1",
+                (user_id, item_id, self.max_history)
+            )
+            oldest_to_keep = cursor.fetchone()
+            if oldest_to_keep:
+                cursor.execute(
+                    "DELETE FROM messages WHERE user_id = ? AND item_id = ? AND id < ?",
+                    (user_id, item_id, oldest_to_keep[0])
+                )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_bargain_count(self, user_id, item_id):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            row = conn.execute(
+                "SELECT count FROM bargain_counts WHERE user_id = ? AND item_id = ?", (user_id, item_id)
+            ).fetchone()
+            return row[0] if row else 0
+        finally:
+            conn.close()
+
+    def get_context(self, user_id, item_id):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            rows = conn.execute(
+                "SELECT id, role, content FROM messages WHERE user_id = ? AND item_id = ? ORDER BY timestamp ASC LIMIT ?",
+                (user_id, item_id, self.max_history)
+            ).fetchall()
+            messages = [{"id": id, "role": role, "content": content} for id, role, content in rows]
+            bargain_count = self.get_bargain_count(user_id, item_id)
+            if bargain_count > 0:
+                messages.append({"role": "system", "content": f"议价次数: {bargain_count}"})
+        finally:
+            conn.close()
+        return messages
+
+    def close(self):
+        pass
+
+
+def run(manager, ops, conversations):
+    """返回(add_message每秒次数, get_context每秒次数)"""
+    keys = [(f"user{i}", f"item{i % 7}") for i in range(conversations)]
+
+    start = time.perf_counter()
+    for i in range(ops):
+        user_id, item_id = keys[i % conversations]
+        manager.add_message(user_id, item_id, "user" if i % 2 == 0 else "assistant", f"第{i}条消息，这个还能便宜点吗")
+    add_rate = ops / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(ops):
+        manager.get_context(*keys[i % conversations])
+    get_rate = ops / (time.perf_counter() - start)
+    return add_rate, get_rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ChatContextManager读写性能对比")
+    parser.add_argument("--ops", type=int, default=2000, help="每种操作的次数")
+    parser.add_argument("--conversations", type=int, default=50, help="会话数")
+    parser.add_argument("--synchronous", default="NORMAL", help="新实现使用的PRAGMA synchronous级别")
+    args = parser.parse_args()
+    logger.remove()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = LegacyContextManager(os.path.join(tmp, "legacy.db"))
+        old_add, old_get = run(legacy, args.ops, args.conversations)
+
+        current = ChatContextManager(db_path=os.path.join(tmp, "current.db"), synchronous=args.synchronous)
+        new_add, new_get = run(current, args.ops, args.conversations)
+        current.close()
+
+    print(f"操作数: {args.ops}，会话数: {args.conversations}")
+    print(f"add_message  旧实现: {old_add:,.0f} 次/秒，长连接+WAL: {new_add:,.0f} 次/秒，加速比 {new_add / old_add:.2f}x")
+    print(f"get_context  旧实现: {old_get:,.0f} 次/秒，长连接+WAL: {new_get:,.0f} 次/秒，加速比 {new_get / old_get:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
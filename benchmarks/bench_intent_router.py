@@ -0,0 +1,99 @@
+"""
+意图规则路由性能对比
+
+对比旧的规则匹配（每条消息re.sub清洗 + 关键词逐个in + 未编译的re.search）与
+intent_matcher单次扫描的吞吐，并校验两者结果一致。
+
+用法:
+    python benchmarks/bench_intent_router.py [--corpus 消息.txt | --db data/chat_history.db] [--rounds 5]
+
+--corpus 每行一条买家消息；--db 读取聊天记录库中role为user的消息；都不提供时使用内置样本。
+"""
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from intent_matcher import IntentMatcher, DEFAULT_RULES  # noqa: E402
+
+
+SAMPLE_MESSAGES = [
+    "在吗", "这个多少钱", "能便宜点吗", "还在吗？", "包邮吗", "最低多少", "300元卖不卖",
+    "能少50吗", "这个型号是什么", "和iPhone13比怎么样", "电池健康多少", "有发票吗",
+    "屏幕有划痕吗？", "支持快充吗", "参数发我看看", "可以小刀吗😊", "今天能发货吗",
+    "成色怎么样", "蓝牙连接稳定吗", "我诚心要，少点吧", "好的，我拍了", "谢谢亲",
+    "这个价格还能再商量吗？", "规格是多大的", "还有别的颜色吗", "同城可以面交吗",
+]
+
+
+def load_corpus(args):
+    if args.corpus:
+        with open(args.corpus, "r", encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip()]
+    if args.db:
+        conn = sqlite3.connect(args.db)
+        try:
+            rows = conn.execute("SELECT content FROM messages WHERE role = 'user'").fetchall()
+        finally:
+            conn.close()
+        return [row[0] for row in rows if row[0]]
+    return SAMPLE_MESSAGES * 400
+
+
+# ---- 旧的规则匹配 ----
+
+OLD_RULES = {rule["name"]: rule for rule in DEFAULT_RULES}
+
+
+def old_match_rules(user_msg):
+    text_clean = re.sub(r'[^\w\u4e00-\u9fa5]', '', user_msg)
+    if any(kw in text_clean for kw in OLD_RULES['tech']['keywords']):
+        return 'tech'
+    for pattern in OLD_RULES['tech']['patterns']:
+        if re.search(pattern, text_clean):
+            return 'tech'
+    for intent in ['price']:
+        if any(kw in text_clean for kw in OLD_RULES[intent]['keywords']):
+            return intent
+        for pattern in OLD_RULES[intent]['patterns']:
+            if re.search(pattern, text_clean):
+                return intent
+    return None
+
+
+def bench(func, corpus, rounds):
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for message in corpus:
+            func(message)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="意图规则路由性能对比")
+    parser.add_argument("--corpus", help="每行一条消息的文本文件")
+    parser.add_argument("--db", help="聊天记录数据库")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args)
+    matcher = IntentMatcher()
+
+    mismatches = sum(1 for message in corpus if old_match_rules(message) != matcher.match(message))
+    old_time = bench(old_match_rules, corpus, args.rounds)
+    new_time = bench(matcher.match, corpus, args.rounds)
+
+    print(f"消息数: {len(corpus)}，结果不一致: {mismatches}")
+    print(f"旧规则匹配: {old_time * 1000:.1f} ms，{len(corpus) / old_time:,.0f} 条/秒")
+    print(f"单次扫描:   {new_time * 1000:.1f} ms，{len(corpus) / new_time:,.0f} 条/秒")
+    print(f"加速比: {old_time / new_time:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
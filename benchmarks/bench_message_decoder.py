@@ -0,0 +1,177 @@
+"""
+消息解析性能对比
+
+对比旧的解析方式（base64/decrypt异常回退 + 多个is_*判断函数反复遍历）与
+message_decoder单次解析的耗时。
+
+用法:
+    python benchmarks/bench_message_decoder.py [--frames 录制的帧.jsonl] [--rounds 5]
+
+录制文件每行是一条websocket原始帧（JSON），不提供时使用合成帧。
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from message_decoder import sync_entries, decode_sync_entry  # noqa: E402
+from utils.xianyu_utils import decrypt  # noqa: E402
+
+
+def _encode(message):
+    return base64.b64encode(json.dumps(message, ensure_ascii=False).encode("utf-8")).decode("utf-8")
+
+
+def synthetic_frames(count=3000):
+    """生成文本、图片、输入状态三类混合的同步帧"""
+    frames = []
+    for i in range(count):
+        cid = f"{10000 + i % 50}@goofish"
+        if i % 10 == 0:
+            message = {"1": [{"1": f"{20000 + i % 50}@goofish", "2": 1}]}
+        elif i % 10 == 1:
+            pics = json.dumps({"image": {"pics": [{"url": "https://img.example/1.jpg", "width": 800, "height": 600, "type": 0}]}})
+            message = {"1": {
+                "2": cid, "3": f"{i}.PNM", "5": int(time.time() * 1000),
+                "6": {"3": {"5": pics}},
+                "10": {"reminderTitle": "买家", "senderUserId": str(20000 + i % 50), "reminderContent": "[图片]",
+                       "detailNotice": "[图片]", "reminderUrl": "fleamarket://message_chat?itemId=123456&peerUserId=1"},
+            }}
+        else:
+            message = {"1": {
+                "2": cid, "3": f"{i}.PNM", "5": int(time.time() * 1000),
+                "10": {"reminderTitle": "买家", "senderUserId": str(20000 + i % 50), "reminderContent": f"这个还能便宜点吗 {i}",
+                       "detailNotice": f"这个还能便宜点吗 {i}", "reminderUrl": "fleamarket://message_chat?itemId=123456&peerUserId=1"},
+            }}
+        frames.append(json.dumps({
+            "headers": {"mid": f"{i} 0", "sid": "s"},
+            "body": {"syncPushPackage": {"data": [{"data": _encode(message), "pts": i}]}},
+        }, ensure_ascii=False))
+    return frames
+
+
+# ---- 旧的解析方式 ----
+
+def old_is_sync_package(message_data):
+    try:
+        return (
+            isinstance(message_data, dict)
+            and "body" in message_data
+            and "syncPushPackage" in message_data["body"]
+            and "data" in message_data["body"]["syncPushPackage"]
+            and len(message_data["body"]["syncPushPackage"]["data"]) > 0
+        )
+    except Exception:
+        return False
+
+
+def old_is_chat_message(message):
+    try:
+        return (
+            isinstance(message, dict)
+            and "1" in message
+            and isinstance(message["1"], dict)
+            and "10" in message["1"]
+            and isinstance(message["1"]["10"], dict)
+            and "reminderContent" in message["1"]["10"]
+        )
+    except Exception:
+        return False
+
+
+def old_is_typing_status(message):
+    try:
+        return (
+            isinstance(message, dict)
+            and "1" in message
+            and isinstance(message["1"], list)
+            and len(message["1"]) > 0
+            and isinstance(message["1"][0], dict)
+            and "1" in message["1"][0]
+            and isinstance(message["1"][0]["1"], str)
+            and "@goofish" in message["1"][0]["1"]
+        )
+    except Exception:
+        return False
+
+
+def old_get_message_type(message):
+    try:
+        if "1" in message and "10" in message["1"]:
+            detail_notice = message["1"]["10"].get("detailNotice", "")
+            reminder_content = message["1"]["10"].get("reminderContent", "")
+            if detail_notice.startswith("[") and detail_notice.endswith("]"):
+                return detail_notice[1:-1]
+            elif reminder_content.startswith("[") and reminder_content.endswith("]"):
+                return reminder_content[1:-1]
+            if "语音" in detail_notice or "语音" in reminder_content:
+                return "语音"
+    except Exception:
+        pass
+    return "正常消息"
+
+
+def old_parse(frame):
+    message_data = json.loads(frame)
+    if not old_is_sync_package(message_data):
+        return None
+    data = message_data["body"]["syncPushPackage"]["data"][0]["data"]
+    try:
+        message = json.loads(base64.b64decode(data).decode("utf-8"))
+    except Exception:
+        message = json.loads(decrypt(data))
+    old_is_typing_status(message)
+    message_type = old_get_message_type(message)
+    if message_type == "图片":
+        json.loads(message["1"]["6"]["3"]["5"])
+    elif old_is_chat_message(message):
+        body = message["1"]
+        url_info = body["10"]["reminderUrl"]
+        return (
+            int(body["5"]), body["10"]["senderUserId"], body["10"]["reminderContent"],
+            url_info.split("itemId=")[1].split("&")[0] if "itemId=" in url_info else None,
+            body["2"].split("@")[0],
+        )
+    return message_type
+
+
+def new_parse(frame):
+    events = [decode_sync_entry(entry) for entry in sync_entries(json.loads(frame))]
+    return events
+
+
+def bench(name, func, frames, rounds):
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for frame in frames:
+            func(frame)
+        best = min(best, time.perf_counter() - start)
+    per_frame = best / len(frames) * 1e6
+    print(f"{name:<6} {len(frames)} 帧  最佳 {best * 1000:.1f} ms  每帧 {per_frame:.2f} µs")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="消息解析性能对比")
+    parser.add_argument("--frames", help="录制的websocket帧文件（每行一条JSON）")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.frames:
+        with open(args.frames, "r", encoding="utf-8") as f:
+            frames = [line for line in (l.strip() for l in f) if line]
+    else:
+        frames = synthetic_frames()
+
+    old = bench("旧实现", old_parse, frames, args.rounds)
+    new = bench("新实现", new_parse, frames, args.rounds)
+    print(f"加速比: {old / new:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import asyncio
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from collections import OrderedDict
+from loguru import logger
+
+from intent_matcher import clean_text
+
+
+_CATEGORY_RE = re.compile(r"商品分类: ([^;]+)")
+
+
+def normalize_text(text):
+    """全角转半角、统一大小写，并去掉标点、空白和表情"""
+    return clean_text(unicodedata.normalize("NFKC", text).lower())
+
+
+def item_category(item_desc):
+    """从商品描述中取出商品分类，没有时返回空字符串"""
+    match = _CATEGORY_RE.search(item_desc or "")
+    return match.group(1).strip() if match else ""
+
+
+class ClassifyCache:
+    """
+    意图分类结果缓存
+
+    买家消息高度重复，规则和本地模型都未命中时，大模型对同一句话（同一商品分类下）
+    给出的意图基本不变。按归一化后的消息文本加商品分类缓存分类结果，支持TTL和
+    LRU容量上限，可选持久化到SQLite，重启后热点条目仍然有效。新条目攒批后在
+    线程中写入，不阻塞事件循环。
+    """
+
+    def __init__(self, ttl=86400, max_size=5000, db_path=None, flush_interval=1.0):
+        """
+        初始化分类缓存
+
+        Args:
+            ttl: 条目有效期（秒）
+            max_size: 最大缓存条目数，超出时淘汰最久未使用的条目
+            db_path: SQLite数据库路径，为None时不持久化
+            flush_interval: 事件循环中攒批写库的间隔（秒）
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.entries = OrderedDict()  # 缓存键 -> (意图, 写入时间)
+        self.pending = []             # 待写库的 (缓存键, 意图, 写入时间)
+        self._flush_task = None
+        self.hits = 0
+        self.misses = 0
+
+        if self.db_path:
+            self._init_db()
+            self._load()
+
+    def _init_db(self):
+        """初始化缓存表"""
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+
+        conn = sqlite3.connect(self.db_path)
+        try:
+            # 多个worker进程共用同一个数据库，WAL模式下读写互不阻塞
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS classify_cache (
+                cache_key TEXT PRIMARY KEY,
+                intent TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            ''')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _load(self):
+        """从数据库加载未过期的条目，并清理已过期的条目"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            expire_before = time.time() - self.ttl
+            conn.execute("DELETE FROM classify_cache WHERE created_at <= ?", (expire_before,))
+            conn.commit()
+            rows = conn.execute(
+                "SELECT cache_key, intent, created_at FROM classify_cache ORDER BY created_at ASC"
+            ).fetchall()
+            for key, intent, created_at in rows[-self.max_size:]:
+                self.entries[key] = (intent, created_at)
+            logger.info(f"已从数据库加载 {len(self.entries)} 条意图分类缓存")
+        except Exception as e:
+            logger.error(f"加载意图分类缓存失败: {e}")
+        finally:
+            conn.close()
+
+    def _write(self, batch):
+        """在一个事务中写入一批条目"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO classify_cache (cache_key, intent, created_at) VALUES (?, ?, ?)",
+                batch
+            )
+            conn.commit()
+        except Exception as e:
+            logger.error(f"保存意图分类缓存失败: {e}")
+        finally:
+            conn.close()
+
+    def _schedule_flush(self):
+        """事件循环中延迟一段时间后攒批写库，没有运行中的事件循环时直接写入"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.aflush()
+
+    def flush(self):
+        """同步写入所有待写条目"""
+        batch, self.pending = self.pending, []
+        if batch:
+            self._write(batch)
+
+    async def aflush(self):
+        """在线程中写入所有待写条目"""
+        batch, self.pending = self.pending, []
+        if batch:
+            await asyncio.to_thread(self._write, batch)
+
+    @staticmethod
+    def make_key(user_msg, item_desc):
+        """缓存键：商品分类 + 归一化文本，文本归一化后为空时返回None（不缓存）"""
+        text = normalize_text(user_msg)
+        if not text:
+            return None
+        return f"{item_category(item_desc)}\x1f{text}"
+
+    def get(self, user_msg, item_desc):
+        """返回缓存的意图，未命中返回None"""
+        key = self.make_key(user_msg, item_desc)
+        entry = self.entries.get(key) if key else None
+        if entry is not None:
+            if time.time() - entry[1] < self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            del self.entries[key]
+        self.misses += 1
+        return None
+
+    def peek(self, user_msg, item_desc):
+        """查看缓存的意图，不计入命中统计也不调整LRU顺序"""
+        key = self.make_key(user_msg, item_desc)
+        entry = self.entries.get(key) if key else None
+        if entry is not None and time.time() - entry[1] < self.ttl:
+            return entry[0]
+        return None
+
+    def put(self, user_msg, item_desc, intent):
+        """写入大模型给出的分类结果"""
+        key = self.make_key(user_msg, item_desc)
+        if not key or not intent:
+            return
+        created_at = time.time()
+        self.entries[key] = (intent, created_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        if self.db_path:
+            self.pending.append((key, intent, created_at))
+            self._schedule_flush()
+
+    def stats(self):
+        """获取缓存命中统计"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "pending": len(self.pending),
+        }
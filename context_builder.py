@@ -0,0 +1,134 @@
+import asyncio
+import re
+from loguru import logger
+
+
+_CJK_RE = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+
+SUMMARY_PROMPT = (
+    "你是闲鱼卖家的对话记录员。请把【已有摘要】和【新增对话】合并成一段新的摘要，"
+    "保留买家关心的问题、双方报过的价格、议价进展、已承诺的事项（如包邮、发货时间）和买家的偏好，"
+    "省略寒暄。摘要控制在150字以内，只输出摘要本身。"
+)
+
+
+def estimate_tokens(text):
+    """
+    粗略估算文本的token数
+
+    不依赖分词器：中文及全角字符按每字1个token计，其余字符按每4个字符1个token计。
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def message_tokens(message):
+    return estimate_tokens(f"{message['role']}: {message['content']}")
+
+
+class ContextBuilder:
+    """
+    按token预算组装对话上下文
+
+    最近的对话在预算内原样保留，更早的对话由每个(用户, 商品)一份的滚动摘要代替，
+    摘要保存在会话状态中。摘要在后台增量更新：每次只把新移出预算的对话合并进已有摘要，不阻塞回复生成，
+    因此无论对话多长，提示词长度和回复延迟都基本不变。移出预算但尚未进入摘要的对话仍原样保留，
+    上下文最多超出预算约min_batch_tokens，不会丢失对话。
+    """
+
+    def __init__(self, llm_client, conversations, budget=800, min_batch_tokens=100, model="qwen-max"):
+        """
+        初始化上下文组装器
+
+        Args:
+            llm_client: 生成摘要使用的LLMClient
+            conversations: 保存摘要的ConversationStateStore
+            budget: 历史对话（含摘要）的token预算
+            min_batch_tokens: 移出预算的新对话累计达到该token数才更新摘要
+            model: 生成摘要使用的模型
+        """
+        self.llm_client = llm_client
+        self.conversations = conversations
+        self.budget = budget
+        self.min_batch_tokens = min_batch_tokens
+        self.model = model
+        self._tasks = {}     # (user_id, item_id) -> 正在进行的摘要任务
+        self.summary_count = 0
+        self.summary_failures = 0
+
+    def build(self, user_id, item_id, context, state):
+        """
+        在预算内组装上下文
+
+        Args:
+            user_id: 用户ID
+            item_id: 商品ID
+            context: 按ID升序的消息列表，消息带id
+            state: 会话的ConversationState，提供已有摘要
+
+        Returns:
+            list: 摘要消息(role为summary) + 尚未进入摘要的较早对话 + 预算内的最近对话
+        """
+        key = (user_id, item_id)
+        summary, covered_until = state.summary, state.summary_covered_until
+        turns = [m for m in context if m["role"] in ("user", "assistant")]
+
+        remaining = self.budget - estimate_tokens(summary)
+        split = len(turns)
+        while split > 0:
+            cost = message_tokens(turns[split - 1])
+            # 至少保留最新一条消息
+            if cost > remaining and split < len(turns):
+                break
+            remaining -= cost
+            split -= 1
+
+        # 移出预算且尚未进入摘要的对话，累计足够多时在后台合并进摘要
+        pending = [m for m in turns[:split] if m.get("id", 0) > covered_until]
+        if pending and key not in self._tasks:
+            if sum(message_tokens(m) for m in pending) >= self.min_batch_tokens:
+                self._tasks[key] = asyncio.create_task(self._summarize(key, summary, pending))
+
+        messages = [{"role": "summary", "content": summary}] if summary else []
+        # 摘要覆盖之前，这部分对话只能原样保留
+        return messages + pending + turns[split:]
+
+    async def _summarize(self, key, summary, pending):
+        """把新移出预算的对话合并进摘要"""
+        try:
+            dialogue = "\n".join(f"{m['role']}: {m['content']}" for m in pending)
+            new_summary = await self.llm_client.acomplete(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {"role": "user", "content": f"【已有摘要】{summary or '无'}\n【新增对话】\n{dialogue}"},
+                ],
+                temperature=0.2,
+                max_tokens=300,
+            )
+            await self.conversations.set_summary(*key, new_summary.strip(), pending[-1]["id"])
+            self.summary_count += 1
+            logger.debug(f"会话 {key} 摘要已更新，覆盖到消息 {pending[-1]['id']}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.summary_failures += 1
+            logger.warning(f"更新对话摘要失败: {e}")
+        finally:
+            self._tasks.pop(key, None)
+
+    def stats(self):
+        return {
+            "summaries": self.summary_count,
+            "failures": self.summary_failures,
+            "pending": len(self._tasks),
+        }
+
+    async def close(self):
+        """取消进行中的摘要任务"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -1,29 +1,110 @@
+import asyncio
 import sqlite3
 import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from loguru import logger
 
 
+# 数据库结构版本，记录在PRAGMA user_version中，启动时按版本逐步升级旧库
+SCHEMA_VERSION = 3
+
+CONVERSATION_COLUMNS = (
+    "bargain_count", "last_intent", "summary", "summary_covered_until", "item_snapshot", "created_at", "updated_at",
+)
+
+
+class ConversationState:
+    """
+    单个(用户, 商品)会话的状态，对应conversations表的一行
+
+    Attributes:
+        bargain_count: 议价次数
+        last_intent: 最近一次回复的意图
+        summary: 较早对话的滚动摘要
+        summary_covered_until: 摘要已覆盖的最大消息ID
+        item_snapshot: 最近一次回复时的商品描述
+        created_at: 会话创建时间
+        updated_at: 最近更新时间
+    """
+
+    __slots__ = CONVERSATION_COLUMNS
+
+    def __init__(self, bargain_count=0, last_intent=None, summary="", summary_covered_until=0,
+                 item_snapshot=None, created_at=None, updated_at=None):
+        self.bargain_count = bargain_count
+        self.last_intent = last_intent
+        self.summary = summary
+        self.summary_covered_until = summary_covered_until
+        self.item_snapshot = item_snapshot
+        self.created_at = created_at
+        self.updated_at = updated_at
+
+    def to_row(self, user_id, item_id):
+        """conversations表的一行，列顺序与UPSERT_CONVERSATION一致"""
+        return (user_id, item_id, *(getattr(self, name) for name in CONVERSATION_COLUMNS))
+
+
+UPSERT_CONVERSATION = f"""
+INSERT INTO conversations (user_id, item_id, {", ".join(CONVERSATION_COLUMNS)})
+VALUES (?, ?, {", ".join("?" for _ in CONVERSATION_COLUMNS)})
+ON CONFLICT(user_id, item_id) DO UPDATE SET
+{", ".join(f"{name} = excluded.{name}" for name in CONVERSATION_COLUMNS if name != "created_at")}
+"""
+
+
 class ChatContextManager:
     """
     聊天上下文管理器
     
     负责存储和检索用户与商品之间的对话历史，使用SQLite数据库进行持久化存储。
     支持按用户ID和商品ID检索对话历史，以及清理过期的历史记录。
+    每个对话超出max_history的旧消息不在写入时删除，而是由compact()定期批量清理。
     """
     
-    def __init__(self, max_history=100, db_path="data/chat_history.db"):
+    def __init__(self, max_history=100, db_path="data/chat_history.db", synchronous="NORMAL",
+                 mmap_size=64 * 1024 * 1024, cached_statements=128, readonly=False):
         """
         初始化聊天上下文管理器
         
         Args:
             max_history: 每个对话保留的最大消息数
             db_path: SQLite数据库文件路径
+            synchronous: PRAGMA synchronous级别，WAL模式下NORMAL只在检查点时fsync，掉电最多丢失最近的事务
+            mmap_size: 内存映射读取的字节数，0表示不使用
+            cached_statements: 连接缓存的预编译语句数
+            readonly: 只读连接，不创建或升级表结构，供并发读取使用
         """
         self.max_history = max_history
         self.db_path = db_path
+        self.synchronous = synchronous
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+        self.readonly = readonly
+        self.conn = None
+        # 连接在事件循环和工作线程之间共享，同一时刻只允许一个线程使用
+        self._lock = threading.RLock()
+        # 有新消息写入、等待压缩的对话；首次压缩时全库扫描一次
+        self._compact_pending = set()
+        self._compact_all = True
         self._init_db()
         
+    def _connect(self):
+        """打开长连接并设置WAL等参数"""
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+        
     def _init_db(self):
         """初始化数据库表结构"""
         # 确保数据库目录存在
@@ -31,8 +112,11 @@ class ChatContextManager:
         if db_dir and not os.path.exists(db_dir):
             os.makedirs(db_dir)
             
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        self.conn = self._connect()
+        if self.readonly:
+            self.conn.execute("PRAGMA query_only=ON")
+            return
+        cursor = self.conn.cursor()
         
         # 创建消息表
         cursor.execute('''
@@ -46,31 +130,81 @@ class ChatContextManager:
         )
         ''')
         
-        # 创建索引以加速查询
-        cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_user_item ON messages (user_id, item_id)
-        ''')
+        self._migrate(cursor)
         
         cursor.execute('''
         CREATE INDEX IF NOT EXISTS idx_timestamp ON messages (timestamp)
         ''')
         
-        # 创建议价次数表
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS bargain_counts (
-            user_id TEXT NOT NULL,
-            item_id TEXT NOT NULL,
-            count INTEGER DEFAULT 0,
-            last_updated DATETIME DEFAULT CURRENT_TIMESTAMP,
-            PRIMARY KEY (user_id, item_id)
-        )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        self.conn.commit()
         logger.info(f"聊天历史数据库初始化完成: {self.db_path}")
         
-    def add_message(self, user_id, item_id, role, content):
+    def _migrate(self, cursor):
+        """按PRAGMA user_version原地升级旧库"""
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        
+        if version < 1:
+            # 补充意图列，用于训练本地意图分类器
+            cursor.execute("PRAGMA table_info(messages)")
+            if "intent" not in [row[1] for row in cursor.fetchall()]:
+                cursor.execute("ALTER TABLE messages ADD COLUMN intent TEXT")
+        
+        if version < 2:
+            # 按(用户, 商品, ID)建索引，取最近N条和压缩都能直接走索引，不再按timestamp排序
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversation ON messages (user_id, item_id, id)")
+            cursor.execute("DROP INDEX IF EXISTS idx_user_item")
+        
+        if version < 3:
+            # 议价次数、最近意图、摘要等会话状态合并到conversations表，一次读取
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS conversations (
+                user_id TEXT NOT NULL,
+                item_id TEXT NOT NULL,
+                bargain_count INTEGER NOT NULL DEFAULT 0,
+                last_intent TEXT,
+                summary TEXT NOT NULL DEFAULT '',
+                summary_covered_until INTEGER NOT NULL DEFAULT 0,
+                item_snapshot TEXT,
+                created_at DATETIME,
+                updated_at DATETIME,
+                PRIMARY KEY (user_id, item_id)
+            )
+            ''')
+            cursor.execute('''
+            INSERT OR IGNORE INTO conversations (user_id, item_id, created_at, updated_at)
+            SELECT user_id, item_id, MIN(timestamp), MAX(timestamp) FROM messages GROUP BY user_id, item_id
+            ''')
+            cursor.execute('''
+            UPDATE conversations SET last_intent = (
+                SELECT intent FROM messages
+                WHERE messages.user_id = conversations.user_id AND messages.item_id = conversations.item_id
+                AND intent IS NOT NULL
+                ORDER BY id DESC LIMIT 1
+            )
+            ''')
+            tables = {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            if "bargain_counts" in tables:
+                cursor.execute('''
+                INSERT INTO conversations (user_id, item_id, bargain_count, created_at, updated_at)
+                SELECT user_id, item_id, count, last_updated, last_updated FROM bargain_counts WHERE true
+                ON CONFLICT(user_id, item_id) DO UPDATE SET bargain_count = excluded.bargain_count
+                ''')
+                cursor.execute("DROP TABLE bargain_counts")
+            if "conversation_summaries" in tables:
+                cursor.execute('''
+                INSERT INTO conversations (user_id, item_id, summary, summary_covered_until, created_at, updated_at)
+                SELECT user_id, item_id, summary, covered_until, updated_at, updated_at FROM conversation_summaries WHERE true
+                ON CONFLICT(user_id, item_id) DO UPDATE SET
+                summary = excluded.summary, summary_covered_until = excluded.summary_covered_until
+                ''')
+                cursor.execute("DROP TABLE conversation_summaries")
+        
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        logger.info(f"聊天历史数据库结构已从版本 {version} 升级到 {SCHEMA_VERSION}")
+        
+    def add_message(self, user_id, item_id, role, content, intent=None):
         """
         添加新消息到对话历史
         
@@ -79,41 +213,34 @@ class ChatContextManager:
             item_id: 商品ID
             role: 消息角色 (user/assistant)
             content: 消息内容
+            intent: 生成该回复时识别出的意图（仅机器人回复），作为本地意图分类器的标注
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._lock:
+            conn = self.conn
+            cursor = conn.cursor()
         
-        try:
-            # 插入新消息
-            cursor.execute(
-                "INSERT INTO messages (user_id, item_id, role, content, timestamp) VALUES (?, ?, ?, ?, ?)",
-                (user_id, item_id, role, content, datetime.now().isoformat())
-            )
-            
-            # 检查是否需要清理旧消息
-            cursor.execute(
-                """
-                SELECT id FROM messages 
-                WHERE user_id = ? AND item_id = ? 
-                ORDER BY timestamp DESC 
-                LIMIT ?, 1
-                """, 
-                (user_id, item_id, self.max_history)
-            )
-            
-            oldest_to_keep = cursor.fetchone()
-            if oldest_to_keep:
+            try:
+                # 插入新消息
                 cursor.execute(
-                    "DELETE FROM messages WHERE user_id = ? AND item_id = ? AND id < ?",
-                    (user_id, item_id, oldest_to_keep[0])
+                    "INSERT INTO messages (user_id, item_id, role, content, timestamp, intent) VALUES (?, ?, ?, ?, ?, ?)",
+                    (user_id, item_id, role, content, datetime.now().isoformat(), intent)
                 )
-            
-            conn.commit()
-        except Exception as e:
-            logger.error(f"添加消息到数据库时出错: {e}")
-            conn.rollback()
-        finally:
-            conn.close()
+                now = datetime.now().isoformat()
+                cursor.execute(
+                    """
+                    INSERT INTO conversations (user_id, item_id, last_intent, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(user_id, item_id)
+                    DO UPDATE SET last_intent = COALESCE(excluded.last_intent, last_intent), updated_at = excluded.updated_at
+                    """,
+                    (user_id, item_id, intent, now, now)
+                )
+                conn.commit()
+                # 超出max_history的旧消息留给compact()清理
+                self._compact_pending.add((user_id, item_id))
+            except Exception as e:
+                logger.error(f"添加消息到数据库时出错: {e}")
+                conn.rollback()
         
     def increment_bargain_count(self, user_id, item_id):
         """
@@ -122,29 +249,39 @@ class ChatContextManager:
         Args:
             user_id: 用户ID
             item_id: 商品ID
+            
+        Returns:
+            int: 增加后的议价次数，出错时返回0
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._lock:
+            conn = self.conn
+            cursor = conn.cursor()
         
-        try:
-            # 使用UPSERT语法（SQLite 3.24.0及以上版本支持）
-            cursor.execute(
-                """
-                INSERT INTO bargain_counts (user_id, item_id, count, last_updated)
-                VALUES (?, ?, 1, ?)
-                ON CONFLICT(user_id, item_id) 
-                DO UPDATE SET count = count + 1, last_updated = ?
-                """,
-                (user_id, item_id, datetime.now().isoformat(), datetime.now().isoformat())
-            )
+            try:
+                # 使用UPSERT语法（SQLite 3.24.0及以上版本支持）
+                now = datetime.now().isoformat()
+                cursor.execute(
+                    """
+                    INSERT INTO conversations (user_id, item_id, bargain_count, created_at, updated_at)
+                    VALUES (?, ?, 1, ?, ?)
+                    ON CONFLICT(user_id, item_id) 
+                    DO UPDATE SET bargain_count = bargain_count + 1, updated_at = excluded.updated_at
+                    """,
+                    (user_id, item_id, now, now)
+                )
+                cursor.execute(
+                    "SELECT bargain_count FROM conversations WHERE user_id = ? AND item_id = ?",
+                    (user_id, item_id)
+                )
+                count = cursor.fetchone()[0]
             
-            conn.commit()
-            logger.debug(f"用户 {user_id} 商品 {item_id} 议价次数已增加")
-        except Exception as e:
-            logger.error(f"增加议价次数时出错: {e}")
-            conn.rollback()
-        finally:
-            conn.close()
+                conn.commit()
+                logger.debug(f"用户 {user_id} 商品 {item_id} 议价次数已增加")
+                return count
+            except Exception as e:
+                logger.error(f"增加议价次数时出错: {e}")
+                conn.rollback()
+                return 0
     
     def get_bargain_count(self, user_id, item_id):
         """
@@ -157,67 +294,141 @@ class ChatContextManager:
         Returns:
             int: 议价次数
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._lock:
+            conn = self.conn
+            cursor = conn.cursor()
         
-        try:
-            cursor.execute(
-                "SELECT count FROM bargain_counts WHERE user_id = ? AND item_id = ?",
-                (user_id, item_id)
-            )
+            try:
+                cursor.execute(
+                    "SELECT bargain_count FROM conversations WHERE user_id = ? AND item_id = ?",
+                    (user_id, item_id)
+                )
             
-            result = cursor.fetchone()
-            return result[0] if result else 0
-        except Exception as e:
-            logger.error(f"获取议价次数时出错: {e}")
-            return 0
-        finally:
-            conn.close()
+                result = cursor.fetchone()
+                return result[0] if result else 0
+            except Exception as e:
+                logger.error(f"获取议价次数时出错: {e}")
+                return 0
         
     def get_context(self, user_id, item_id):
         """
-        获取特定用户和商品的对话历史
+        在同一个读事务中获取特定用户和商品的对话历史和会话状态
         
         Args:
             user_id: 用户ID
             item_id: 商品ID
             
         Returns:
-            list: 包含对话历史的列表
+            tuple: (按ID升序的最近消息列表, ConversationState)，消息带id、role、content和intent；
+                会话不存在时返回空列表和默认状态
+        """
+        with self._lock:
+            conn = self.conn
+            try:
+                conn.execute("BEGIN")
+                try:
+                    # 压缩前对话可能超出max_history，按ID倒序取最近的消息
+                    rows = conn.execute(
+                        """
+                        SELECT id, role, content, intent FROM messages 
+                        WHERE user_id = ? AND item_id = ? 
+                        ORDER BY id DESC
+                        LIMIT ?
+                        """, 
+                        (user_id, item_id, self.max_history)
+                    ).fetchall()
+                    row = conn.execute(
+                        f"SELECT {', '.join(CONVERSATION_COLUMNS)} FROM conversations WHERE user_id = ? AND item_id = ?",
+                        (user_id, item_id)
+                    ).fetchone()
+                finally:
+                    conn.execute("COMMIT")
+            except Exception as e:
+                logger.error(f"获取对话历史时出错: {e}")
+                return [], ConversationState()
+        
+        messages = [
+            {"id": id, "role": role, "content": content, "intent": intent}
+            for id, role, content, intent in reversed(rows)
+        ]
+        return messages, ConversationState(*row) if row else ConversationState()
+    
+    def max_message_id(self):
+        """当前最大的消息ID，用于在内存中预分配新消息的ID"""
+        with self._lock:
+            return self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+
+    def write_batch(self, messages, conversations):
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        在一个事务中批量写入
         
-        try:
-            cursor.execute(
-                """
-                SELECT role, content FROM messages 
-                WHERE user_id = ? AND item_id = ? 
-                ORDER BY timestamp ASC
-                LIMIT ?
-                """, 
-                (user_id, item_id, self.max_history)
-            )
+        Args:
+            messages: [(id, user_id, item_id, role, content, timestamp, intent)]
+            conversations: [ConversationState.to_row()]，整行写入会话状态（创建时间只在首次写入）
+        """
+        with self._lock:
+            with self.conn as conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO messages (id, user_id, item_id, role, content, timestamp, intent) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    messages
+                )
+                conn.executemany(UPSERT_CONVERSATION, conversations)
+            self._compact_pending.update((user_id, item_id) for _, user_id, item_id, *_ in messages)
+
+    def compact(self, max_conversations=500):
+        """
+        删除各对话中超出max_history的旧消息
+        
+        只处理上次压缩后有新消息写入的对话，每个对话通过idx_conversation定位第max_history
+        新的消息后按ID范围删除。首次调用时全库扫描一次，处理旧库和max_history调小的情况。
+        
+        Args:
+            max_conversations: 本次最多处理的对话数，其余留到下一次
             
-            messages = [{"role": role, "content": content} for role, content in cursor.fetchall()]
+        Returns:
+            int: 删除的消息数
+        """
+        with self._lock:
+            if self._compact_all:
+                rows = self.conn.execute(
+                    "SELECT user_id, item_id FROM messages GROUP BY user_id, item_id HAVING COUNT(*) > ?",
+                    (self.max_history,)
+                ).fetchall()
+                self._compact_pending.update(rows)
+                self._compact_all = False
             
-            # 获取议价次数并添加到上下文中
-            bargain_count = self.get_bargain_count(user_id, item_id)
-            if bargain_count > 0:
-                # 添加一条系统消息，包含议价次数信息
-                messages.append({
-                    "role": "system", 
-                    "content": f"议价次数: {bargain_count}"
-                })
+            keys = []
+            while self._compact_pending and len(keys) < max_conversations:
+                keys.append(self._compact_pending.pop())
             
-        except Exception as e:
-            logger.error(f"获取对话历史时出错: {e}")
-            messages = []
-        finally:
-            conn.close()
-        
-        return messages
-    
+            deleted = 0
+            try:
+                with self.conn as conn:
+                    for user_id, item_id in keys:
+                        row = conn.execute(
+                            """
+                            SELECT id FROM messages
+                            WHERE user_id = ? AND item_id = ?
+                            ORDER BY id DESC
+                            LIMIT 1 OFFSET ?
+                            """,
+                            (user_id, item_id, self.max_history - 1)
+                        ).fetchone()
+                        if row:
+                            deleted += conn.execute(
+                                "DELETE FROM messages WHERE user_id = ? AND item_id = ? AND id < ?",
+                                (user_id, item_id, row[0])
+                            ).rowcount
+            except Exception as e:
+                logger.error(f"压缩对话历史时出错: {e}")
+                self._compact_pending.update(keys)
+                return 0
+        
+        if deleted:
+            logger.debug(f"已压缩 {len(keys)} 个对话，删除 {deleted} 条旧消息")
+        return deleted
+
     def get_user_items(self, user_id):
         """
         获取用户交互过的所有商品ID
@@ -228,21 +439,20 @@ class ChatContextManager:
         Returns:
             list: 商品ID列表
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._lock:
+            conn = self.conn
+            cursor = conn.cursor()
         
-        try:
-            cursor.execute(
-                "SELECT DISTINCT item_id FROM messages WHERE user_id = ?", 
-                (user_id,)
-            )
+            try:
+                cursor.execute(
+                    "SELECT DISTINCT item_id FROM messages WHERE user_id = ?", 
+                    (user_id,)
+                )
             
-            items = [item[0] for item in cursor.fetchall()]
-        except Exception as e:
-            logger.error(f"获取用户商品列表时出错: {e}")
-            items = []
-        finally:
-            conn.close()
+                items = [item[0] for item in cursor.fetchall()]
+            except Exception as e:
+                logger.error(f"获取用户商品列表时出错: {e}")
+                items = []
         
         return items
     
@@ -256,26 +466,25 @@ class ChatContextManager:
         Returns:
             list: 用户ID列表
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._lock:
+            conn = self.conn
+            cursor = conn.cursor()
         
-        try:
-            cursor.execute(
-                """
-                SELECT DISTINCT user_id FROM messages 
-                GROUP BY user_id
-                ORDER BY MAX(timestamp) DESC
-                LIMIT ?
-                """, 
-                (limit,)
-            )
+            try:
+                cursor.execute(
+                    """
+                    SELECT DISTINCT user_id FROM messages 
+                    GROUP BY user_id
+                    ORDER BY MAX(timestamp) DESC
+                    LIMIT ?
+                    """, 
+                    (limit,)
+                )
             
-            users = [user[0] for user in cursor.fetchall()]
-        except Exception as e:
-            logger.error(f"获取最近用户列表时出错: {e}")
-            users = []
-        finally:
-            conn.close()
+                users = [user[0] for user in cursor.fetchall()]
+            except Exception as e:
+                logger.error(f"获取最近用户列表时出错: {e}")
+                users = []
         
         return users
     
@@ -289,42 +498,41 @@ class ChatContextManager:
         Returns:
             dict: 包含用户统计信息的字典
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._lock:
+            conn = self.conn
+            cursor = conn.cursor()
         
-        try:
-            # 获取用户消息总数
-            cursor.execute(
-                "SELECT COUNT(*) FROM messages WHERE user_id = ?", 
-                (user_id,)
-            )
-            total_messages = cursor.fetchone()[0]
+            try:
+                # 获取用户消息总数
+                cursor.execute(
+                    "SELECT COUNT(*) FROM messages WHERE user_id = ?", 
+                    (user_id,)
+                )
+                total_messages = cursor.fetchone()[0]
             
-            # 获取用户交互的商品数
-            cursor.execute(
-                "SELECT COUNT(DISTINCT item_id) FROM messages WHERE user_id = ?", 
-                (user_id,)
-            )
-            total_items = cursor.fetchone()[0]
+                # 获取用户交互的商品数
+                cursor.execute(
+                    "SELECT COUNT(DISTINCT item_id) FROM messages WHERE user_id = ?", 
+                    (user_id,)
+                )
+                total_items = cursor.fetchone()[0]
             
-            # 获取用户最早和最近的消息时间
-            cursor.execute(
-                "SELECT MIN(timestamp), MAX(timestamp) FROM messages WHERE user_id = ?", 
-                (user_id,)
-            )
-            first_time, last_time = cursor.fetchone()
+                # 获取用户最早和最近的消息时间
+                cursor.execute(
+                    "SELECT MIN(timestamp), MAX(timestamp) FROM messages WHERE user_id = ?", 
+                    (user_id,)
+                )
+                first_time, last_time = cursor.fetchone()
             
-            stats = {
-                "total_messages": total_messages,
-                "total_items": total_items,
-                "first_interaction": first_time,
-                "last_interaction": last_time
-            }
-        except Exception as e:
-            logger.error(f"获取用户统计信息时出错: {e}")
-            stats = {}
-        finally:
-            conn.close()
+                stats = {
+                    "total_messages": total_messages,
+                    "total_items": total_items,
+                    "first_interaction": first_time,
+                    "last_interaction": last_time
+                }
+            except Exception as e:
+                logger.error(f"获取用户统计信息时出错: {e}")
+                stats = {}
         
         return stats
     
@@ -335,26 +543,25 @@ class ChatContextManager:
         Args:
             days_to_keep: 保留多少天的历史
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._lock:
+            conn = self.conn
+            cursor = conn.cursor()
         
-        try:
-            cursor.execute(
-                """
-                DELETE FROM messages 
-                WHERE timestamp < datetime('now', '-' || ? || ' days')
-                """, 
-                (days_to_keep,)
-            )
+            try:
+                cursor.execute(
+                    """
+                    DELETE FROM messages 
+                    WHERE timestamp < datetime('now', '-' || ? || ' days')
+                    """, 
+                    (days_to_keep,)
+                )
             
-            deleted_count = cursor.rowcount
-            conn.commit()
-            logger.info(f"已清理 {deleted_count} 条历史消息记录")
-        except Exception as e:
-            logger.error(f"清理历史记录时出错: {e}")
-            conn.rollback()
-        finally:
-            conn.close()
+                deleted_count = cursor.rowcount
+                conn.commit()
+                logger.info(f"已清理 {deleted_count} 条历史消息记录")
+            except Exception as e:
+                logger.error(f"清理历史记录时出错: {e}")
+                conn.rollback()
     
     def backup_database(self, backup_path=None):
         """
@@ -375,16 +582,164 @@ class ChatContextManager:
         
         try:
             # 使用SQLite的备份API
-            source_conn = sqlite3.connect(self.db_path)
             dest_conn = sqlite3.connect(backup_path)
             
-            source_conn.backup(dest_conn)
+            with self._lock:
+                self.conn.backup(dest_conn)
             
-            source_conn.close()
             dest_conn.close()
             
             logger.info(f"数据库已备份到: {backup_path}")
             return backup_path
         except Exception as e:
             logger.error(f"备份数据库时出错: {e}")
-            return None 
\ No newline at end of file
+            return None
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+
+class AsyncChatContextManager:
+    """
+    ChatContextManager的异步封装
+
+    写操作全部提交到一个专用的数据库线程串行执行；读操作在独立的读线程池中执行，
+    每个读线程持有自己的只读连接，WAL模式下读取与写入互不阻塞。事件循环只等待结果，
+    慢fsync或大表清理不会卡住websocket。
+    """
+
+    def __init__(self, manager, read_workers=4, latency_window=1000):
+        """
+        初始化异步封装
+
+        Args:
+            manager: 负责写入的ChatContextManager，只在数据库线程中使用
+            read_workers: 读线程数
+            latency_window: 每种操作保留的最近耗时样本数
+        """
+        self.manager = manager
+        self.db_path = manager.db_path
+        self.max_history = manager.max_history
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix="chat-db-reader")
+        self._local = threading.local()
+        self._reader_managers = []
+        self._reader_lock = threading.Lock()
+
+        self.pending = {"write": 0, "read": 0}
+        self.max_depth = {"write": 0, "read": 0}
+        self.latencies = defaultdict(lambda: deque(maxlen=latency_window))  # 操作名 -> 最近耗时
+        self.counts = defaultdict(int)
+        self.errors = defaultdict(int)
+
+    def _reader(self):
+        """当前读线程的只读连接"""
+        reader = getattr(self._local, "manager", None)
+        if reader is None:
+            reader = self._local.manager = ChatContextManager(
+                max_history=self.manager.max_history,
+                db_path=self.manager.db_path,
+                synchronous=self.manager.synchronous,
+                mmap_size=self.manager.mmap_size,
+                cached_statements=self.manager.cached_statements,
+                readonly=True,
+            )
+            with self._reader_lock:
+                self._reader_managers.append(reader)
+        return reader
+
+    def _call_reader(self, name, args):
+        return getattr(self._reader(), name)(*args)
+
+    async def _run(self, kind, name, func, *args):
+        """提交到对应线程执行，记录队列深度和从提交到完成的耗时"""
+        executor = self._writer if kind == "write" else self._readers
+        self.pending[kind] += 1
+        self.max_depth[kind] = max(self.max_depth[kind], self.pending[kind])
+        started = time.monotonic()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+        except Exception:
+            self.errors[name] += 1
+            raise
+        finally:
+            self.pending[kind] -= 1
+            self.counts[name] += 1
+            self.latencies[name].append(time.monotonic() - started)
+
+    def _write(self, name, *args):
+        return self._run("write", name, getattr(self.manager, name), *args)
+
+    async def submit(self, name, func, *args):
+        """在数据库写线程中执行任意写操作，与聊天记录的写入串行，并计入同样的指标"""
+        return await self._run("write", name, func, *args)
+
+    def _read(self, name, *args):
+        return self._run("read", name, self._call_reader, name, args)
+
+    async def add_message(self, user_id, item_id, role, content, intent=None):
+        return await self._write("add_message", user_id, item_id, role, content, intent)
+
+    async def increment_bargain_count(self, user_id, item_id):
+        return await self._write("increment_bargain_count", user_id, item_id)
+
+    async def write_batch(self, messages, conversations):
+        return await self._write("write_batch", messages, conversations)
+
+    async def compact(self, max_conversations=500):
+        return await self._write("compact", max_conversations)
+
+    async def clear_history(self, days_to_keep=30):
+        return await self._write("clear_history", days_to_keep)
+
+    async def backup_database(self, backup_path=None):
+        return await self._write("backup_database", backup_path)
+
+    async def get_context(self, user_id, item_id):
+        return await self._read("get_context", user_id, item_id)
+
+    async def get_bargain_count(self, user_id, item_id):
+        return await self._read("get_bargain_count", user_id, item_id)
+
+    async def get_user_items(self, user_id):
+        return await self._read("get_user_items", user_id)
+
+    async def get_recent_users(self, limit=100):
+        return await self._read("get_recent_users", limit)
+
+    async def get_user_stats(self, user_id):
+        return await self._read("get_user_stats", user_id)
+
+    def stats(self):
+        """获取队列深度和各操作的耗时分布"""
+        operations = {}
+        for name, samples in self.latencies.items():
+            latencies = sorted(samples)
+            operations[name] = {
+                "count": self.counts[name],
+                "errors": self.errors[name],
+                "p50": latencies[len(latencies) // 2] if latencies else None,
+                "p95": latencies[int(len(latencies) * 0.95)] if latencies else None,
+                "max": latencies[-1] if latencies else None,
+            }
+        return {
+            "write_queue": self.pending["write"],
+            "read_queue": self.pending["read"],
+            "max_write_queue": self.max_depth["write"],
+            "max_read_queue": self.max_depth["read"],
+            "operations": operations,
+        }
+
+    async def close(self):
+        """等待已提交的操作完成后关闭线程和全部连接"""
+        await asyncio.to_thread(self._readers.shutdown, wait=True)
+        await asyncio.to_thread(self._writer.shutdown, wait=True)
+        with self._reader_lock:
+            readers, self._reader_managers = self._reader_managers, []
+        for reader in readers:
+            reader.close()
+        self.manager.close()
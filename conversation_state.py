@@ -0,0 +1,265 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from loguru import logger
+
+
+class CachedConversation:
+    """单个(用户, 商品)会话在内存中的最近消息和状态"""
+
+    __slots__ = ("messages", "state")
+
+    def __init__(self, messages, state, max_history):
+        self.messages = deque(messages, maxlen=max_history)
+        self.state = state
+
+
+class ConversationStateStore:
+    """
+    会话状态缓存
+
+    每个会话的最近消息和ConversationState常驻内存，读取不做任何I/O；
+    写入先改内存，再由后台任务按固定间隔批量写入SQLite（write-behind），
+    关闭时保证把尚未写入的数据全部落盘。同一后台任务还定期压缩数据库中超出
+    max_history的旧消息，并调用flushers中登记的其他批量写入（如消息去重记录）。
+    """
+
+    def __init__(self, db, flush_interval=1.0, max_conversations=5000, compact_interval=60.0):
+        """
+        初始化会话状态缓存
+
+        Args:
+            db: 负责持久化的AsyncChatContextManager
+            flush_interval: 批量写入数据库的间隔（秒）
+            max_conversations: 内存中最多保留的会话数，超出时淘汰最久未使用的会话
+            compact_interval: 压缩数据库中旧消息的间隔（秒）
+        """
+        self.db = db
+        self.max_history = db.max_history
+        self.flush_interval = flush_interval
+        self.max_conversations = max_conversations
+        self.compact_interval = compact_interval
+        self.states = OrderedDict()  # (user_id, item_id) -> CachedConversation
+
+        # 新消息的ID在内存中预分配，摘要等依赖ID的逻辑无需等待落盘
+        self.next_id = db.manager.max_message_id() + 1
+        self.pending_messages = []
+        self.dirty = set()  # 会话状态有变化、需要写入的会话
+        self.flushing = set()  # 所在批次正在写入、尚未提交的会话
+        self.unsaved_rows = {}  # 已淘汰会话写入失败后保留的状态行，下一批重试
+
+        self.flushers = []  # 每轮批量写入后一并调用的协程函数
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.flush_count = 0
+        self.rows_written = 0
+        self.last_flush_time = None
+        self.compacted_rows = 0
+
+    async def _conversation(self, user_id, item_id):
+        key = (user_id, item_id)
+        conversation = self.states.get(key)
+        if conversation is not None:
+            self.states.move_to_end(key)
+            self.hits += 1
+            return conversation
+
+        self.misses += 1
+        if key in self.unsaved_rows:
+            # 数据库中还是旧状态，先写入再加载
+            await self.aflush()
+        messages, state = await self.db.get_context(user_id, item_id)
+        # 等待加载期间可能已有其他消息加载了同一会话，以先加载的为准
+        conversation = self.states.get(key)
+        if conversation is not None:
+            return conversation
+        if state.created_at is None:
+            state.created_at = datetime.now().isoformat()
+        conversation = self.states[key] = CachedConversation(messages, state, self.max_history)
+        while len(self.states) > self.max_conversations:
+            oldest = next(iter(self.states))
+            if self._unsaved(oldest):
+                # 淘汰前先落盘并等待提交，之后重新加载时才能从数据库读到完整状态
+                await self.aflush()
+                # 落盘期间可能有新的写入（或写入失败），仍未提交时暂不淘汰
+                if self._unsaved(oldest):
+                    break
+                # 等待期间最旧的会话可能已变化，重新检查
+                continue
+            self.states.pop(oldest)
+        return conversation
+
+    def _unsaved(self, key):
+        """会话有未写入或尚未提交的状态"""
+        return key in self.dirty or key in self.flushing
+
+    def _touch(self, user_id, item_id, state):
+        state.updated_at = datetime.now().isoformat()
+        self.dirty.add((user_id, item_id))
+
+    async def add_message(self, user_id, item_id, role, content, intent=None):
+        """添加消息，立即对读取可见，稍后批量写入数据库"""
+        conversation = await self._conversation(user_id, item_id)
+        message_id = self.next_id
+        self.next_id += 1
+        conversation.messages.append({"id": message_id, "role": role, "content": content, "intent": intent})
+        if intent:
+            conversation.state.last_intent = intent
+        self.pending_messages.append(
+            (message_id, user_id, item_id, role, content, datetime.now().isoformat(), intent)
+        )
+        self._touch(user_id, item_id, conversation.state)
+
+    async def increment_bargain_count(self, user_id, item_id):
+        state = (await self._conversation(user_id, item_id)).state
+        state.bargain_count += 1
+        self._touch(user_id, item_id, state)
+        return state.bargain_count
+
+    async def set_summary(self, user_id, item_id, summary, covered_until):
+        """更新滚动摘要及其覆盖到的消息ID"""
+        state = (await self._conversation(user_id, item_id)).state
+        state.summary = summary
+        state.summary_covered_until = covered_until
+        self._touch(user_id, item_id, state)
+
+    async def set_item_snapshot(self, user_id, item_id, item_desc):
+        """记录回复时的商品描述，未变化时不写入"""
+        state = (await self._conversation(user_id, item_id)).state
+        if state.item_snapshot != item_desc:
+            state.item_snapshot = item_desc
+            self._touch(user_id, item_id, state)
+
+    async def get_state(self, user_id, item_id):
+        return (await self._conversation(user_id, item_id)).state
+
+    async def get_context(self, user_id, item_id):
+        """
+        返回会话的最近消息和状态
+
+        Returns:
+            tuple: (按ID升序的消息列表, ConversationState)，状态对象由缓存持有，调用方只读
+        """
+        conversation = await self._conversation(user_id, item_id)
+        messages = [{"id": m["id"], "role": m["role"], "content": m["content"]} for m in conversation.messages]
+        return messages, conversation.state
+
+    def _take_batch(self):
+        """取出待写入的数据，之后的新写入进入下一批"""
+        messages, self.pending_messages = self.pending_messages, []
+        dirty, self.dirty = self.dirty, set()
+        rows, self.unsaved_rows = self.unsaved_rows, {}
+        for key in dirty:
+            conversation = self.states.get(key)
+            if conversation is not None:
+                rows[key] = conversation.state.to_row(*key)
+        # 提交之前这些会话不能被淘汰，否则重新加载会读到旧状态
+        self.flushing = set(rows)
+        return messages, list(rows.values())
+
+    def _record_write(self, batch, started):
+        messages, conversations = batch
+        self.flush_count += 1
+        self.rows_written += len(messages) + len(conversations)
+        self.last_flush_time = time.monotonic() - started
+
+    def _restore(self, batch):
+        """写入失败时把数据放回队列，下次重试"""
+        messages, conversations = batch
+        self.pending_messages[:0] = messages
+        for row in conversations:
+            key = (row[0], row[1])
+            if key in self.states:
+                self.dirty.add(key)
+            else:
+                self.unsaved_rows.setdefault(key, row)
+
+    def flush(self):
+        """在当前线程同步写入所有未落盘的数据，用于事件循环已停止时"""
+        if not self.pending_messages and not self.dirty and not self.unsaved_rows:
+            return
+        batch = self._take_batch()
+        started = time.monotonic()
+        try:
+            self.db.manager.write_batch(*batch)
+            self._record_write(batch, started)
+        except Exception as e:
+            logger.error(f"写入会话状态失败: {e}")
+            self._restore(batch)
+        finally:
+            self.flushing = set()
+
+    async def aflush(self):
+        """由数据库线程写入未落盘的数据，不阻塞事件循环"""
+        async with self._flush_lock:
+            if not self.pending_messages and not self.dirty and not self.unsaved_rows:
+                return
+            batch = self._take_batch()
+            started = time.monotonic()
+            try:
+                await self.db.write_batch(*batch)
+                self._record_write(batch, started)
+            except Exception as e:
+                logger.error(f"写入会话状态失败: {e}")
+                self._restore(batch)
+            finally:
+                self.flushing = set()
+
+    async def acompact(self):
+        """由数据库线程压缩数据库中的旧消息"""
+        async with self._flush_lock:
+            try:
+                self.compacted_rows += await self.db.compact()
+            except Exception as e:
+                logger.error(f"压缩对话历史失败: {e}")
+
+    async def _run_flushers(self):
+        for flusher in self.flushers:
+            try:
+                await flusher()
+            except Exception as e:
+                logger.error(f"批量写入失败: {e}")
+
+    async def _flush_loop(self):
+        last_compact = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.aflush()
+            await self._run_flushers()
+            if time.monotonic() - last_compact >= self.compact_interval:
+                last_compact = time.monotonic()
+                await self.acompact()
+
+    def start(self):
+        """启动后台批量写入任务"""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """停止后台任务并写入全部未落盘的数据"""
+        if self._flush_task:
+            # 持锁取消，避免打断正在线程中进行的写入
+            async with self._flush_lock:
+                self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.aflush()
+        await self._run_flushers()
+
+    def stats(self):
+        return {
+            "conversations": len(self.states),
+            "hits": self.hits,
+            "misses": self.misses,
+            "pending_messages": len(self.pending_messages),
+            "flushes": self.flush_count,
+            "rows_written": self.rows_written,
+            "last_flush_time": self.last_flush_time,
+            "compacted_rows": self.compacted_rows,
+        }
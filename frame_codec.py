@@ -0,0 +1,97 @@
+"""
+websocket帧编解码
+
+优先使用orjson（未安装时回退到标准库json），ACK和发送消息帧由预先序列化好的模板拼接，
+避免每次都构建嵌套字典再整体序列化。
+"""
+import base64
+import json
+
+from utils.xianyu_utils import generate_mid, generate_uuid
+
+try:
+    import orjson
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode("utf-8")
+
+    loads = orjson.loads
+    JSONDecodeError = orjson.JSONDecodeError
+except ImportError:  # pragma: no cover - 取决于运行环境
+    def dumps(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+    loads = json.loads
+    JSONDecodeError = json.JSONDecodeError
+
+
+# ACK需要回带的header字段
+ACK_HEADER_KEYS = ("app-key", "ua", "dt")
+
+
+def build_ack(frame):
+    """
+    为收到的帧构建ACK，帧中没有mid时返回None
+
+    Args:
+        frame: 已解析的入站帧
+
+    Returns:
+        str: 序列化后的ACK帧
+    """
+    headers = frame.get("headers")
+    if not isinstance(headers, dict) or "mid" not in headers:
+        return None
+    ack_headers = {"mid": headers["mid"], "sid": headers.get("sid", "")}
+    for key in ACK_HEADER_KEYS:
+        if key in headers:
+            ack_headers[key] = headers[key]
+    return dumps({"code": 200, "headers": ack_headers})
+
+
+def build_heartbeat(mid):
+    """构建心跳帧"""
+    return '{"lwp":"/!","headers":{"mid":%s}}' % dumps(mid)
+
+
+class SendFrameBuilder:
+    """
+    sendByReceiverScope消息帧构建器
+
+    帧中不变的部分在初始化时序列化一次，发送时只填入mid、uuid、会话、接收方和文本。
+    """
+
+    _TEXT_TEMPLATE = '{"contentType":1,"text":{"text":%s}}'
+
+    def __init__(self, myid):
+        self.myid = myid
+        self._template = (
+            '{"lwp":"/r/MessageSend/sendByReceiverScope","headers":{"mid":%s},'
+            '"body":[{"uuid":%s,"cid":%s,"conversationType":1,'
+            '"content":{"contentType":101,"custom":{"type":1,"data":"%s"}},'
+            '"redPointPolicy":0,"extension":{"extJson":"{}"},'
+            '"ctx":{"appVersion":"1.0","platform":"web"},"mtags":{},"msgReadStatusSetting":1},'
+            '{"actualReceivers":[%s,' + dumps(f"{myid}@goofish").replace("%", "%%") + ']}]}'
+        )
+
+    def build(self, cid, toid, text):
+        """
+        构建发送文本消息的帧
+
+        Args:
+            cid: 会话ID（不含@goofish）
+            toid: 接收方用户ID
+            text: 消息文本
+
+        Returns:
+            str: 序列化后的消息帧
+        """
+        content = (self._TEXT_TEMPLATE % dumps(text)).encode("utf-8")
+        data = base64.b64encode(content).decode("ascii")
+        return self._template % (
+            dumps(generate_mid()),
+            dumps(generate_uuid()),
+            dumps(f"{cid}@goofish"),
+            data,
+            dumps(f"{toid}@goofish"),
+        )
@@ -0,0 +1,265 @@
+"""
+本地意图分类器
+
+用聊天记录库中已标注意图的历史消息训练一个字符n-gram朴素贝叶斯模型，规则未命中时
+先用它判断意图，置信度足够高就不再调用大模型分类。训练和推理都只用CPU，不需要网络。
+
+标注来自线上路由：每条机器人回复在messages表中记录了当时的意图，与它前面的那条
+用户消息组成一个训练样本。
+
+用法:
+    python intent_classifier.py train --db data/chat_history.db [--db ...] [--out data/intent_model.json]
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sqlite3
+import time
+from collections import Counter, defaultdict
+from loguru import logger
+
+from intent_matcher import clean_text
+
+
+DEFAULT_MODEL_PATH = os.path.join("data", "intent_model.json")
+
+
+def char_ngrams(text, n_min=1, n_max=3):
+    """提取清洗后文本的字符n-gram"""
+    text = clean_text(text)
+    grams = []
+    for n in range(n_min, n_max + 1):
+        grams.extend(text[i:i + n] for i in range(len(text) - n + 1))
+    return grams
+
+
+def load_samples(db_path):
+    """
+    从聊天记录库读取训练样本
+
+    Returns:
+        list: [(用户消息, 意图)]
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(
+            """
+            SELECT user_id, item_id, role, content, intent FROM messages
+            ORDER BY user_id, item_id, id
+            """
+        ).fetchall()
+    finally:
+        conn.close()
+
+    samples = []
+    previous = None
+    for user_id, item_id, role, content, intent in rows:
+        if (
+            role == "assistant" and intent and previous is not None
+            and previous[0] == user_id and previous[1] == item_id and previous[2] == "user"
+        ):
+            samples.append((previous[3], intent))
+        previous = (user_id, item_id, role, content)
+    return samples
+
+
+class NaiveBayesModel:
+    """多项式朴素贝叶斯，特征为字符n-gram"""
+
+    def __init__(self, classes=None, priors=None, weights=None, unknown=None, n_max=3):
+        self.classes = classes or []
+        self.priors = priors or {}      # 类别 -> log先验
+        self.weights = weights or {}    # n-gram -> {类别: log似然}
+        self.unknown = unknown or {}    # 类别 -> 未见过的n-gram的log似然
+        self.n_max = n_max
+
+    @classmethod
+    def fit(cls, samples, alpha=1.0, n_max=3, min_count=1):
+        """
+        训练模型
+
+        Args:
+            samples: [(文本, 意图)]
+            alpha: 拉普拉斯平滑系数
+            min_count: 出现次数少于该值的n-gram不进入词表
+        """
+        class_counts = Counter(intent for _, intent in samples)
+        feature_counts = defaultdict(Counter)  # 类别 -> n-gram计数
+        for text, intent in samples:
+            feature_counts[intent].update(char_ngrams(text, n_max=n_max))
+
+        total = Counter()
+        for counts in feature_counts.values():
+            total.update(counts)
+        vocab = [gram for gram, count in total.items() if count >= min_count]
+
+        classes = sorted(class_counts)
+        priors = {c: math.log(class_counts[c] / len(samples)) for c in classes}
+        unknown = {}
+        weights = defaultdict(dict)
+        for c in classes:
+            denominator = sum(feature_counts[c][gram] for gram in vocab) + alpha * (len(vocab) + 1)
+            unknown[c] = math.log(alpha / denominator)
+            for gram in vocab:
+                count = feature_counts[c][gram]
+                if count:
+                    weights[gram][c] = math.log((count + alpha) / denominator)
+        return cls(classes, priors, dict(weights), unknown, n_max)
+
+    def predict_proba(self, text, min_features=1):
+        """
+        返回各类别的后验概率
+
+        词表内的n-gram少于min_features时返回None：此时后验几乎就是先验，
+        不能作为判断意图的依据。
+        """
+        scores = dict(self.priors)
+        features = 0
+        for gram in char_ngrams(text, n_max=self.n_max):
+            row = self.weights.get(gram)
+            if row is None:
+                continue  # 词表外的n-gram对所有类别一视同仁，直接跳过
+            features += 1
+            for c in self.classes:
+                scores[c] += row.get(c, self.unknown[c])
+        if features < max(min_features, 1):
+            return None
+        top = max(scores.values())
+        exp = {c: math.exp(score - top) for c, score in scores.items()}
+        total = sum(exp.values())
+        return {c: value / total for c, value in exp.items()}
+
+    def predict(self, text, min_features=1):
+        """返回(意图, 置信度)，证据不足时返回(None, 0.0)"""
+        proba = self.predict_proba(text, min_features)
+        if proba is None:
+            return None, 0.0
+        intent = max(proba, key=proba.get)
+        return intent, proba[intent]
+
+    def to_dict(self):
+        return {
+            "classes": self.classes, "priors": self.priors, "weights": self.weights,
+            "unknown": self.unknown, "n_max": self.n_max,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["classes"], data["priors"], data["weights"], data["unknown"], data.get("n_max", 3))
+
+
+class IntentClassifier:
+    """
+    本地意图分类器
+
+    加载训练好的模型文件，只返回置信度不低于阈值、且词表内特征足够多的预测。
+    模型文件被重新训练后自动加载。
+    """
+
+    def __init__(self, model_path=DEFAULT_MODEL_PATH, threshold=0.8, check_interval=30.0, min_features=2):
+        """
+        初始化分类器
+
+        Args:
+            model_path: 模型文件路径，文件不存在时不做预测
+            threshold: 采用本地预测的最低置信度
+            check_interval: 检查模型文件是否更新的最小间隔（秒）
+            min_features: 采用本地预测所需的最少词表内n-gram数，不足时交给大模型
+        """
+        self.model_path = model_path
+        self.threshold = threshold
+        self.min_features = min_features
+        self.check_interval = check_interval
+        self.model = None
+        self.mtime = None
+        self.last_check = 0
+        self.reload()
+
+    def reload(self):
+        """模型文件有变化时重新加载"""
+        self.last_check = time.monotonic()
+        try:
+            mtime = os.path.getmtime(self.model_path)
+        except OSError:
+            return False
+        if mtime == self.mtime:
+            return False
+
+        self.mtime = mtime
+        try:
+            with open(self.model_path, "r", encoding="utf-8") as f:
+                self.model = NaiveBayesModel.from_dict(json.load(f))
+        except Exception as e:
+            logger.error(f"加载意图模型失败: {e}")
+            return False
+        logger.info(f"已加载本地意图模型: {self.model_path}，类别: {self.model.classes}")
+        return True
+
+    def predict(self, text):
+        """置信度达到阈值时返回意图，否则返回None"""
+        if time.monotonic() - self.last_check >= self.check_interval:
+            self.reload()
+        if self.model is None:
+            return None
+        intent, confidence = self.model.predict(text, self.min_features)
+        if intent is None or confidence < self.threshold:
+            return None
+        logger.debug(f"本地模型识别意图: {intent} ({confidence:.2f})")
+        return intent
+
+
+def evaluate(model, samples, thresholds=(0.6, 0.7, 0.8, 0.9, 0.95), min_features=2):
+    """输出各阈值下本地模型接管的比例及其准确率"""
+    predictions = [(model.predict(text, min_features), intent) for text, intent in samples]
+    for threshold in thresholds:
+        covered = [(pred, truth) for (pred, confidence), truth in predictions if confidence >= threshold]
+        accuracy = sum(1 for pred, truth in covered if pred == truth) / len(covered) if covered else 0
+        logger.info(f"阈值 {threshold:.2f}: 覆盖 {len(covered) / len(samples):.1%}，准确率 {accuracy:.1%}")
+
+
+def train(db_paths, out_path, holdout=0.2, min_samples=50, seed=42):
+    """训练模型并写入模型文件，样本不足时不覆盖已有模型"""
+    samples = []
+    for db_path in db_paths:
+        samples.extend(load_samples(db_path))
+    logger.info(f"共读取 {len(samples)} 条样本，分布: {dict(Counter(intent for _, intent in samples))}")
+    if len(samples) < min_samples:
+        logger.error(f"样本数少于 {min_samples}，未生成模型")
+        return None
+
+    random.Random(seed).shuffle(samples)
+    split = int(len(samples) * (1 - holdout))
+    if holdout and split < len(samples):
+        evaluate(NaiveBayesModel.fit(samples[:split]), samples[split:])
+
+    # 评估后用全部样本训练最终模型
+    model = NaiveBayesModel.fit(samples)
+    out_dir = os.path.dirname(out_path)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(model.to_dict(), f, ensure_ascii=False)
+    os.replace(tmp_path, out_path)
+    logger.info(f"模型已写入: {out_path}")
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地意图分类器")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    train_parser = subparsers.add_parser("train", help="从聊天记录库训练模型")
+    train_parser.add_argument("--db", action="append", required=True, help="聊天记录数据库，可指定多个")
+    train_parser.add_argument("--out", default=DEFAULT_MODEL_PATH)
+    train_parser.add_argument("--holdout", type=float, default=0.2, help="用于评估的样本比例")
+    train_parser.add_argument("--min-samples", type=int, default=50)
+    args = parser.parse_args()
+
+    if args.command == "train":
+        train(args.db, args.out, holdout=args.holdout, min_samples=args.min_samples)
+
+
+if __name__ == "__main__":
+    main()
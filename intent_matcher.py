@@ -0,0 +1,172 @@
+import json
+import os
+import re
+import time
+from collections import deque
+from loguru import logger
+
+
+# 规则文件缺失时使用的内置规则，顺序即优先级（技术类优先于价格类）
+DEFAULT_RULES = [
+    {"name": "tech", "keywords": ["参数", "规格", "型号", "连接", "对比"], "patterns": [r"和.+比"]},
+    {"name": "price", "keywords": ["便宜", "价", "砍价", "少点"], "patterns": [r"\d+元", r"能少\d+"]},
+]
+
+_CLEAN_RE = re.compile(r"[^\w\u4e00-\u9fa5]")
+
+
+def clean_text(text):
+    """去掉标点、空白和表情，只保留文字和数字"""
+    return _CLEAN_RE.sub("", text)
+
+
+class AhoCorasick:
+    """多关键词匹配自动机，每个关键词带一个优先级（数值越小越优先）"""
+
+    def __init__(self, keywords):
+        """
+        Args:
+            keywords: [(关键词, 优先级)]
+        """
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [None]  # 节点 -> 以该节点结尾的关键词中最高的优先级
+        for keyword, priority in keywords:
+            if keyword:
+                self._add(keyword, priority)
+        self._build()
+
+    def _add(self, keyword, priority):
+        node = 0
+        for char in keyword:
+            nxt = self.goto[node].get(char)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][char] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(None)
+            node = nxt
+        if self.output[node] is None or priority < self.output[node]:
+            self.output[node] = priority
+
+    def _build(self):
+        """广度优先构建失败指针，并把后缀节点的输出合并进来"""
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                state = self.fail[node]
+                while state and char not in self.goto[state]:
+                    state = self.fail[state]
+                self.fail[child] = self.goto[state].get(char, 0)
+                inherited = self.output[self.fail[child]]
+                if inherited is not None and (self.output[child] is None or inherited < self.output[child]):
+                    self.output[child] = inherited
+
+    def best(self, text, stop_at=0):
+        """
+        单次扫描返回命中的最高优先级，未命中返回None
+
+        Args:
+            stop_at: 命中该优先级时提前结束扫描
+        """
+        goto, fail, output = self.goto, self.fail, self.output
+        best = None
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            priority = output[node]
+            if priority is not None and (best is None or priority < best):
+                if priority <= stop_at:
+                    return priority
+                best = priority
+        return best
+
+
+class IntentMatcher:
+    """
+    规则意图匹配器
+
+    从规则文件加载各意图的关键词和正则：关键词编译成一个Aho-Corasick自动机，
+    正则合并成一个预编译的组合正则，一次扫描即可得到优先级最高的意图。
+    规则文件中意图的顺序就是优先级，文件修改后自动重新加载。
+    """
+
+    def __init__(self, rules_path=None, check_interval=5.0):
+        """
+        初始化匹配器
+
+        Args:
+            rules_path: 规则文件路径，文件不存在时使用内置规则
+            check_interval: 检查规则文件是否修改的最小间隔（秒）
+        """
+        self.rules_path = rules_path
+        self.check_interval = check_interval
+        self.mtime = None
+        self.last_check = 0
+        self.reload_count = 0
+        self.intents = []
+        self.automaton = None
+        self.pattern = None
+        self._compile(DEFAULT_RULES)
+        self.reload()
+
+    def _compile(self, rules):
+        """编译规则，规则有误时抛出异常且不影响当前规则"""
+        intents = [rule["name"] for rule in rules]
+        automaton = AhoCorasick(
+            (keyword, priority) for priority, rule in enumerate(rules) for keyword in rule.get("keywords", [])
+        )
+        # 用零宽前瞻包住各意图的正则，每个位置都按优先级依次尝试，匹配之间可以重叠
+        groups = [
+            f"(?P<_{priority}>{'|'.join(f'(?:{p})' for p in rule['patterns'])})"
+            for priority, rule in enumerate(rules) if rule.get("patterns")
+        ]
+        pattern = re.compile(f"(?=(?:{'|'.join(groups)}))") if groups else None
+
+        self.intents, self.automaton, self.pattern = intents, automaton, pattern
+
+    def reload(self):
+        """规则文件有变化时重新加载，返回是否加载了新规则"""
+        self.last_check = time.monotonic()
+        if not self.rules_path:
+            return False
+        try:
+            mtime = os.path.getmtime(self.rules_path)
+        except OSError:
+            return False
+        if mtime == self.mtime:
+            return False
+
+        self.mtime = mtime
+        try:
+            with open(self.rules_path, "r", encoding="utf-8") as f:
+                rules = json.load(f)["intents"]
+            self._compile(rules)
+        except Exception as e:
+            logger.error(f"加载意图规则失败，继续使用当前规则: {e}")
+            return False
+        self.reload_count += 1
+        logger.info(f"已加载意图规则: {self.rules_path}，意图: {self.intents}")
+        return True
+
+    def match(self, text):
+        """返回命中的意图，未命中返回None"""
+        if time.monotonic() - self.last_check >= self.check_interval:
+            self.reload()
+
+        text = clean_text(text)
+        best = self.automaton.best(text)
+        if best != 0 and self.pattern is not None:
+            limit = len(self.intents) if best is None else best
+            for m in self.pattern.finditer(text):
+                priority = int(m.lastgroup[1:])
+                if priority < limit:
+                    limit = best = priority
+                    if priority == 0:
+                        break
+        return None if best is None else self.intents[best]
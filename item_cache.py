@@ -0,0 +1,195 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from loguru import logger
+
+
+def build_item_description(item_info):
+    """根据商品详情构建提供给大模型的商品描述"""
+    item_description = []
+    if 'desc' in item_info and item_info['desc']:
+        item_description.append(f"商品描述: {item_info['desc']}")
+    if 'soldPrice' in item_info:
+        item_description.append(f"当前售价: {str(item_info['soldPrice'])}元")
+    if 'title' in item_info and item_info['title']:
+        item_description.append(f"商品标题: {item_info['title']}")
+    if 'categoryName' in item_info and item_info['categoryName']:
+        item_description.append(f"商品分类: {item_info['categoryName']}")
+    return "; ".join(item_description) or "无法获取商品信息"
+
+
+class ItemCacheEntry:
+    __slots__ = ("item_info", "description", "fetched_at")
+
+    def __init__(self, item_info, description, fetched_at):
+        self.item_info = item_info
+        self.description = description
+        self.fetched_at = fetched_at
+
+
+class ItemCache:
+    """
+    商品详情缓存
+
+    按item_id缓存商品详情及构建好的商品描述，支持TTL、LRU容量上限和
+    stale-while-revalidate：过期但仍在宽限期内的条目直接返回，同时在后台刷新。
+    可选持久化到SQLite，重启后直接从磁盘预热。
+    """
+
+    def __init__(self, ttl=600, stale_ttl=3600, max_size=1000, db_path=None):
+        """
+        初始化商品缓存
+
+        Args:
+            ttl: 条目新鲜期（秒），期内直接返回
+            stale_ttl: 过期后的宽限期（秒），期内返回旧值并后台刷新
+            max_size: 最大缓存条目数，超出时淘汰最久未使用的条目
+            db_path: SQLite数据库路径，为None时不持久化
+        """
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_size = max_size
+        self.db_path = db_path
+        self.entries = OrderedDict()
+        self._inflight = {}   # item_id -> 正在进行的拉取任务
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+        if self.db_path:
+            self._init_db()
+            self._load()
+
+    def _init_db(self):
+        """初始化缓存表"""
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+
+        conn = sqlite3.connect(self.db_path)
+        try:
+            # 与意图分类缓存共用数据库，多个worker进程同时读写
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS item_cache (
+                item_id TEXT PRIMARY KEY,
+                item_info TEXT NOT NULL,
+                description TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+            ''')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _load(self):
+        """从数据库加载宽限期内的缓存条目"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            rows = conn.execute(
+                "SELECT item_id, item_info, description, fetched_at FROM item_cache "
+                "WHERE fetched_at > ? ORDER BY fetched_at ASC",
+                (time.time() - self.ttl - self.stale_ttl,)
+            ).fetchall()
+            for item_id, item_info, description, fetched_at in rows[-self.max_size:]:
+                self.entries[item_id] = ItemCacheEntry(json.loads(item_info), description, fetched_at)
+            logger.info(f"已从数据库加载 {len(self.entries)} 条商品缓存")
+        except Exception as e:
+            logger.error(f"加载商品缓存失败: {e}")
+        finally:
+            conn.close()
+
+    def _persist(self, item_id, entry):
+        """写入一条缓存，在工作线程中执行"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO item_cache (item_id, item_info, description, fetched_at) VALUES (?, ?, ?, ?)",
+                (item_id, json.dumps(entry.item_info, ensure_ascii=False), entry.description, entry.fetched_at)
+            )
+            conn.commit()
+        except Exception as e:
+            logger.error(f"保存商品缓存失败: {e}")
+        finally:
+            conn.close()
+
+    def _store(self, item_id, item_info):
+        entry = ItemCacheEntry(item_info, build_item_description(item_info), time.time())
+        self.entries[item_id] = entry
+        self.entries.move_to_end(item_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return entry
+
+    async def _load_item(self, item_id, fetch):
+        item_info = await fetch()
+        entry = self._store(item_id, item_info)
+        if self.db_path:
+            # 写库放到线程中，不阻塞事件循环
+            await asyncio.to_thread(self._persist, item_id, entry)
+        return entry
+
+    async def _fetch(self, item_id, fetch):
+        """拉取商品详情，同一商品的并发请求只发起一次"""
+        task = self._inflight.get(item_id)
+        if task is None:
+            task = asyncio.ensure_future(self._load_item(item_id, fetch))
+            self._inflight[item_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(item_id, None))
+        return await asyncio.shield(task)
+
+    async def _refresh(self, item_id, fetch):
+        try:
+            await self._fetch(item_id, fetch)
+        except Exception as e:
+            logger.warning(f"后台刷新商品 {item_id} 失败: {e}")
+
+    async def get(self, item_id, fetch):
+        """
+        获取商品缓存条目
+
+        Args:
+            item_id: 商品ID
+            fetch: 无参协程函数，返回商品详情(itemDO)
+
+        Returns:
+            ItemCacheEntry: 包含商品详情和商品描述的缓存条目
+        """
+        entry = self.entries.get(item_id)
+        if entry is not None:
+            age = time.time() - entry.fetched_at
+            self.entries.move_to_end(item_id)
+            if age < self.ttl:
+                self.hits += 1
+                return entry
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                if item_id not in self._inflight:
+                    asyncio.create_task(self._refresh(item_id, fetch))
+                return entry
+
+        self.misses += 1
+        try:
+            return await self._fetch(item_id, fetch)
+        except Exception:
+            # 拉取失败时宁可返回过期数据
+            if entry is not None:
+                logger.warning(f"商品 {item_id} 拉取失败，使用过期缓存")
+                return entry
+            raise
+
+    def invalidate(self, item_id):
+        """移除指定商品的缓存"""
+        self.entries.pop(item_id, None)
+
+    def stats(self):
+        """获取缓存命中统计"""
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,91 @@
+import asyncio
+import os
+from openai import OpenAI, AsyncOpenAI
+from loguru import logger
+
+
+DASHSCOPE_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+
+
+class LLMClient:
+    """
+    大模型调用客户端
+
+    同时持有同步和异步两个OpenAI兼容客户端，所有Agent共享同一个连接池。
+    异步调用受全局并发上限和按模型的并发上限约束，每次请求都带超时。
+    """
+
+    def __init__(self, api_key=None, base_url=None, timeout=None,
+                 max_concurrency=None, model_concurrency=None):
+        """
+        初始化大模型客户端
+
+        Args:
+            api_key: API密钥，默认读取OPENAI_API_KEY
+            base_url: 兼容OpenAI协议的接口地址，默认读取LLM_BASE_URL，未设置时使用DashScope
+            timeout: 单次请求超时（秒），默认读取LLM_TIMEOUT
+            max_concurrency: 全局同时进行的最大请求数，默认读取LLM_MAX_CONCURRENCY
+            model_concurrency: 按模型的最大并发数，如 {"qwen-max": 4}，默认读取LLM_MODEL_CONCURRENCY
+                （格式如 "qwen-max:4,qwen-plus:8"），未配置的模型与全局上限相同
+        """
+        api_key = api_key or os.getenv("OPENAI_API_KEY")
+        base_url = base_url or os.getenv("LLM_BASE_URL", DASHSCOPE_BASE_URL)
+        self.timeout = float(timeout or os.getenv("LLM_TIMEOUT", "30"))
+        self.max_concurrency = int(max_concurrency or os.getenv("LLM_MAX_CONCURRENCY", "8"))
+        self.model_concurrency = model_concurrency or self._parse_model_concurrency(
+            os.getenv("LLM_MODEL_CONCURRENCY", ""))
+
+        self.sync_client = OpenAI(api_key=api_key, base_url=base_url, timeout=self.timeout)
+        self.async_client = AsyncOpenAI(api_key=api_key, base_url=base_url, timeout=self.timeout)
+
+        self._global_semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._model_semaphores = {}
+        self.in_flight = 0
+
+    @staticmethod
+    def _parse_model_concurrency(value):
+        """解析 "模型:并发数" 逗号分隔的配置"""
+        limits = {}
+        for part in value.split(","):
+            part = part.strip()
+            model, sep, limit = part.rpartition(":")
+            if not sep or not model:
+                continue
+            try:
+                limits[model] = int(limit)
+            except ValueError:
+                logger.warning(f"忽略无效的模型并发配置: {part}")
+        return limits
+
+    def _model_semaphore(self, model):
+        semaphore = self._model_semaphores.get(model)
+        if semaphore is None:
+            limit = self.model_concurrency.get(model, self.max_concurrency)
+            semaphore = self._model_semaphores[model] = asyncio.Semaphore(limit)
+        return semaphore
+
+    def complete(self, **kwargs) -> str:
+        """同步调用大模型，返回回复文本（供脚本使用）"""
+        kwargs.setdefault("timeout", self.timeout)
+        response = self.sync_client.chat.completions.create(**kwargs)
+        return response.choices[0].message.content
+
+    async def acomplete(self, **kwargs) -> str:
+        """异步调用大模型，返回回复文本"""
+        kwargs.setdefault("timeout", self.timeout)
+        model = kwargs.get("model")
+        # 先等按模型的配额再占全局配额，避免等待受限模型的请求占住全局名额
+        async with self._model_semaphore(model), self._global_semaphore:
+            self.in_flight += 1
+            try:
+                response = await self.async_client.chat.completions.create(**kwargs)
+            finally:
+                self.in_flight -= 1
+        return response.choices[0].message.content
+
+    async def close(self):
+        """关闭异步客户端的连接池"""
+        try:
+            await self.async_client.close()
+        except Exception as e:
+            logger.warning(f"关闭大模型客户端失败: {e}")
@@ -1,4 +1,3 @@
-import base64
 import json
 import asyncio
 import time
@@ -8,15 +7,27 @@ import signal
 import websockets
 from loguru import logger
 from dotenv import load_dotenv
-from XianyuApis import XianyuApis
 from cookie_manager import get_and_inject_cookies, CookieManager
 from cookie_injector import CookieInjector
 
-from utils.xianyu_utils import generate_mid, generate_uuid, trans_cookies, generate_device_id, decrypt
-from XianyuAgent import XianyuReplyBot
-from context_manager import ChatContextManager
-from image_processor import ImageProcessor
+from utils.xianyu_utils import generate_mid, trans_cookies, generate_device_id
+from context_manager import AsyncChatContextManager, ChatContextManager
+from context_builder import ContextBuilder
+from conversation_state import ConversationStateStore
 from default_responses import get_response
+from message_dispatcher import MessageDispatcher
+from message_debouncer import MessageDebouncer
+from send_queue import SendQueue
+from shared_services import SharedServices
+from token_manager import TokenManager
+from reconnect_manager import ReconnectManager, SyncCursorStore
+from message_dedup import MessageDeduplicator, message_key
+import frame_codec
+from frame_codec import build_ack, build_heartbeat, SendFrameBuilder
+from message_decoder import (
+    MessageEvent, sync_entries, decode_sync_entry,
+    KIND_CHAT, KIND_IMAGE, KIND_VOICE, KIND_TYPING,
+)
 
 # 全局变量
 app = None
@@ -49,18 +60,28 @@ class ConfigManager:
 
 class LoginManager:
     """登录管理类"""
-    def __init__(self, config_manager):
+    def __init__(self, config_manager, xianyu):
+        """
+        Args:
+            config_manager: 配置管理器
+            xianyu: 共享的AsyncXianyuApis，验证通过的TokenManager与XianyuLive共用同一个连接池
+        """
         self.config = config_manager
         self.cookie_manager = CookieManager()
-        self.xianyu = XianyuApis()
+        self.xianyu = xianyu
+        self.token_manager = None
     
     async def validate_token(self, cookies_str):
-        """验证token"""
+        """验证token，验证通过的token会被缓存供XianyuLive复用"""
         try:
             cookies = trans_cookies(cookies_str)
             device_id = generate_device_id(cookies['unb'])
-            token_response = self.xianyu.get_token(cookies, device_id)
-            return token_response and 'data' in token_response and 'accessToken' in token_response['data']
+            self.token_manager = TokenManager(
+                self.xianyu, cookies, device_id,
+                ttl=int(os.getenv("TOKEN_TTL", "3600"))
+            )
+            await self.token_manager.get_token()
+            return True
         except Exception as e:
             logger.error(f"Token验证失败: {e}")
             return False
@@ -101,18 +122,55 @@ class LoginManager:
         return None
 
 class XianyuLive:
-    def __init__(self, cookies_str):
-        self.xianyu = XianyuApis()
-        self.base_url = 'wss://wss-goofish.dingtalk.com/'
+    def __init__(self, cookies_str, token_manager=None, shared=None, db_path="data/chat_history.db"):
+        """
+        Args:
+            cookies_str: 账号cookie字符串
+            token_manager: 已缓存accessToken的TokenManager，为None时自动创建
+            shared: 多账号共享的服务(SharedServices)，为None时单独创建一份
+            db_path: 本账号的聊天记录数据库路径
+        """
+        self.shared = shared or SharedServices.create(db_path)
+        self.xianyu = self.shared.xianyu
+        self.base_url = os.getenv("XIANYU_WS_URL", 'wss://wss-goofish.dingtalk.com/')
         self.cookies_str = cookies_str
         self.cookies = trans_cookies(cookies_str)
         self.myid = self.cookies['unb']
         self.device_id = generate_device_id(self.myid)
-        self.context_manager = ChatContextManager()
-        self.bot = XianyuReplyBot()
-        
-        # 从XianyuReplyBot获取图片提示词
-        self.image_processor = ImageProcessor(image_prompt=self.bot.image_prompt)
+        self.frame_builder = SendFrameBuilder(self.myid)
+        self.token_manager = token_manager or TokenManager(
+            self.xianyu, self.cookies, self.device_id,
+            ttl=int(os.getenv("TOKEN_TTL", "3600"))
+        )
+        self.reg_mid = None
+        self.context_manager = ChatContextManager(
+            db_path=db_path,
+            synchronous=os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+            mmap_size=int(os.getenv("SQLITE_MMAP_SIZE", str(64 * 1024 * 1024))),
+        )
+        # 数据库读写都在独立线程中执行，事件循环只等待结果
+        self.chat_db = AsyncChatContextManager(
+            self.context_manager,
+            read_workers=int(os.getenv("CHAT_DB_READ_WORKERS", "4"))
+        )
+        # 会话状态常驻内存，读取无I/O，写入由后台任务批量落盘
+        self.conversations = ConversationStateStore(
+            self.chat_db,
+            flush_interval=float(os.getenv("STATE_FLUSH_INTERVAL", "1")),
+            compact_interval=float(os.getenv("HISTORY_COMPACT_INTERVAL", "60")),
+        )
+        # 按token预算组装上下文，较早的对话由后台更新的滚动摘要代替
+        self.context_builder = ContextBuilder(
+            self.shared.llm_client,
+            self.conversations,
+            budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "800")),
+            min_batch_tokens=int(os.getenv("SUMMARY_MIN_TOKENS", "100")),
+            model=os.getenv("SUMMARY_MODEL", "qwen-max")
+        )
+        self.bot = self.shared.bot
+        self.item_cache = self.shared.item_cache
+        self.reply_cache = self.shared.reply_cache
+        self.image_processor = self.shared.image_processor
         
         # 心跳相关配置
         self.heartbeat_interval = 15  # 心跳间隔15秒
@@ -122,54 +180,58 @@ class XianyuLive:
         self.heartbeat_task = None
         self.ws = None
 
-    async def send_msg(self, ws, cid, toid, text):
-        text = {
-            "contentType": 1,
-            "text": {
-                "text": text
-            }
-        }
-        text_base64 = str(base64.b64encode(json.dumps(text).encode('utf-8')), 'utf-8')
-        msg = {
-            "lwp": "/r/MessageSend/sendByReceiverScope",
-            "headers": {
-                "mid": generate_mid()
-            },
-            "body": [
-                {
-                    "uuid": generate_uuid(),
-                    "cid": f"{cid}@goofish",
-                    "conversationType": 1,
-                    "content": {
-                        "contentType": 101,
-                        "custom": {
-                            "type": 1,
-                            "data": text_base64
-                        }
-                    },
-                    "redPointPolicy": 0,
-                    "extension": {
-                        "extJson": "{}"
-                    },
-                    "ctx": {
-                        "appVersion": "1.0",
-                        "platform": "web"
-                    },
-                    "mtags": {},
-                    "msgReadStatusSetting": 1
-                },
-                {
-                    "actualReceivers": [
-                        f"{toid}@goofish",
-                        f"{self.myid}@goofish"
-                    ]
-                }
-            ]
-        }
-        await ws.send(json.dumps(msg))
+        # 断线重连与同步游标
+        self.reconnect_manager = ReconnectManager(
+            base_delay=float(os.getenv("RECONNECT_BASE_DELAY", "1")),
+            max_delay=float(os.getenv("RECONNECT_MAX_DELAY", "60"))
+        )
+        self.sync_cursor = SyncCursorStore(self.myid, db_path=self.context_manager.db_path)
+        self.sync_resume_max_age = int(os.getenv("SYNC_RESUME_MAX_AGE", "3600"))
+        self.cursor_positions = {}  # 消息去重键 -> 尚未处理完的(pts, seq)
+        self.resume_since_ms = None  # 本次连接从同步游标续传的起点（毫秒）
+
+        # 已处理消息去重，防止重连后服务器重推导致重复回复
+        self.deduplicator = MessageDeduplicator(
+            capacity=int(os.getenv("DEDUP_CAPACITY", "10000")),
+            db_path=self.context_manager.db_path if os.getenv("DEDUP_PERSIST", "1") == "1" else None,
+            account_id=self.myid
+        )
+        # 已处理消息的去重记录随会话状态一起批量写入，不在接收路径上提交事务
+        self.conversations.flushers.append(lambda: self.deduplicator.aflush(self.chat_db))
+        self.conversations.flushers.append(lambda: self.sync_cursor.aflush(self.chat_db))
+
+        # 出站发送队列：按会话和账号限速，断线重连后继续发送
+        self.send_queue = SendQueue(
+            conversation_rate=float(os.getenv("SEND_CONVERSATION_RATE", "1")),
+            conversation_burst=int(os.getenv("SEND_CONVERSATION_BURST", "1")),
+            account_rate=float(os.getenv("SEND_ACCOUNT_RATE", "5")),
+            account_burst=int(os.getenv("SEND_ACCOUNT_BURST", "10")),
+            max_retries=int(os.getenv("SEND_MAX_RETRIES", "3")),
+            max_age=int(os.getenv("SEND_MAX_AGE", "300"))
+        )
+
+        # 消息分发器：同一会话串行处理，不同会话并行处理
+        self.dispatcher = MessageDispatcher(
+            self.handle_dispatched,
+            max_workers=int(os.getenv("DISPATCH_MAX_WORKERS", "8")),
+            on_drop=lambda event, websocket, sources: self.finish_messages(sources, handled=False)
+        )
+
+        # 消息防抖：买家连发的多条消息合并为一轮再生成回复
+        self.debouncer = MessageDebouncer(
+            self.dispatch_burst,
+            window=float(os.getenv("DEBOUNCE_WINDOW", "1.5")),
+            typing_window=float(os.getenv("DEBOUNCE_TYPING_WINDOW", "3")),
+            max_window=float(os.getenv("DEBOUNCE_MAX_WINDOW", "6"))
+        )
+
+    def send_msg(self, cid, toid, text):
+        """将回复加入发送队列，返回发送完成的future"""
+        return self.send_queue.enqueue(cid, self.frame_builder.build(cid, toid, text))
 
     async def init(self, ws):
-        token = self.xianyu.get_token(self.cookies, self.device_id)['data']['accessToken']
+        token = await self.token_manager.get_token()
+        self.reg_mid = generate_mid()
         msg = {
             "lwp": "/reg",
             "headers": {
@@ -181,15 +243,18 @@ class XianyuLive:
                 "wv": "im:3,au:3,sy:6",
                 "sync": "0,0;0;0;",
                 "did": self.device_id,
-                "mid": generate_mid()
+                "mid": self.reg_mid
             }
         }
         await ws.send(json.dumps(msg))
         # 等待一段时间，确保连接注册完成
         await asyncio.sleep(1)
+        # 从上次处理到的位置继续同步，游标过旧时从当前时间开始
+        pts, seq = self.sync_cursor.resume_point(self.sync_resume_max_age)
+        self.resume_since_ms = pts // 1000 if pts == self.sync_cursor.pts else None
         msg = {"lwp": "/r/SyncStatus/ackDiff", "headers": {"mid": "5701741704675979 0"}, "body": [
             {"pipeline": "sync", "tooLong2Tag": "PNM,1", "channel": "sync", "topic": "sync", "highPts": 0,
-             "pts": int(time.time() * 1000) * 1000, "seq": 0, "timestamp": int(time.time() * 1000)}]}
+             "pts": pts, "seq": seq, "timestamp": int(time.time() * 1000)}]}
         await ws.send(json.dumps(msg))
         
         # 显示当前登录用户ID
@@ -197,220 +262,191 @@ class XianyuLive:
             
         logger.info('连接注册完成')
 
-    def is_chat_message(self, message):
-        """判断是否为用户聊天消息"""
-        try:
-            return (
-                isinstance(message, dict) 
-                and "1" in message 
-                and isinstance(message["1"], dict)  # 确保是字典类型
-                and "10" in message["1"]
-                and isinstance(message["1"]["10"], dict)  # 确保是字典类型
-                and "reminderContent" in message["1"]["10"]
-            )
-        except Exception:
-            return False
+    async def get_item_description(self, item_id):
+        """获取商品描述（走商品缓存）"""
+        async def fetch():
+            return (await self.xianyu.get_item_info(self.cookies, item_id))['data']['itemDO']
 
-    def is_image_message(self, message):
-        """判断是否为图片消息"""
         try:
-            return (
-                isinstance(message, dict)
-                and "1" in message
-                and isinstance(message["1"], dict)
-                and "6" in message["1"]
-                and isinstance(message["1"]["6"], dict)
-                and "3" in message["1"]["6"]
-                and isinstance(message["1"]["6"]["3"], dict)
-                and "5" in message["1"]["6"]["3"]
-            )
-        except Exception:
-            return False
-
-    def extract_image_info(self, message):
-        """提取图片信息"""
-        try:
-            image_data = json.loads(message["1"]["6"]["3"]["5"])
-            if "image" in image_data and "pics" in image_data["image"]:
-                image_info = image_data["image"]["pics"][0]
-                return {
-                    "url": image_info["url"],
-                    "width": image_info["width"],
-                    "height": image_info["height"],
-                    "type": image_info["type"]
-                }
+            entry = await self.item_cache.get(item_id, fetch)
+            return entry.description
         except Exception as e:
-            logger.error(f"提取图片信息失败: {e}")
-        return None
+            logger.error(f"获取商品信息失败: {e}")
+            return "无法获取商品信息"
 
-    def is_sync_package(self, message_data):
-        """判断是否为同步包消息"""
+    async def handle_message(self, message_data, websocket):
+        """处理同步包消息（ACK已在主循环中发送）"""
         try:
-            return (
-                isinstance(message_data, dict)
-                and "body" in message_data
-                and "syncPushPackage" in message_data["body"]
-                and "data" in message_data["body"]["syncPushPackage"]
-                and len(message_data["body"]["syncPushPackage"]["data"]) > 0
-            )
-        except Exception:
-            return False
+            # 服务器可能把多条推送合并在一个包里，按顺序逐条处理（非同步包时为空）
+            seen = set()
+            for sync_data in sync_entries(message_data):
+                # 检查是否有必要的字段
+                if not isinstance(sync_data, dict) or "data" not in sync_data:
+                    continue
 
-    def is_typing_status(self, message):
-        """判断是否为用户正在输入状态消息"""
-        try:
-            return (
-                isinstance(message, dict)
-                and "1" in message
-                and isinstance(message["1"], list)
-                and len(message["1"]) > 0
-                and isinstance(message["1"][0], dict)
-                and "1" in message["1"][0]
-                and isinstance(message["1"][0]["1"], str)
-                and "@goofish" in message["1"][0]["1"]
-            )
-        except Exception:
-            return False
+                # 同一个包内内容相同的重复推送只处理一次
+                if sync_data["data"] in seen:
+                    continue
+                seen.add(sync_data["data"])
 
-    async def handle_message(self, message_data, websocket):
-        """处理所有类型的消息"""
+                try:
+                    self.handle_sync_entry(sync_data, websocket)
+                except Exception as e:
+                    logger.error(f"处理同步数据时发生错误: {e}")
+
+        except Exception as e:
+            logger.error(f"处理消息时发生错误: {str(e)}")
+
+    def handle_sync_entry(self, sync_data, websocket):
+        """解码单条同步数据并交给分发器"""
         try:
-            try:
-                message = message_data
-                ack = {
-                    "code": 200,
-                    "headers": {
-                        "mid": message["headers"]["mid"] if "mid" in message["headers"] else generate_mid(),
-                        "sid": message["headers"]["sid"] if "sid" in message["headers"] else '',
-                    }
-                }
-                if 'app-key' in message["headers"]:
-                    ack["headers"]["app-key"] = message["headers"]["app-key"]
-                if 'ua' in message["headers"]:
-                    ack["headers"]["ua"] = message["headers"]["ua"]
-                if 'dt' in message["headers"]:
-                    ack["headers"]["dt"] = message["headers"]["dt"]
-                await websocket.send(json.dumps(ack))
-            except Exception as e:
-                pass
+            event = decode_sync_entry(sync_data)
+        except Exception as e:
+            logger.error(f"消息解密失败: {e}")
+            return
+
+        # 统计断线期间补收的消息
+        if event.create_time:
+            self.reconnect_manager.record_message(event.create_time)
+        pts = sync_data.get("pts") or (event.create_time * 1000 if event.create_time else None)
+        seq = sync_data.get("seq")
+
+        # 同步游标在消息处理完成后才推进，分发出去的消息由finish_messages完成
+        self.sync_cursor.begin(pts)
+        key = None
+        try:
+            key = self.route_event(event, websocket)
+        finally:
+            if key is None:
+                self.sync_cursor.complete(pts, seq)
+            else:
+                self.cursor_positions[key] = (pts, seq)
+
+    def route_event(self, event, websocket):
+        """按消息类型分流，交给防抖器或分发器时返回消息去重键，无需处理时返回None"""
+        # 买家正在输入时延长防抖窗口
+        if event.kind == KIND_TYPING:
+            self.debouncer.touch(event.sender_id)
+            return None
 
-            # 如果不是同步包消息，直接返回
-            if not self.is_sync_package(message_data):
-                return
+        # 只有会话消息需要处理
+        if event.kind not in (KIND_CHAT, KIND_IMAGE, KIND_VOICE) or not event.cid:
+            return None
 
-            # 获取并解密数据
-            sync_data = message_data["body"]["syncPushPackage"]["data"][0]
-            
-            # 检查是否有必要的字段
-            if "data" not in sync_data:
-                return
+        key = message_key(event)
+        if self.deduplicator.is_duplicate(key):
+            logger.debug(f"忽略重复推送的消息: {key}")
+            return None
 
-            # 解密数据
-            try:
-                data = sync_data["data"]
-                try:
-                    data = base64.b64decode(data).decode("utf-8")
-                    data = json.loads(data)
-                    message = data
-                except Exception as e:
-                    decrypted_data = decrypt(data)
-                    message = json.loads(decrypted_data)
-            except Exception as e:
-                logger.error(f"消息解密失败: {e}")
+        # 买家的文字消息先进入防抖窗口，其他消息先提交该会话已暂存的消息以保证顺序
+        if event.kind == KIND_CHAT and event.sender_id != self.myid:
+            self.debouncer.add(event.cid, event.sender_id, event)
+            return key
+        self.debouncer.flush(event.cid)
+        # 按会话分发，耗时的回复生成不阻塞websocket接收循环
+        self.dispatcher.dispatch(event.cid, event, websocket, (event,))
+        return key
+
+    def dispatch_burst(self, cid, events):
+        """把防抖窗口内的连续消息合并为一条交给分发器"""
+        event = events[-1]
+        if len(events) > 1:
+            event = MessageEvent(
+                KIND_CHAT, event.cid, event.sender_id, event.sender_name, event.item_id,
+                "\n".join(e.text for e in events if e.text), None, event.create_time, event.message_id
+            )
+        self.dispatcher.dispatch(cid, event, self.ws, events)
+
+    async def handle_dispatched(self, event, websocket, sources):
+        """处理分发的消息，完成后记录合并前的各条原始消息"""
+        handled = await self.process_message(event, websocket) is not False
+        self.finish_messages(sources, handled)
+
+    def finish_messages(self, events, handled):
+        """
+        消息处理结束（或被丢弃）时调用
+
+        Args:
+            events: 合并前的原始消息
+            handled: 是否处理成功，只有成功处理的消息才写入去重记录
+        """
+        for event in events:
+            key = message_key(event)
+            if handled:
+                self.deduplicator.mark_handled(key)
+            position = self.cursor_positions.pop(key, None)
+            if position:
+                self.sync_cursor.complete(*position)
+
+    async def process_message(self, event, websocket):
+        """处理单条会话消息（由分发器按会话顺序调用），出错时返回False"""
+        try:
+            cid = event.cid
+            send_user_id = event.sender_id
+            item_id = event.item_id
+
+            # 处理语音消息
+            if event.kind == KIND_VOICE:
+                response = get_response("special", "voice")
+                self.send_msg(cid, send_user_id, response)
+                logger.info(f"已回复语音消息: {response}")
                 return
 
-            # 检查消息类型
-            message_type = self.image_processor.get_message_type(message)
-            if message_type != "正常消息":
-                # 获取用户信息
-                send_user_name = message["1"]["10"]["reminderTitle"]
-                send_user_id = message["1"]["10"]["senderUserId"]
-                cid = message["1"]["2"].split('@')[0]
+            if event.kind == KIND_IMAGE:
+                # 立即发送等待消息
+                wait_msg = get_response("special", "image", sub_key="wait")
+                # 同一会话的消息按入队顺序发送，等待消息一定先于回复发出
+                self.send_msg(cid, send_user_id, wait_msg)
+                logger.info(f"等待消息已加入发送队列: {wait_msg}")
                 
-                # 处理语音消息
-                if message_type == "语音":
-                    response = get_response("special", "voice")
-                    await self.send_msg(websocket, cid, send_user_id, response)
-                    logger.info(f"已回复语音消息: {response}")
-                    return
+                if item_id:
+                    await self.conversations.add_message(send_user_id, item_id, "assistant", wait_msg)
                 
-                if message_type == "图片":
-                    # 立即发送等待消息
-                    wait_msg = get_response("special", "image", sub_key="wait")
-                    wait_task = asyncio.create_task(self.send_msg(websocket, cid, send_user_id, wait_msg))
-                    logger.info(f"正在发送等待消息: {wait_msg}")
-                    
-                    # 获取商品信息
-                    url_info = message["1"]["10"]["reminderUrl"]
-                    item_id = url_info.split("itemId=")[1].split("&")[0] if "itemId=" in url_info else None
-                    
-                    # 确保等待消息已发送
-                    await wait_task
-                    logger.info("等待消息已发送")
-                    
-                    if item_id:
-                        self.context_manager.add_message(send_user_id, item_id, "assistant", wait_msg)
-                    
-                    image_info = self.extract_image_info(message)
-                    if image_info:
-                        # 处理图片
-                        image_description = self.image_processor.process_image(image_info["url"])
-                        if image_description:
-                            logger.info(f"图片描述: {image_description}")
+                if event.image:
+                    # 处理图片（图片识别仍为同步调用，放到线程中执行以免阻塞事件循环）
+                    image_description = await asyncio.to_thread(self.image_processor.process_image, event.image["url"])
+                    if image_description:
+                        logger.info(f"图片描述: {image_description}")
+                        
+                        if item_id:
+                            item_description = await self.get_item_description(item_id)
                             
-                            if item_id:
-                                # 异步获取商品信息
-                                try:
-                                    item_info = self.xianyu.get_item_info(self.cookies, item_id)['data']['itemDO']
-                                    # 构建商品描述
-                                    item_description = []
-                                    if 'desc' in item_info and item_info['desc']:
-                                        item_description.append(f"商品描述: {item_info['desc']}")
-                                    if 'soldPrice' in item_info:
-                                        item_description.append(f"当前售价: {str(item_info['soldPrice'])}元")
-                                    if 'title' in item_info and item_info['title']:
-                                        item_description.append(f"商品标题: {item_info['title']}")
-                                    if 'categoryName' in item_info and item_info['categoryName']:
-                                        item_description.append(f"商品分类: {item_info['categoryName']}")
-                                    
-                                    item_description = "; ".join(item_description)
-                                    if not item_description:
-                                        item_description = "无法获取商品信息"
-                                except Exception as e:
-                                    logger.error(f"获取商品信息失败: {e}")
-                                    item_description = "无法获取商品信息"
-                                
-                                # 将图片描述添加到上下文
-                                self.context_manager.add_message(send_user_id, item_id, "user", f"[图片] {image_description}")
-                                
-                                # 获取完整的对话上下文
-                                context = self.context_manager.get_context(send_user_id, item_id)
-                                
-                                # 生成回复
-                                bot_reply = self.bot.generate_reply(
-                                    f"这是一张图片，内容是：{image_description}",
-                                    item_description,
-                                    context=context
-                                )
-                                
-                                # 添加机器人回复到上下文
-                                self.context_manager.add_message(send_user_id, item_id, "assistant", bot_reply)
-                                
-                                logger.info(f"机器人回复: {bot_reply}")
-                                await self.send_msg(websocket, cid, send_user_id, bot_reply)
+                            # 将图片描述添加到上下文
+                            await self.conversations.add_message(send_user_id, item_id, "user", f"[图片] {image_description}")
+                            
+                            # 获取完整的对话上下文和会话状态
+                            messages, state = await self.conversations.get_context(send_user_id, item_id)
+                            context = self.context_builder.build(send_user_id, item_id, messages, state)
+                            
+                            # 生成回复
+                            bot_reply, _ = await self.bot.generate_reply_async(
+                                f"这是一张图片，内容是：{image_description}",
+                                item_description,
+                                context=context,
+                                bargain_count=state.bargain_count
+                            )
+                            
+                            # 添加机器人回复到上下文
+                            await self.conversations.add_message(send_user_id, item_id, "assistant", bot_reply)
+                            await self.conversations.set_item_snapshot(send_user_id, item_id, item_description)
+                            
+                            logger.info(f"机器人回复: {bot_reply}")
+                            self.send_msg(cid, send_user_id, bot_reply)
                 return
 
             # 处理文本消息
-            if not self.is_chat_message(message):
-                return
-
-            create_time = int(message["1"]["5"])
-            send_user_name = message["1"]["10"]["reminderTitle"]
-            send_user_id = message["1"]["10"]["senderUserId"]
-            send_message = message["1"]["10"]["reminderContent"]
+            send_user_name = event.sender_name
+            send_message = event.text
             
-            # 时效性验证（过滤5分钟前消息）
-            if (time.time() * 1000 - create_time) > 300000:
+            # 时效性验证（过滤5分钟前消息）；从同步游标续传的消息尚未处理过，
+            # 在续传窗口SYNC_RESUME_MAX_AGE内不按5分钟过滤，否则断线期间的消息大多会被丢弃
+            age = time.time() * 1000 - event.create_time
+            resumed = (
+                self.resume_since_ms is not None and event.create_time >= self.resume_since_ms
+                and age <= self.sync_resume_max_age * 1000
+            )
+            if age > 300000 and not resumed:
+                self.reconnect_manager.expired_messages += 1
                 return
                 
             # 修改：过滤自己发送的消息
@@ -418,76 +454,64 @@ class XianyuLive:
                 logger.debug(f"忽略自己发送的消息: {send_message}")
                 return
                 
-            url_info = message["1"]["10"]["reminderUrl"]
-            item_id = url_info.split("itemId=")[1].split("&")[0] if "itemId=" in url_info else None
-            
             if not item_id:
                 logger.warning(f"消息中未找到商品ID: {send_message}")
                 return
                 
-            try:
-                item_info = self.xianyu.get_item_info(self.cookies, item_id)['data']['itemDO']
-                # 构建商品描述，包含所有可用信息
-                item_description = []
-                if 'desc' in item_info and item_info['desc']:
-                    item_description.append(f"商品描述: {item_info['desc']}")
-                if 'soldPrice' in item_info:
-                    item_description.append(f"当前售价: {str(item_info['soldPrice'])}元")
-                if 'title' in item_info and item_info['title']:
-                    item_description.append(f"商品标题: {item_info['title']}")
-                if 'categoryName' in item_info and item_info['categoryName']:
-                    item_description.append(f"商品分类: {item_info['categoryName']}")
-                
-                item_description = "; ".join(item_description)
-                if not item_description:
-                    item_description = "无法获取商品信息"
-                    
-            except Exception as e:
-                logger.error(f"获取商品信息失败: {e}")
-                item_description = "无法获取商品信息"
+            item_description = await self.get_item_description(item_id)
             
             logger.info(f"收到用户消息 - 用户: {send_user_name}, 消息: {send_message}")
             
             # 添加用户消息到上下文
-            self.context_manager.add_message(send_user_id, item_id, "user", send_message)
+            await self.conversations.add_message(send_user_id, item_id, "user", send_message)
             
-            # 获取完整的对话上下文
-            context = self.context_manager.get_context(send_user_id, item_id)
+            # 常见问题直接复用同一商品下的缓存回复；只有不调用大模型就能确定意图、且该意图允许缓存时
+            # 才查缓存，无法预判的消息可能是议价，不能用其他意图的缓存回复
+            cached = None
+            if self.reply_cache:
+                intent_hint = self.bot.peek_intent(send_message, item_description)
+                if intent_hint in self.reply_cache.intents:
+                    cached = self.reply_cache.get(item_id, item_description, send_message, intent_hint)
             
-            # 生成回复
-            bot_reply = self.bot.generate_reply(
-                send_message,
-                item_description,
-                context=context
-            )
+            if cached:
+                bot_reply, intent = cached
+                logger.info(f"命中问答缓存，意图: {intent}")
+            else:
+                # 获取完整的对话上下文和会话状态
+                messages, state = await self.conversations.get_context(send_user_id, item_id)
+                context = self.context_builder.build(send_user_id, item_id, messages, state)
+                
+                # 生成回复
+                bot_reply, intent = await self.bot.generate_reply_async(
+                    send_message,
+                    item_description,
+                    context=context,
+                    bargain_count=state.bargain_count
+                )
+                if self.reply_cache:
+                    self.reply_cache.put(item_id, item_description, send_message, intent, bot_reply)
             
             # 检查是否为价格意图，如果是则增加议价次数
-            if self.bot.last_intent == "price":
-                self.context_manager.increment_bargain_count(send_user_id, item_id)
-                bargain_count = self.context_manager.get_bargain_count(send_user_id, item_id)
+            if intent == "price":
+                bargain_count = await self.conversations.increment_bargain_count(send_user_id, item_id)
                 logger.info(f"用户 {send_user_name} 对商品 {item_id} 的议价次数: {bargain_count}")
             
-            # 添加机器人回复到上下文
-            self.context_manager.add_message(send_user_id, item_id, "assistant", bot_reply)
+            # 添加机器人回复到上下文，同时记录意图供本地分类器训练
+            await self.conversations.add_message(send_user_id, item_id, "assistant", bot_reply, intent=intent)
+            await self.conversations.set_item_snapshot(send_user_id, item_id, item_description)
             
             logger.info(f"机器人回复: {bot_reply}")
-            cid = message["1"]["2"].split('@')[0]
-            await self.send_msg(websocket, cid, send_user_id, bot_reply)
+            self.send_msg(cid, send_user_id, bot_reply)
             
         except Exception as e:
             logger.error(f"处理消息时发生错误: {str(e)}")
+            return False
 
     async def send_heartbeat(self, ws):
         """发送心跳包并等待响应"""
         try:
             heartbeat_mid = generate_mid()
-            heartbeat_msg = {
-                "lwp": "/!",
-                "headers": {
-                    "mid": heartbeat_mid
-                }
-            }
-            await ws.send(json.dumps(heartbeat_msg))
+            await ws.send(build_heartbeat(heartbeat_mid))
             self.last_heartbeat_time = time.time()
             logger.debug("心跳包已发送")
             return heartbeat_mid
@@ -508,6 +532,8 @@ class XianyuLive:
                 # 检查上次心跳响应时间，如果超时则认为连接已断开
                 if (current_time - self.last_heartbeat_response) > (self.heartbeat_interval + self.heartbeat_timeout):
                     logger.warning("心跳响应超时，可能连接已断开")
+                    # 主动关闭连接，让主循环进入重连流程
+                    await ws.close()
                     break
                 
                 await asyncio.sleep(1)
@@ -515,6 +541,18 @@ class XianyuLive:
                 logger.error(f"心跳循环出错: {e}")
                 break
 
+    def is_reg_rejected(self, message_data):
+        """判断是否为/reg注册请求的失败响应"""
+        try:
+            return (
+                self.reg_mid is not None
+                and message_data.get("headers", {}).get("mid") == self.reg_mid
+                and "code" in message_data
+                and message_data["code"] != 200
+            )
+        except Exception:
+            return False
+
     async def handle_heartbeat_response(self, message_data):
         """处理心跳响应"""
         try:
@@ -532,12 +570,50 @@ class XianyuLive:
             logger.error(f"处理心跳响应出错: {e}")
         return False
 
+    def stats(self):
+        """获取本账号的运行指标"""
+        return {
+            "connected": self.reconnect_manager.connected_at is not None,
+            "dispatch_pending": self.dispatcher.pending_count(),
+            "dispatch_active": self.dispatcher.active_count(),
+            "dispatch_dropped": self.dispatcher.dropped_count,
+            "reconnect": self.reconnect_manager.stats(),
+            "sync_pending": self.sync_cursor.pending_count(),
+            "dedup": self.deduplicator.stats(),
+            "send_queue": self.send_queue.stats(),
+            "debounce": self.debouncer.stats(),
+            "summaries": self.context_builder.stats(),
+            "conversations": self.conversations.stats(),
+            "chat_db": self.chat_db.stats(),
+        }
+
+    async def close(self):
+        """停止后台任务，保存同步游标并关闭数据库连接"""
+        await self.stop_heartbeat()
+        await self.token_manager.stop_auto_refresh()
+        await self.debouncer.stop()
+        await self.dispatcher.stop()
+        await self.send_queue.stop()
+        await self.context_builder.close()
+        await self.conversations.close()
+        await self.chat_db.close()
+
+    async def stop_heartbeat(self):
+        """停止心跳任务"""
+        if self.heartbeat_task:
+            self.heartbeat_task.cancel()
+            try:
+                await self.heartbeat_task
+            except asyncio.CancelledError:
+                pass
+            self.heartbeat_task = None
+
     async def main(self):
+        self.conversations.start()
         while True:
             try:
                 headers = {
                     "Cookie": self.cookies_str,
-                    "Host": "wss-goofish.dingtalk.com",
                     "Connection": "Upgrade",
                     "Pragma": "no-cache",
                     "Cache-Control": "no-cache",
@@ -550,6 +626,9 @@ class XianyuLive:
                 async with websockets.connect(self.base_url, extra_headers=headers) as websocket:
                     self.ws = websocket
                     await self.init(websocket)
+                    self.reconnect_manager.record_connected()
+                    self.send_queue.attach(websocket)
+                    self.token_manager.start_auto_refresh()
                     
                     # 初始化心跳时间
                     self.last_heartbeat_time = time.time()
@@ -560,66 +639,68 @@ class XianyuLive:
                     
                     async for message in websocket:
                         try:
-                            message_data = json.loads(message)
+                            message_data = frame_codec.loads(message)
+                            
+                            # 注册被拒绝时，缓存的token可能已失效
+                            if self.is_reg_rejected(message_data):
+                                logger.warning(f"连接注册失败，清除缓存的accessToken: {message_data.get('code')}")
+                                self.token_manager.invalidate()
+                                await websocket.close()
+                                break
                             
                             # 处理心跳响应
                             if await self.handle_heartbeat_response(message_data):
                                 continue
                             
-                            # 发送通用ACK响应
-                            if "headers" in message_data and "mid" in message_data["headers"]:
-                                ack = {
-                                    "code": 200,
-                                    "headers": {
-                                        "mid": message_data["headers"]["mid"],
-                                        "sid": message_data["headers"].get("sid", "")
-                                    }
-                                }
-                                # 复制其他可能的header字段
-                                for key in ["app-key", "ua", "dt"]:
-                                    if key in message_data["headers"]:
-                                        ack["headers"][key] = message_data["headers"][key]
-                                await websocket.send(json.dumps(ack))
+                            # 每个入站mid只发送一次ACK
+                            ack = build_ack(message_data)
+                            if ack:
+                                await websocket.send(ack)
                             
                             # 处理其他消息
                             await self.handle_message(message_data, websocket)
                                 
-                        except json.JSONDecodeError:
+                        except frame_codec.JSONDecodeError:
                             logger.error("消息解析失败")
                         except Exception as e:
                             logger.error(f"处理消息时发生错误: {str(e)}")
                             logger.debug(f"原始消息: {message}")
 
+                logger.warning("WebSocket连接已断开")
+
             except websockets.exceptions.ConnectionClosed:
                 logger.warning("WebSocket连接已关闭")
-                if self.heartbeat_task:
-                    self.heartbeat_task.cancel()
-                    try:
-                        await self.heartbeat_task
-                    except asyncio.CancelledError:
-                        pass
-                await asyncio.sleep(5)  # 等待5秒后重连
                 
             except Exception as e:
                 logger.error(f"连接发生错误: {e}")
-                if self.heartbeat_task:
-                    self.heartbeat_task.cancel()
-                    try:
-                        await self.heartbeat_task
-                    except asyncio.CancelledError:
-                        pass
-                await asyncio.sleep(5)  # 等待5秒后重连
+
+            # 断线后暂停发送队列、保存同步游标，并按指数退避等待重连
+            self.send_queue.detach()
+            await self.stop_heartbeat()
+            await self.sync_cursor.aflush(self.chat_db)
+            self.reconnect_manager.record_disconnect()
+            delay = self.reconnect_manager.next_delay()
+            logger.info(f"{delay:.1f} 秒后重连，重连统计: {self.reconnect_manager.stats()}，去重统计: {self.deduplicator.stats()}")
+            await asyncio.sleep(delay)
 
 class XianyuApp:
     def __init__(self):
         self.config = ConfigManager()
-        self.login_manager = LoginManager(self.config)
+        # 登录验证和XianyuLive共用一份服务，重连时也不重复创建连接池
+        self.shared = SharedServices.create()
+        self.login_manager = LoginManager(self.config, self.shared.xianyu)
         self.xianyu_live = None
         self.cookie_manager = CookieManager()
         self.cookie_injector = CookieInjector()
         
     async def start(self):
         """启动应用"""
+        try:
+            await self._run()
+        finally:
+            await self.shared.close()
+
+    async def _run(self):
         try:
             # 1. 获取启动选项
             no_previous_login = False
@@ -653,7 +734,9 @@ class XianyuApp:
                     
                 # 4. 启动主程序
                 try:
-                    self.xianyu_live = XianyuLive(cookies_str)
+                    self.xianyu_live = XianyuLive(
+                        cookies_str, token_manager=self.login_manager.token_manager, shared=self.shared
+                    )
                     await self.xianyu_live.main()
                 except Exception as e:
                     logger.error(f"连接发生错误: {e}")
@@ -676,6 +759,15 @@ def handle_exit(signum=None, frame=None):
     logger.remove()
     # 关闭所有连接
     if hasattr(app, 'xianyu_live') and app.xianyu_live:
+        # 写入尚未落盘的会话状态、去重记录、同步游标和意图分类缓存
+        try:
+            app.xianyu_live.conversations.flush()
+            app.xianyu_live.deduplicator.flush()
+            app.xianyu_live.sync_cursor.flush()
+            if app.xianyu_live.shared.classify_cache:
+                app.xianyu_live.shared.classify_cache.flush()
+        except Exception:
+            pass
         try:
             loop = asyncio.get_event_loop()
             if loop.is_running():
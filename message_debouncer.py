@@ -0,0 +1,117 @@
+import asyncio
+import time
+from loguru import logger
+
+
+class PendingBurst:
+    __slots__ = ("sender_id", "events", "started_at", "deadline", "timer")
+
+    def __init__(self, sender_id, started_at):
+        self.sender_id = sender_id
+        self.events = []
+        self.started_at = started_at
+        self.deadline = started_at
+        self.timer = None
+
+
+class MessageDebouncer:
+    """
+    会话级消息防抖器
+
+    买家常在几秒内连发多条消息，逐条生成回复既浪费大模型调用又会产生重叠的回复。
+    防抖器把同一会话内连续到达的消息暂存起来，窗口内没有新消息时再合并为一轮交给
+    回调；买家仍在输入时窗口会继续延长，但总等待时间不超过max_window。
+    """
+
+    def __init__(self, flush, window=1.5, typing_window=3.0, max_window=6.0):
+        """
+        初始化防抖器
+
+        Args:
+            flush: 窗口结束时调用的函数，参数为(会话键, 按到达顺序排列的消息列表)
+            window: 收到消息后继续等待新消息的时间（秒），为0时不做防抖
+            typing_window: 收到“正在输入”状态后延长的等待时间（秒）
+            max_window: 从第一条消息起的最长等待时间（秒）
+        """
+        self.flush_callback = flush
+        self.window = window
+        self.typing_window = typing_window
+        self.max_window = max_window
+        self.pending = {}  # 会话键 -> PendingBurst
+
+        self.received_count = 0
+        self.flushed_count = 0
+        self.typing_extensions = 0
+
+    @property
+    def saved_calls(self):
+        """合并掉的消息数，即少调用的回复生成次数"""
+        return self.received_count - self.flushed_count - sum(len(p.events) for p in self.pending.values())
+
+    def _extend(self, burst, delay):
+        cap = burst.started_at + self.max_window
+        burst.deadline = min(cap, max(burst.deadline, time.monotonic() + delay))
+
+    def add(self, key, sender_id, event):
+        """暂存一条消息，窗口内的后续消息会与它合并"""
+        self.received_count += 1
+        if self.window <= 0:
+            self.flushed_count += 1
+            self.flush_callback(key, [event])
+            return
+
+        burst = self.pending.get(key)
+        if burst is None:
+            burst = self.pending[key] = PendingBurst(sender_id, time.monotonic())
+            burst.timer = asyncio.create_task(self._timer(key, burst))
+        burst.events.append(event)
+        self._extend(burst, self.window)
+
+    def touch(self, sender_id):
+        """对方正在输入，延长其所有待合并会话的窗口"""
+        for burst in self.pending.values():
+            if burst.sender_id == sender_id:
+                self._extend(burst, self.typing_window)
+                self.typing_extensions += 1
+
+    def flush(self, key):
+        """立即结束会话的窗口（如收到图片等不参与合并的消息时，保证顺序）"""
+        burst = self.pending.pop(key, None)
+        if burst is None:
+            return
+        if burst.timer and burst.timer is not asyncio.current_task():
+            burst.timer.cancel()
+        self.flushed_count += 1
+        if len(burst.events) > 1:
+            logger.info(f"会话 {key} 合并了 {len(burst.events)} 条连续消息")
+        try:
+            self.flush_callback(key, burst.events)
+        except Exception as e:
+            logger.error(f"提交合并消息失败: {e}")
+
+    async def _timer(self, key, burst):
+        while True:
+            delay = burst.deadline - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        if self.pending.get(key) is burst:
+            self.flush(key)
+
+    def stats(self):
+        """获取防抖统计"""
+        return {
+            "pending": len(self.pending),
+            "received": self.received_count,
+            "flushed": self.flushed_count,
+            "saved_calls": self.saved_calls,
+            "typing_extensions": self.typing_extensions,
+        }
+
+    async def stop(self):
+        """取消所有等待中的窗口，未提交的消息不再处理"""
+        timers = [burst.timer for burst in self.pending.values() if burst.timer]
+        self.pending.clear()
+        for timer in timers:
+            timer.cancel()
+        await asyncio.gather(*timers, return_exceptions=True)
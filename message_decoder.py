@@ -0,0 +1,155 @@
+import binascii
+import json
+
+from utils.xianyu_utils import decrypt
+
+
+# 消息类型
+KIND_CHAT = "chat"          # 文本聊天消息
+KIND_IMAGE = "image"        # 图片消息
+KIND_VOICE = "voice"        # 语音消息
+KIND_SPECIAL = "special"    # 其他方括号格式的特殊消息（卡片、视频等）
+KIND_TYPING = "typing"      # 对方正在输入
+KIND_OTHER = "other"        # 其余无需处理的消息
+
+
+class MessageEvent:
+    """解码后的消息事件，整条处理链路只读取这里的字段"""
+
+    __slots__ = (
+        "kind", "cid", "sender_id", "sender_name", "item_id", "text",
+        "image", "create_time", "message_id", "special_type",
+    )
+
+    def __init__(self, kind, cid=None, sender_id=None, sender_name=None, item_id=None, text=None,
+                 image=None, create_time=None, message_id=None, special_type=None):
+        self.kind = kind
+        self.cid = cid
+        self.sender_id = sender_id
+        self.sender_name = sender_name
+        self.item_id = item_id
+        self.text = text
+        self.image = image
+        self.create_time = create_time
+        self.message_id = message_id
+        self.special_type = special_type
+
+    def __repr__(self):
+        return f"MessageEvent(kind={self.kind!r}, cid={self.cid!r}, sender_id={self.sender_id!r}, text={self.text!r})"
+
+
+def sync_entries(frame):
+    """获取同步包中的数据列表，不是同步包时返回空列表"""
+    body = frame.get("body")
+    if not isinstance(body, dict):
+        return []
+    package = body.get("syncPushPackage")
+    if not isinstance(package, dict):
+        return []
+    data = package.get("data")
+    return data if isinstance(data, list) else []
+
+
+def decode_payload(data):
+    """
+    解码同步数据
+
+    明文消息是base64编码的JSON（以"ey"开头，即'{"'的编码），直接解析；
+    其余按加密消息走decrypt，不再靠异常在两种格式之间回退。
+    """
+    if data[:2] == "ey":
+        try:
+            return json.loads(binascii.a2b_base64(data).decode("utf-8"))
+        except ValueError:
+            pass
+    return json.loads(decrypt(data))
+
+
+def _extract_image(body):
+    """提取图片信息"""
+    try:
+        image_data = json.loads(body["6"]["3"]["5"])
+        image_info = image_data["image"]["pics"][0]
+        return {
+            "url": image_info["url"],
+            "width": image_info["width"],
+            "height": image_info["height"],
+            "type": image_info["type"]
+        }
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+def _special_type(reminder):
+    """识别图片、语音等特殊消息，普通消息返回None"""
+    detail_notice = reminder.get("detailNotice", "")
+    reminder_content = reminder.get("reminderContent", "")
+    if detail_notice[:1] == "[" and detail_notice[-1:] == "]":
+        return detail_notice[1:-1]
+    if reminder_content[:1] == "[" and reminder_content[-1:] == "]":
+        return reminder_content[1:-1]
+    if "语音" in detail_notice or "语音" in reminder_content:
+        return "语音"
+    return None
+
+
+def decode_message(message):
+    """
+    一次遍历解析消息，生成MessageEvent
+
+    Args:
+        message: 解码后的消息字典
+
+    Returns:
+        MessageEvent: 消息事件
+    """
+    body = message.get("1") if isinstance(message, dict) else None
+
+    # 正在输入状态
+    if isinstance(body, list):
+        if body and isinstance(body[0], dict):
+            user = body[0].get("1")
+            if isinstance(user, str) and "@goofish" in user:
+                return MessageEvent(KIND_TYPING, sender_id=user.split("@")[0])
+        return MessageEvent(KIND_OTHER)
+
+    if not isinstance(body, dict):
+        return MessageEvent(KIND_OTHER)
+
+    cid = body.get("2")
+    if isinstance(cid, str):
+        cid = cid.split("@", 1)[0]
+    create_time = body.get("5")
+    if create_time is not None:
+        create_time = int(create_time)
+    message_id = body.get("3")
+
+    reminder = body.get("10")
+    if not isinstance(reminder, dict):
+        return MessageEvent(KIND_OTHER, cid, None, None, None, None, None, create_time, message_id)
+
+    text = reminder.get("reminderContent")
+    url_info = reminder.get("reminderUrl", "")
+    item_id = url_info.split("itemId=", 1)[1].split("&", 1)[0] if "itemId=" in url_info else None
+
+    image = None
+    special_type = _special_type(reminder)
+    if special_type is None:
+        kind = KIND_CHAT if text is not None else KIND_OTHER
+    elif special_type == "图片":
+        kind = KIND_IMAGE
+        image = _extract_image(body)
+    elif special_type == "语音":
+        kind = KIND_VOICE
+    else:
+        kind = KIND_SPECIAL
+
+    return MessageEvent(
+        kind, cid, reminder.get("senderUserId"), reminder.get("reminderTitle"), item_id,
+        text, image, create_time, message_id, special_type
+    )
+
+
+def decode_sync_entry(sync_data):
+    """解码单条同步数据并生成MessageEvent"""
+    return decode_message(decode_payload(sync_data["data"]))
@@ -0,0 +1,188 @@
+import hashlib
+import os
+import sqlite3
+import time
+from collections import deque
+from loguru import logger
+
+
+def message_key(event):
+    """
+    获取消息的去重键
+
+    优先使用消息ID，缺失时用会话、发送者、时间和内容组合出一个键
+    """
+    if event.message_id:
+        return str(event.message_id)
+    return "{}:{}:{}:{}".format(
+        event.cid or "",
+        event.create_time or "",
+        event.sender_id or "",
+        hashlib.md5(str(event.text or "").encode("utf-8")).hexdigest()
+    )
+
+
+class MessageDeduplicator:
+    """
+    消息去重器
+
+    用固定容量的环形缓冲记住最近收到的消息ID，内存占用有上限；
+    可选写入SQLite，重启后仍能识别服务器重推的旧消息。只有处理完成（已回复）的消息
+    才会落盘，处理途中崩溃时重启后仍会重新处理；落盘按批次在数据库线程中执行。
+    """
+
+    def __init__(self, capacity=10000, db_path=None, account_id=""):
+        """
+        初始化消息去重器
+
+        Args:
+            capacity: 记住的最近消息数量
+            db_path: SQLite数据库路径，为None时只在内存中去重
+            account_id: 账号ID，用于区分不同账号的记录
+        """
+        self.capacity = capacity
+        self.db_path = db_path
+        self.account_id = account_id
+        self.ring = deque()
+        self.keys = set()
+        self.pending = []  # 已处理完成、等待落盘的(键, 时间)
+        self.persisted = 0
+        self.hits = 0
+        self.misses = 0
+
+        if self.db_path:
+            self._init_db()
+            self._load()
+
+    def _init_db(self):
+        """初始化去重表"""
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS processed_messages (
+                account_id TEXT NOT NULL,
+                message_key TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (account_id, message_key)
+            )
+            ''')
+            conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_processed_created ON processed_messages (account_id, created_at)
+            ''')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _load(self):
+        """加载最近的记录，并清理超出容量的旧记录"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            rows = conn.execute(
+                "SELECT message_key, created_at FROM processed_messages WHERE account_id = ? "
+                "ORDER BY created_at DESC LIMIT ?",
+                (self.account_id, self.capacity)
+            ).fetchall()
+            for key, _ in reversed(rows):
+                self._remember(key)
+            if len(rows) == self.capacity:
+                conn.execute(
+                    "DELETE FROM processed_messages WHERE account_id = ? AND created_at < ?",
+                    (self.account_id, rows[-1][1])
+                )
+                conn.commit()
+            logger.info(f"已加载 {len(rows)} 条消息去重记录")
+        except Exception as e:
+            logger.error(f"加载消息去重记录失败: {e}")
+        finally:
+            conn.close()
+
+    def _remember(self, key):
+        self.ring.append(key)
+        self.keys.add(key)
+        while len(self.ring) > self.capacity:
+            self.keys.discard(self.ring.popleft())
+
+    def mark_handled(self, key):
+        """消息处理完成后调用，记录稍后批量落盘"""
+        if self.db_path:
+            self.pending.append((key, time.time()))
+
+    def _write(self, batch):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO processed_messages (account_id, message_key, created_at) VALUES (?, ?, ?)",
+                    [(self.account_id, key, created_at) for key, created_at in batch]
+                )
+                # 每写入一轮容量的记录，清理一次超出容量的旧记录
+                if self.persisted // self.capacity != (self.persisted + len(batch)) // self.capacity:
+                    conn.execute(
+                        """
+                        DELETE FROM processed_messages WHERE account_id = ? AND message_key NOT IN (
+                            SELECT message_key FROM processed_messages WHERE account_id = ?
+                            ORDER BY created_at DESC LIMIT ?
+                        )
+                        """,
+                        (self.account_id, self.account_id, self.capacity)
+                    )
+        finally:
+            conn.close()
+        self.persisted += len(batch)
+
+    def flush(self):
+        """在当前线程写入待落盘的记录，用于事件循环已停止时"""
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        try:
+            self._write(batch)
+        except Exception as e:
+            logger.error(f"保存消息去重记录失败: {e}")
+            self.pending[:0] = batch
+
+    async def aflush(self, db):
+        """
+        由数据库写线程批量写入待落盘的记录
+
+        Args:
+            db: AsyncChatContextManager，写入与聊天记录共用同一个写线程
+        """
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        try:
+            await db.submit("dedup_flush", self._write, batch)
+        except Exception as e:
+            logger.error(f"保存消息去重记录失败: {e}")
+            self.pending[:0] = batch
+
+    def is_duplicate(self, key):
+        """
+        检查消息是否已收到过，未收到过时在内存中记录下来（落盘见mark_handled）
+
+        Args:
+            key: 消息去重键
+
+        Returns:
+            bool: 是否为重复消息
+        """
+        if key in self.keys:
+            self.hits += 1
+            return True
+        self.misses += 1
+        self._remember(key)
+        return False
+
+    def stats(self):
+        """获取去重命中统计"""
+        return {
+            "size": len(self.ring),
+            "hits": self.hits,
+            "misses": self.misses,
+            "pending": len(self.pending),
+        }
@@ -0,0 +1,90 @@
+import asyncio
+from collections import deque
+from loguru import logger
+
+
+class MessageDispatcher:
+    """
+    会话级消息分发器
+
+    按会话ID(cid)把消息分发到独立的异步worker：同一会话内严格按到达顺序处理，
+    不同会话之间并行处理，并通过信号量限制同时处理的会话数量。
+    """
+
+    def __init__(self, handler, max_workers=8, max_queue_size=50, on_drop=None):
+        """
+        初始化消息分发器
+
+        Args:
+            handler: 处理单条消息的协程函数
+            max_workers: 同时处理消息的最大会话数
+            max_queue_size: 单个会话允许积压的最大消息数，超出时丢弃最旧的消息
+            on_drop: 消息被丢弃时调用，参数与handler相同
+        """
+        self.handler = handler
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.on_drop = on_drop
+        self.semaphore = asyncio.Semaphore(max_workers)
+        self.queues = {}   # cid -> 待处理消息队列
+        self.workers = {}  # cid -> worker任务
+        self.dropped_count = 0
+
+    def dispatch(self, key, *args):
+        """
+        将消息投递到对应会话的队列，必要时启动该会话的worker
+
+        Args:
+            key: 会话键（通常为cid）
+            *args: 传递给handler的参数
+        """
+        queue = self.queues.get(key)
+        if queue is None:
+            queue = self.queues[key] = deque()
+
+        if len(queue) >= self.max_queue_size:
+            dropped = queue.popleft()
+            self.dropped_count += 1
+            if self.on_drop:
+                self.on_drop(*dropped)
+            logger.warning(f"会话 {key} 积压消息过多，已丢弃最旧的一条")
+        queue.append(args)
+
+        if key not in self.workers:
+            self.workers[key] = asyncio.create_task(self._worker(key))
+
+    async def _worker(self, key):
+        """按顺序处理单个会话的消息，队列清空后自动退出"""
+        queue = self.queues[key]
+        try:
+            while queue:
+                args = queue.popleft()
+                async with self.semaphore:
+                    try:
+                        await self.handler(*args)
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        logger.error(f"会话 {key} 处理消息时发生错误: {e}")
+        finally:
+            # 队列为空与删除之间没有await，不会漏掉新投递的消息
+            self.workers.pop(key, None)
+            self.queues.pop(key, None)
+
+    def pending_count(self):
+        """获取所有会话中待处理的消息总数"""
+        return sum(len(queue) for queue in self.queues.values())
+
+    def active_count(self):
+        """获取当前存在worker的会话数"""
+        return len(self.workers)
+
+    async def stop(self):
+        """取消所有worker并清空队列"""
+        workers = list(self.workers.values())
+        for task in workers:
+            task.cancel()
+        if workers:
+            await asyncio.gather(*workers, return_exceptions=True)
+        self.workers.clear()
+        self.queues.clear()
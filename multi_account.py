@@ -0,0 +1,152 @@
+"""
+多账号运行入口
+
+在一个事件循环中同时运行多个卖家账号的XianyuLive会话。各账号共享大模型连接池、
+商品缓存和提示词，cookie、token和聊天数据库按账号隔离。
+
+用法:
+    python multi_account.py config/accounts.json
+"""
+import asyncio
+import json
+import os
+import signal
+import sys
+from loguru import logger
+from dotenv import load_dotenv
+
+from main import XianyuLive
+from shared_services import SharedServices
+from token_manager import TokenManager
+from utils.xianyu_utils import trans_cookies, generate_device_id
+
+
+def load_accounts(config_path):
+    """
+    读取账号配置文件
+
+    配置格式：{"accounts": [{"name": "shop_a", "cookies": "..."}, {"name": "shop_b", "cookies_env": "COOKIES_STR_B"}]}
+    cookies_env表示从环境变量读取cookie，避免把cookie写进配置文件。
+
+    Returns:
+        list: [{"name": 账号名, "cookies": cookie字符串}]
+    """
+    with open(config_path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+
+    accounts = []
+    for account in config.get("accounts", []):
+        name = account.get("name")
+        cookies_str = account.get("cookies") or os.getenv(account.get("cookies_env", ""), "")
+        if not name or not cookies_str:
+            logger.error(f"账号配置不完整，已跳过: {name}")
+            continue
+        accounts.append({"name": name, "cookies": cookies_str})
+    return accounts
+
+
+def account_db_path(name, data_dir="data"):
+    """每个账号使用独立的聊天数据库"""
+    return os.path.join(data_dir, "accounts", name, "chat_history.db")
+
+
+class MultiAccountRunner:
+    """多账号运行器"""
+
+    def __init__(self, accounts, data_dir="data"):
+        self.accounts = accounts
+        self.data_dir = data_dir
+        self.shared = None
+        self.sessions = {}  # 账号名 -> XianyuLive
+
+    async def _create_session(self, account):
+        """校验账号token并创建会话，失败返回None"""
+        name = account["name"]
+        try:
+            cookies = trans_cookies(account["cookies"])
+            token_manager = TokenManager(
+                self.shared.xianyu, cookies, generate_device_id(cookies["unb"]),
+                ttl=int(os.getenv("TOKEN_TTL", "3600"))
+            )
+            await token_manager.get_token()
+        except Exception as e:
+            logger.error(f"账号 {name} token验证失败: {e}")
+            return None
+
+        return XianyuLive(
+            account["cookies"],
+            token_manager=token_manager,
+            shared=self.shared,
+            db_path=account_db_path(name, self.data_dir)
+        )
+
+    def stats(self):
+        """获取所有账号及共享缓存的运行指标"""
+        return {
+            "accounts": {name: live.stats() for name, live in self.sessions.items()},
+            "item_cache": self.shared.item_cache.stats() if self.shared else None,
+            "llm_in_flight": self.shared.llm_client.in_flight if self.shared else 0,
+            "bot": self.shared.bot.stats() if self.shared else None,
+            "intent_router": self.shared.bot.router.stats() if self.shared else None,
+            "reply_cache": self.shared.reply_cache.stats() if self.shared and self.shared.reply_cache else None,
+        }
+
+    async def _run_session(self, name, live):
+        """运行单个账号，异常退出时记录日志，不影响其他账号"""
+        try:
+            await live.main()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"账号 {name} 运行出错: {e}")
+
+    async def run(self):
+        """启动所有账号并等待运行结束"""
+        self.shared = SharedServices.create(os.path.join(self.data_dir, "shared.db"))
+        try:
+            for account in self.accounts:
+                live = await self._create_session(account)
+                if live:
+                    self.sessions[account["name"]] = live
+                    logger.info(f"账号 {account['name']} 已就绪")
+
+            if not self.sessions:
+                logger.error("没有可用的账号")
+                return
+
+            logger.info(f"共启动 {len(self.sessions)} 个账号")
+            await asyncio.gather(*(
+                self._run_session(name, live) for name, live in self.sessions.items()
+            ))
+        finally:
+            for live in self.sessions.values():
+                await live.close()
+            await self.shared.close()
+
+
+async def run_until_terminated(runner):
+    """运行所有账号，收到SIGTERM时取消主任务，让各账号写入未落盘的数据后退出"""
+    main_task = asyncio.current_task()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, main_task.cancel)
+    try:
+        await runner.run()
+    except asyncio.CancelledError:
+        logger.info("系统正在安全退出...")
+
+
+def main():
+    load_dotenv()
+    config_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join("config", "accounts.json")
+    accounts = load_accounts(config_path)
+    if not accounts:
+        logger.error(f"配置文件中没有有效账号: {config_path}")
+        return
+
+    try:
+        asyncio.run(run_until_terminated(MultiAccountRunner(accounts)))
+    except KeyboardInterrupt:
+        logger.info("系统正在安全退出...")
+
+
+if __name__ == "__main__":
+    main()
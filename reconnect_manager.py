@@ -0,0 +1,231 @@
+import heapq
+import os
+import random
+import sqlite3
+import time
+from collections import Counter
+from loguru import logger
+
+
+class ReconnectManager:
+    """
+    断线重连管理器
+
+    使用带抖动的指数退避计算重连等待时间，连接稳定一段时间后重置退避；
+    同时记录断线次数、恢复耗时和断线期间补收的消息数，便于观察重连效果。
+    """
+
+    def __init__(self, base_delay=1.0, max_delay=60.0, stable_after=60.0):
+        """
+        初始化重连管理器
+
+        Args:
+            base_delay: 首次重连的基础等待时间（秒）
+            max_delay: 最大等待时间（秒）
+            stable_after: 连接持续多久视为稳定并重置退避（秒）
+        """
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stable_after = stable_after
+        self.attempt = 0
+        self.connected_at = None
+        self.disconnected_at = None
+
+        # 统计指标
+        self.disconnect_count = 0
+        self.last_recovery_time = None
+        self.total_recovery_time = 0.0
+        self.backlog_messages = 0    # 重连后补收到的断线期间消息
+        self.expired_messages = 0    # 因超过时效被丢弃的消息
+
+    def next_delay(self):
+        """计算下一次重连前的等待时间（equal jitter）"""
+        cap = min(self.max_delay, self.base_delay * (2 ** self.attempt))
+        self.attempt += 1
+        return cap / 2 + random.uniform(0, cap / 2)
+
+    def record_connected(self):
+        """记录连接建立，并计算本次恢复耗时"""
+        now = time.time()
+        self.connected_at = now
+        if self.disconnected_at is not None:
+            self.last_recovery_time = now - self.disconnected_at
+            self.total_recovery_time += self.last_recovery_time
+            logger.info(f"连接已恢复，耗时 {self.last_recovery_time:.1f} 秒")
+
+    def record_disconnect(self):
+        """记录连接断开，连接已稳定时重置退避"""
+        now = time.time()
+        if self.connected_at is not None and now - self.connected_at >= self.stable_after:
+            self.attempt = 0
+        # 连续重连失败时保留最初的断线时间
+        if self.connected_at is not None or self.disconnected_at is None:
+            self.disconnected_at = now
+            self.disconnect_count += 1
+        self.connected_at = None
+
+    def record_message(self, create_time_ms):
+        """记录收到的消息，统计其中属于断线期间的补收消息"""
+        if (
+            self.disconnected_at is not None
+            and self.connected_at is not None
+            and create_time_ms / 1000 < self.connected_at
+        ):
+            self.backlog_messages += 1
+
+    def stats(self):
+        """获取重连统计"""
+        return {
+            "disconnects": self.disconnect_count,
+            "last_recovery_time": self.last_recovery_time,
+            "avg_recovery_time": (self.total_recovery_time / self.disconnect_count) if self.disconnect_count else None,
+            "backlog_messages": self.backlog_messages,
+            "expired_messages": self.expired_messages,
+        }
+
+
+class SyncCursorStore:
+    """
+    同步游标存储
+
+    按账号持久化最后处理的同步位置(pts/seq)，重新注册时从该位置继续同步，
+    避免断线期间的消息被跳过。消息收到时调用begin，处理完成后调用complete；
+    游标只推进到所有更早的消息都已处理完的位置，处理途中崩溃时重启后会重新收到这些消息。
+    """
+
+    def __init__(self, account_id, db_path="data/chat_history.db"):
+        """
+        初始化同步游标存储
+
+        Args:
+            account_id: 账号ID
+            db_path: SQLite数据库文件路径
+        """
+        self.account_id = account_id
+        self.db_path = db_path
+        self.pts = None
+        self.seq = 0
+        self.updated_at = None
+        self._dirty = False
+        self._inflight = Counter()  # 已收到、尚未处理完的pts
+        self._done = []             # 已处理完、但更早的消息仍在处理中的(pts, seq)，小根堆
+        self._init_db()
+        self._load()
+
+    def _init_db(self):
+        """初始化游标表"""
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS sync_cursor (
+                account_id TEXT PRIMARY KEY,
+                pts INTEGER NOT NULL,
+                seq INTEGER DEFAULT 0,
+                updated_at REAL NOT NULL
+            )
+            ''')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _load(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            row = conn.execute(
+                "SELECT pts, seq, updated_at FROM sync_cursor WHERE account_id = ?",
+                (self.account_id,)
+            ).fetchone()
+            if row:
+                self.pts, self.seq, self.updated_at = row
+                logger.info(f"已加载同步游标: pts={self.pts}")
+        except Exception as e:
+            logger.error(f"加载同步游标失败: {e}")
+        finally:
+            conn.close()
+
+    def begin(self, pts):
+        """收到一条同步消息"""
+        if pts is not None:
+            self._inflight[int(pts)] += 1
+
+    def complete(self, pts, seq=None):
+        """一条同步消息处理完成（或无需处理），推进到不会跳过未完成消息的位置"""
+        if pts is None:
+            return
+        pts = int(pts)
+        self._inflight[pts] -= 1
+        if self._inflight[pts] <= 0:
+            del self._inflight[pts]
+        heapq.heappush(self._done, (pts, int(seq or 0)))
+        lowest = min(self._inflight) if self._inflight else None
+        while self._done and (lowest is None or self._done[0][0] < lowest):
+            self._advance(*heapq.heappop(self._done))
+
+    def _advance(self, pts, seq):
+        """推进同步游标（只前进不后退）"""
+        if self.pts is not None and pts <= self.pts:
+            return
+        self.pts = pts
+        self.seq = seq
+        self.updated_at = time.time()
+        self._dirty = True
+
+    def pending_count(self):
+        """已收到但尚未处理完的消息数"""
+        return sum(self._inflight.values())
+
+    def _write(self, row):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO sync_cursor (account_id, pts, seq, updated_at) VALUES (?, ?, ?, ?)",
+                    row
+                )
+        finally:
+            conn.close()
+
+    def flush(self):
+        """在当前线程写入未保存的游标，用于事件循环已停止时"""
+        if not self._dirty:
+            return
+        try:
+            self._write((self.account_id, self.pts, self.seq, self.updated_at))
+            self._dirty = False
+        except Exception as e:
+            logger.error(f"保存同步游标失败: {e}")
+
+    async def aflush(self, db):
+        """
+        由数据库写线程写入未保存的游标
+
+        Args:
+            db: AsyncChatContextManager，写入与聊天记录共用同一个写线程
+        """
+        if not self._dirty:
+            return
+        self._dirty = False
+        try:
+            await db.submit("sync_cursor_flush", self._write, (self.account_id, self.pts, self.seq, self.updated_at))
+        except Exception as e:
+            logger.error(f"保存同步游标失败: {e}")
+            self._dirty = True
+
+    def resume_point(self, max_age):
+        """
+        获取重新注册时使用的同步位置
+
+        Args:
+            max_age: 游标允许的最大年龄（秒），过旧时从当前时间开始同步
+
+        Returns:
+            tuple: (pts, seq)
+        """
+        now = time.time()
+        if self.pts is not None and self.updated_at and now - self.updated_at <= max_age:
+            return self.pts, self.seq
+        return int(now * 1000) * 1000, 0
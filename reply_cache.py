@@ -0,0 +1,167 @@
+import hashlib
+import math
+import time
+from collections import Counter, OrderedDict
+from loguru import logger
+
+from classify_cache import normalize_text
+from intent_classifier import char_ngrams
+
+
+def text_vector(text):
+    """归一化文本的字符n-gram向量，返回(向量, 模长)"""
+    vector = Counter(char_ngrams(normalize_text(text)))
+    return vector, math.sqrt(sum(v * v for v in vector.values()))
+
+
+def cosine(a, a_norm, b, b_norm):
+    if not a_norm or not b_norm:
+        return 0.0
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(k, 0) for k, v in a.items()) / (a_norm * b_norm)
+
+
+class ReplyCacheEntry:
+    __slots__ = ("question", "vector", "norm", "intent", "reply", "created_at")
+
+    def __init__(self, question, vector, norm, intent, reply, created_at):
+        self.question = question
+        self.vector = vector
+        self.norm = norm
+        self.intent = intent
+        self.reply = reply
+        self.created_at = created_at
+
+
+class ItemReplies:
+    """单个商品下缓存的问答"""
+
+    __slots__ = ("fingerprint", "entries")
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.entries = []
+
+
+class ReplyCache:
+    """
+    商品级常见问答回复缓存
+
+    同一商品被不同买家反复问到相同的问题（包邮吗、成色怎么样），答案并不会变。
+    按商品缓存问题和回复，新问题与已缓存问题的字符n-gram向量余弦相似度达到阈值时
+    直接复用回复。商品价格或描述变化（商品描述指纹改变）时自动清空该商品的缓存；
+    议价等依赖上下文的意图不缓存。
+    """
+
+    def __init__(self, threshold=0.8, ttl=86400, max_items=1000, max_entries_per_item=50,
+                 intents=("tech", "default")):
+        """
+        初始化回复缓存
+
+        Args:
+            threshold: 复用回复所需的最低相似度
+            ttl: 条目有效期（秒）
+            max_items: 最多缓存的商品数，超出时淘汰最久未使用的商品
+            max_entries_per_item: 每个商品最多缓存的问答数
+            intents: 允许缓存的意图
+        """
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_items = max_items
+        self.max_entries_per_item = max_entries_per_item
+        self.intents = set(intents)
+        self.items = OrderedDict()  # item_id -> ItemReplies
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def fingerprint(item_desc):
+        """商品描述指纹，描述中包含售价、描述、标题和分类，任一变化都会改变指纹"""
+        return hashlib.md5((item_desc or "").encode("utf-8")).hexdigest()
+
+    def _item(self, item_id, item_desc, create=False):
+        """取商品的缓存，商品信息已变化时先清空"""
+        fingerprint = self.fingerprint(item_desc)
+        item = self.items.get(item_id)
+        if item is not None and item.fingerprint != fingerprint:
+            logger.info(f"商品 {item_id} 信息已变化，清空 {len(item.entries)} 条缓存回复")
+            del self.items[item_id]
+            self.invalidations += 1
+            item = None
+        if item is None and create:
+            item = self.items[item_id] = ItemReplies(fingerprint)
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+        if item is not None:
+            self.items.move_to_end(item_id)
+        return item
+
+    def get(self, item_id, item_desc, question, intent=None):
+        """
+        查找可复用的回复
+
+        Args:
+            item_id: 商品ID
+            item_desc: 当前商品描述，用于检测商品信息变化
+            question: 买家消息
+            intent: 已知的意图，只匹配该意图下的缓存；为None或不允许缓存的意图时不查找
+
+        Returns:
+            tuple: (回复, 意图)，未命中返回None
+        """
+        if intent not in self.intents:
+            return None
+        item = self._item(item_id, item_desc)
+        if item is None:
+            self.misses += 1
+            return None
+
+        now = time.time()
+        item.entries = [e for e in item.entries if now - e.created_at < self.ttl]
+        vector, norm = text_vector(question)
+        best, best_score = None, self.threshold
+        for entry in item.entries:
+            if entry.intent != intent:
+                continue
+            score = cosine(vector, norm, entry.vector, entry.norm)
+            if score >= best_score:
+                best, best_score = entry, score
+
+        if best is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        logger.debug(f"复用缓存回复 (相似度 {best_score:.2f}): {best.question} -> {best.reply}")
+        return best.reply, best.intent
+
+    def put(self, item_id, item_desc, question, intent, reply):
+        """缓存一次生成的回复，不允许缓存的意图直接忽略"""
+        if intent not in self.intents or not reply:
+            return
+        vector, norm = text_vector(question)
+        if not norm:
+            return
+        item = self._item(item_id, item_desc, create=True)
+        item.entries.append(ReplyCacheEntry(question, vector, norm, intent, reply, time.time()))
+        if len(item.entries) > self.max_entries_per_item:
+            item.entries.pop(0)
+
+    def invalidate(self, item_id):
+        """移除指定商品的全部缓存回复"""
+        if self.items.pop(item_id, None) is not None:
+            self.invalidations += 1
+
+    def stats(self):
+        """获取缓存命中统计"""
+        lookups = self.hits + self.misses
+        return {
+            "items": len(self.items),
+            "entries": sum(len(item.entries) for item in self.items.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,218 @@
+import asyncio
+import time
+from collections import deque
+from loguru import logger
+
+
+class TokenBucket:
+    """令牌桶限速器"""
+
+    def __init__(self, rate, capacity):
+        """
+        Args:
+            rate: 每秒补充的令牌数
+            capacity: 桶容量，即允许的最大突发数
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def is_full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+    async def acquire(self):
+        """取走一个令牌，令牌不足时等待补充"""
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class OutboundMessage:
+    __slots__ = ("cid", "frame", "enqueued_at", "attempts", "future")
+
+    def __init__(self, cid, frame, future):
+        self.cid = cid
+        self.frame = frame
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+        self.future = future
+
+
+class SendQueue:
+    """
+    出站消息队列
+
+    所有回复都先进入队列，再由按会话划分的worker发送：同一会话内按入队顺序发送，
+    并同时受会话级和账号级令牌桶限速，避免突发时触发平台限流。连接断开时消息保留
+    在队列中，重连后继续发送；发送失败按次数重试，超过最大等待时间的消息会被丢弃。
+    """
+
+    def __init__(self, conversation_rate=1.0, conversation_burst=1, account_rate=5.0,
+                 account_burst=10, max_retries=3, retry_delay=1.0, max_age=300, latency_window=1000):
+        """
+        初始化发送队列
+
+        Args:
+            conversation_rate: 单个会话每秒允许发送的消息数
+            conversation_burst: 单个会话允许的突发消息数
+            account_rate: 整个账号每秒允许发送的消息数
+            account_burst: 整个账号允许的突发消息数
+            max_retries: 单条消息发送失败后的最大重试次数
+            retry_delay: 发送失败后重试前的等待时间（秒）
+            max_age: 消息在队列中的最长等待时间（秒），超时未发出则丢弃
+            latency_window: 统计发送延迟时保留的最近样本数
+        """
+        self.conversation_rate = conversation_rate
+        self.conversation_burst = conversation_burst
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_age = max_age
+
+        self.account_bucket = TokenBucket(account_rate, account_burst)
+        self._account_lock = asyncio.Lock()  # 让等待账号令牌的会话按先来后到排队
+        self.buckets = {}  # cid -> 会话令牌桶
+        self.queues = {}   # cid -> 待发送消息
+        self.workers = {}  # cid -> worker任务
+
+        self.ws = None
+        self._connected = asyncio.Event()
+
+        self.max_depth = 0
+        self.sent_count = 0
+        self.retry_count = 0
+        self.failed_count = 0
+        self.expired_count = 0
+        self.latencies = deque(maxlen=latency_window)
+
+    def attach(self, ws):
+        """连接建立后绑定websocket，恢复发送"""
+        self.ws = ws
+        self._connected.set()
+
+    def detach(self):
+        """连接断开后解绑websocket，队列中的消息等待重连"""
+        self.ws = None
+        self._connected.clear()
+
+    def enqueue(self, cid, frame):
+        """
+        将一帧消息加入对应会话的发送队列
+
+        Returns:
+            asyncio.Future: 消息发出后完成，发送失败或过期时带异常
+        """
+        future = asyncio.get_running_loop().create_future()
+        # 调用方通常不等待发送结果，失败已记录日志，这里取走异常避免asyncio告警
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        queue = self.queues.get(cid)
+        if queue is None:
+            queue = self.queues[cid] = deque()
+        queue.append(OutboundMessage(cid, frame, future))
+        self.max_depth = max(self.max_depth, self.pending_count())
+
+        if cid not in self.workers:
+            self.workers[cid] = asyncio.create_task(self._worker(cid))
+        return future
+
+    def pending_count(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def _bucket(self, cid):
+        bucket = self.buckets.get(cid)
+        if bucket is None:
+            # 已补满的令牌桶与新建的等价，会话较多时顺便清理
+            if len(self.buckets) >= 1000:
+                self.buckets = {key: b for key, b in self.buckets.items() if not b.is_full()}
+            bucket = self.buckets[cid] = TokenBucket(self.conversation_rate, self.conversation_burst)
+        return bucket
+
+    async def _wait_connection(self, timeout):
+        """等待可用连接，超时返回None"""
+        while self.ws is None or getattr(self.ws, "closed", False):
+            self._connected.clear()
+            try:
+                await asyncio.wait_for(self._connected.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self.ws
+
+    async def _send(self, message):
+        """发送单条消息，必要时等待重连并重试"""
+        bucket = self._bucket(message.cid)
+        while True:
+            remaining = self.max_age - (time.monotonic() - message.enqueued_at)
+            ws = await self._wait_connection(remaining) if remaining > 0 else None
+            if ws is None:
+                self.expired_count += 1
+                logger.warning(f"会话 {message.cid} 的消息超过 {self.max_age} 秒未能发出，已丢弃")
+                message.future.set_exception(TimeoutError("消息发送超时"))
+                return
+
+            await bucket.acquire()
+            async with self._account_lock:
+                await self.account_bucket.acquire()
+
+            try:
+                await ws.send(message.frame)
+            except Exception as e:
+                message.attempts += 1
+                if message.attempts > self.max_retries:
+                    self.failed_count += 1
+                    logger.error(f"会话 {message.cid} 的消息发送失败，已放弃: {e}")
+                    message.future.set_exception(e)
+                    return
+                self.retry_count += 1
+                logger.warning(f"会话 {message.cid} 的消息发送失败，第 {message.attempts} 次重试: {e}")
+                await asyncio.sleep(self.retry_delay)
+                continue
+
+            self.sent_count += 1
+            self.latencies.append(time.monotonic() - message.enqueued_at)
+            message.future.set_result(True)
+            return
+
+    async def _worker(self, cid):
+        """按顺序发送单个会话的消息，队列清空后自动退出"""
+        queue = self.queues[cid]
+        try:
+            while queue:
+                await self._send(queue[0])
+                queue.popleft()
+        finally:
+            for message in queue:
+                if not message.future.done():
+                    message.future.cancel()
+            self.queues.pop(cid, None)
+            self.workers.pop(cid, None)
+
+    def stats(self):
+        """获取发送队列指标"""
+        latencies = sorted(self.latencies)
+        return {
+            "pending": self.pending_count(),
+            "max_depth": self.max_depth,
+            "sent": self.sent_count,
+            "retries": self.retry_count,
+            "failed": self.failed_count,
+            "expired": self.expired_count,
+            "latency_avg": sum(latencies) / len(latencies) if latencies else None,
+            "latency_p95": latencies[int(len(latencies) * 0.95)] if latencies else None,
+            "latency_max": latencies[-1] if latencies else None,
+        }
+
+    async def stop(self):
+        """取消所有发送worker，未发出的消息随之取消"""
+        workers = list(self.workers.values())
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
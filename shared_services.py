@@ -0,0 +1,75 @@
+import os
+from loguru import logger
+
+from XianyuApis import AsyncXianyuApis
+from XianyuAgent import XianyuReplyBot
+from llm_client import LLMClient
+from image_processor import ImageProcessor
+from item_cache import ItemCache
+from classify_cache import ClassifyCache
+from reply_cache import ReplyCache
+
+
+class SharedServices:
+    """
+    可在多个账号之间共享的服务
+
+    包含mtop接口连接池、大模型连接池、提示词与Agent、图片识别、商品缓存和问答回复缓存。
+    这些对象都不保存账号相关的状态，同一进程内的多个XianyuLive共用一份即可。
+    """
+
+    def __init__(self, xianyu, llm_client, bot, image_processor, item_cache, reply_cache=None,
+                 classify_cache=None):
+        self.xianyu = xianyu
+        self.llm_client = llm_client
+        self.bot = bot
+        self.image_processor = image_processor
+        self.item_cache = item_cache
+        self.reply_cache = reply_cache
+        self.classify_cache = classify_cache
+
+    @classmethod
+    def create(cls, db_path="data/chat_history.db"):
+        """
+        按环境变量配置创建共享服务
+
+        Args:
+            db_path: 商品缓存和意图分类缓存持久化使用的数据库路径
+        """
+        llm_client = LLMClient()
+        classify_cache = ClassifyCache(
+            ttl=int(os.getenv("CLASSIFY_CACHE_TTL", "86400")),
+            max_size=int(os.getenv("CLASSIFY_CACHE_SIZE", "5000")),
+            db_path=db_path if os.getenv("CLASSIFY_CACHE_PERSIST", "1") == "1" else None
+        )
+        bot = XianyuReplyBot(client=llm_client, classify_cache=classify_cache)
+        item_cache = ItemCache(
+            ttl=int(os.getenv("ITEM_CACHE_TTL", "600")),
+            stale_ttl=int(os.getenv("ITEM_CACHE_STALE_TTL", "3600")),
+            max_size=int(os.getenv("ITEM_CACHE_SIZE", "1000")),
+            db_path=db_path if os.getenv("ITEM_CACHE_PERSIST", "1") == "1" else None
+        )
+        return cls(
+            xianyu=AsyncXianyuApis(),
+            llm_client=llm_client,
+            bot=bot,
+            # 从XianyuReplyBot获取图片提示词
+            image_processor=ImageProcessor(image_prompt=bot.image_prompt),
+            item_cache=item_cache,
+            reply_cache=ReplyCache(
+                threshold=float(os.getenv("REPLY_CACHE_THRESHOLD", "0.8")),
+                ttl=int(os.getenv("REPLY_CACHE_TTL", "86400")),
+                intents=[i for i in os.getenv("REPLY_CACHE_INTENTS", "tech,default").split(",") if i]
+            ) if os.getenv("REPLY_CACHE_ENABLED", "1") == "1" else None,
+            classify_cache=classify_cache,
+        )
+
+    async def close(self):
+        """写入待保存的分类缓存，并关闭共享的网络连接池"""
+        try:
+            if self.classify_cache:
+                await self.classify_cache.aflush()
+            await self.xianyu.close()
+            await self.llm_client.close()
+        except Exception as e:
+            logger.warning(f"关闭共享服务时出错: {e}")
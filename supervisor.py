@@ -0,0 +1,280 @@
+"""
+多进程账号分片入口
+
+把账号分片到多个worker进程，每个进程用MultiAccountRunner运行自己那一片账号，
+充分利用多核。supervisor负责按退避重启崩溃的worker，超过重启上限的worker会被
+下线并把账号重新分配给其他worker，同时汇总各worker上报的运行指标。
+
+用法:
+    python supervisor.py config/accounts.json --workers 4
+
+配合 tools/standin_server.py 可在本机完整跑通：
+    XIANYU_WS_URL=ws://127.0.0.1:8765/ws XIANYU_API_BASE=http://127.0.0.1:8765/h5/ \\
+    LLM_BASE_URL=http://127.0.0.1:8765/v1 python supervisor.py config/accounts.json --workers 2
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import signal
+import time
+from loguru import logger
+from dotenv import load_dotenv
+
+from multi_account import MultiAccountRunner, load_accounts
+
+
+def worker_main(worker_id, accounts, metrics_queue, data_dir, metrics_interval):
+    """worker进程入口"""
+    load_dotenv()
+    try:
+        asyncio.run(_worker_async(worker_id, accounts, metrics_queue, data_dir, metrics_interval))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _report_metrics(worker_id, runner, metrics_queue, interval):
+    """定期向supervisor上报本进程的运行指标"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            metrics_queue.put_nowait({
+                "worker_id": worker_id,
+                "pid": os.getpid(),
+                "time": time.time(),
+                "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                "stats": runner.stats(),
+            })
+        except Exception as e:
+            logger.warning(f"worker {worker_id} 上报指标失败: {e}")
+
+
+async def _worker_async(worker_id, accounts, metrics_queue, data_dir, metrics_interval):
+    runner = MultiAccountRunner(accounts, data_dir=data_dir)
+    main_task = asyncio.current_task()
+    # 收到SIGTERM时取消主任务，让各账号正常收尾
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, main_task.cancel)
+    reporter = asyncio.create_task(_report_metrics(worker_id, runner, metrics_queue, metrics_interval))
+    logger.info(f"worker {worker_id} (pid {os.getpid()}) 启动，负责账号: {[a['name'] for a in accounts]}")
+    try:
+        await runner.run()
+    except asyncio.CancelledError:
+        logger.info(f"worker {worker_id} 正在退出")
+    finally:
+        reporter.cancel()
+
+
+class WorkerSlot:
+    """一个worker进程位"""
+
+    def __init__(self, worker_id, accounts):
+        self.worker_id = worker_id
+        self.accounts = accounts
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+        self.next_start_at = None
+        self.retired = False
+        self.last_metrics = None
+
+
+class Supervisor:
+    """worker进程管理器"""
+
+    def __init__(self, accounts, num_workers=None, data_dir="data", max_restarts=5,
+                 base_backoff=1.0, max_backoff=60.0, stable_after=300.0, metrics_interval=10.0,
+                 metrics_path=None):
+        """
+        初始化supervisor
+
+        Args:
+            accounts: 账号列表
+            num_workers: worker进程数，默认CPU核数（不超过账号数）
+            data_dir: 数据目录
+            max_restarts: 单个worker连续重启的上限，超过后下线并重新分配账号
+            base_backoff: 重启退避的基础时间（秒）
+            max_backoff: 重启退避的最大时间（秒）
+            stable_after: worker运行超过该时间后重置连续重启计数（秒）
+            metrics_interval: worker上报指标的间隔（秒）
+            metrics_path: 汇总指标写入的JSON文件，为None时只写日志
+        """
+        num_workers = num_workers or os.cpu_count() or 1
+        self.num_workers = max(1, min(num_workers, len(accounts)))
+        self.data_dir = data_dir
+        self.max_restarts = max_restarts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.stable_after = stable_after
+        self.metrics_interval = metrics_interval
+        self.metrics_path = metrics_path
+
+        self.ctx = multiprocessing.get_context("spawn")
+        self.metrics_queue = self.ctx.Queue()
+        self.slots = [WorkerSlot(i, accounts[i::self.num_workers]) for i in range(self.num_workers)]
+        self.running = False
+
+    def _start(self, slot):
+        slot.process = self.ctx.Process(
+            target=worker_main,
+            args=(slot.worker_id, slot.accounts, self.metrics_queue, self.data_dir, self.metrics_interval),
+            name=f"xianyu-worker-{slot.worker_id}",
+            daemon=False,
+        )
+        slot.process.start()
+        slot.started_at = time.time()
+        slot.next_start_at = None
+        logger.info(f"已启动 worker {slot.worker_id} (pid {slot.process.pid})，账号数: {len(slot.accounts)}")
+
+    def _stop(self, slot, timeout=10):
+        process = slot.process
+        if process and process.is_alive():
+            process.terminate()
+            process.join(timeout)
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+    def _live_slots(self):
+        return [slot for slot in self.slots if not slot.retired]
+
+    def _handle_exit(self, slot):
+        """处理worker退出：按退避重启，或下线并重新分配账号"""
+        exitcode = slot.process.exitcode
+        uptime = time.time() - slot.started_at
+        if uptime >= self.stable_after:
+            slot.restarts = 0
+        slot.restarts += 1
+        logger.warning(f"worker {slot.worker_id} 已退出 (exitcode={exitcode}, 运行 {uptime:.0f} 秒, 连续重启 {slot.restarts} 次)")
+
+        if slot.restarts > self.max_restarts and len(self._live_slots()) > 1:
+            self._retire(slot)
+            return
+
+        delay = min(self.max_backoff, self.base_backoff * (2 ** (slot.restarts - 1)))
+        slot.next_start_at = time.time() + delay
+        logger.info(f"worker {slot.worker_id} 将在 {delay:.1f} 秒后重启")
+
+    def _retire(self, slot):
+        """下线worker，把它的账号分给当前账号最少的worker"""
+        slot.retired = True
+        orphans, slot.accounts = slot.accounts, []
+        logger.error(f"worker {slot.worker_id} 重启次数过多已下线，重新分配 {len(orphans)} 个账号")
+
+        targets = set()
+        for account in orphans:
+            target = min(self._live_slots(), key=lambda s: len(s.accounts))
+            target.accounts.append(account)
+            targets.add(target)
+
+        # 账号分配变化后重启目标worker，使其加载新的账号列表
+        for target in targets:
+            logger.info(f"worker {target.worker_id} 接管账号，当前账号数: {len(target.accounts)}")
+            if target.process and target.process.is_alive():
+                self._stop(target)
+                self._start(target)
+
+    def _check_workers(self):
+        now = time.time()
+        for slot in self._live_slots():
+            if slot.next_start_at is not None:
+                if now >= slot.next_start_at:
+                    self._start(slot)
+            elif slot.process is not None and not slot.process.is_alive():
+                self._handle_exit(slot)
+
+    def _drain_metrics(self):
+        while True:
+            try:
+                metrics = self.metrics_queue.get_nowait()
+            except queue.Empty:
+                return
+            slot = self.slots[metrics["worker_id"]]
+            slot.last_metrics = metrics
+
+    def metrics(self):
+        """汇总各worker的指标"""
+        return {
+            "time": time.time(),
+            "workers": [
+                {
+                    "worker_id": slot.worker_id,
+                    "pid": slot.process.pid if slot.process else None,
+                    "alive": bool(slot.process and slot.process.is_alive()),
+                    "retired": slot.retired,
+                    "restarts": slot.restarts,
+                    "accounts": [a["name"] for a in slot.accounts],
+                    "last_metrics": slot.last_metrics,
+                }
+                for slot in self.slots
+            ],
+        }
+
+    def _publish_metrics(self):
+        metrics = self.metrics()
+        alive = sum(1 for w in metrics["workers"] if w["alive"])
+        logger.info(f"worker状态: {alive}/{len(self._live_slots())} 存活")
+        if self.metrics_path:
+            tmp_path = self.metrics_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(metrics, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.metrics_path)
+
+    def run(self):
+        """启动所有worker并持续监控，直到收到退出信号"""
+        self.running = True
+        signal.signal(signal.SIGTERM, lambda *_: setattr(self, "running", False))
+        for slot in self.slots:
+            self._start(slot)
+
+        last_publish = time.time()
+        try:
+            while self.running:
+                time.sleep(1)
+                self._drain_metrics()
+                self._check_workers()
+                if time.time() - last_publish >= self.metrics_interval:
+                    self._publish_metrics()
+                    last_publish = time.time()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        """停止所有worker"""
+        logger.info("正在停止所有worker...")
+        for slot in self.slots:
+            self._stop(slot)
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="闲鱼多进程账号分片")
+    parser.add_argument("config", nargs="?", default=os.path.join("config", "accounts.json"))
+    parser.add_argument("--workers", type=int, default=None, help="worker进程数，默认CPU核数")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--max-restarts", type=int, default=5)
+    parser.add_argument("--metrics-interval", type=float, default=10.0)
+    parser.add_argument("--metrics-path", default=None, help="汇总指标写入的JSON文件")
+    args = parser.parse_args()
+
+    accounts = load_accounts(args.config)
+    if not accounts:
+        logger.error(f"配置文件中没有有效账号: {args.config}")
+        return
+
+    Supervisor(
+        accounts,
+        num_workers=args.workers,
+        data_dir=args.data_dir,
+        max_restarts=args.max_restarts,
+        metrics_interval=args.metrics_interval,
+        metrics_path=args.metrics_path,
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
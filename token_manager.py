@@ -0,0 +1,103 @@
+import asyncio
+import time
+from loguru import logger
+
+
+class TokenManager:
+    """
+    IM accessToken缓存
+
+    记录token的获取时间和过期时间，在启动校验、/reg注册和断线重连之间复用同一个token，
+    并在过期前由后台任务提前刷新，只有确实需要时才请求登录token接口。
+    """
+
+    def __init__(self, xianyu, cookies, device_id, ttl=3600, refresh_margin=300):
+        """
+        初始化token缓存
+
+        Args:
+            xianyu: AsyncXianyuApis实例
+            cookies: 账号cookie字典
+            device_id: 设备ID
+            ttl: token有效期（秒）
+            refresh_margin: 距离过期多久时提前刷新（秒）
+        """
+        self.xianyu = xianyu
+        self.cookies = cookies
+        self.device_id = device_id
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.token = None
+        self.expires_at = 0
+        self.fetch_count = 0
+        self._lock = asyncio.Lock()
+        self._refresh_task = None
+
+    def is_valid(self):
+        """token存在且未进入提前刷新窗口"""
+        return self.token is not None and time.time() < self.expires_at - self.refresh_margin
+
+    async def get_token(self, force=False):
+        """
+        获取accessToken，缓存有效时直接返回
+
+        Args:
+            force: 是否忽略缓存强制刷新
+
+        Returns:
+            str: accessToken
+        """
+        if not force and self.is_valid():
+            return self.token
+
+        async with self._lock:
+            # 等锁期间可能已被其他协程刷新
+            if not force and self.is_valid():
+                return self.token
+            return await self._fetch()
+
+    async def _fetch(self):
+        response = await self.xianyu.get_token(self.cookies, self.device_id)
+        self.fetch_count += 1
+        try:
+            token = response['data']['accessToken']
+        except (KeyError, TypeError):
+            raise ValueError(f"获取accessToken失败: {response.get('ret') if isinstance(response, dict) else response}")
+        self.token = token
+        self.expires_at = time.time() + self.ttl
+        logger.info(f"已获取新的accessToken，有效期 {self.ttl} 秒")
+        return token
+
+    def invalidate(self):
+        """使缓存的token失效，下次使用时重新获取"""
+        self.token = None
+        self.expires_at = 0
+
+    async def _auto_refresh_loop(self):
+        while True:
+            delay = max(self.expires_at - self.refresh_margin - time.time(), 0)
+            await asyncio.sleep(delay if self.token else self.refresh_margin)
+            try:
+                async with self._lock:
+                    if not self.is_valid():
+                        await self._fetch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"后台刷新accessToken失败: {e}")
+                await asyncio.sleep(60)
+
+    def start_auto_refresh(self):
+        """启动后台提前刷新任务"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._auto_refresh_loop())
+
+    async def stop_auto_refresh(self):
+        """停止后台刷新任务"""
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
@@ -0,0 +1,137 @@
+"""
+本地替身服务
+
+在一个端口上模拟闲鱼IM websocket、mtop接口和OpenAI兼容的对话接口，
+用于在单机上测试多账号和多进程分片，不访问任何真实服务。
+
+用法:
+    python tools/standin_server.py --port 8765 --push-interval 2
+
+客户端环境变量:
+    XIANYU_WS_URL=ws://127.0.0.1:8765/ws
+    XIANYU_API_BASE=http://127.0.0.1:8765/h5/
+    LLM_BASE_URL=http://127.0.0.1:8765/v1
+"""
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import time
+
+from aiohttp import web, WSMsgType
+
+
+# 买家消息样本：议价、常见问题和闲聊混合
+BUYER_MESSAGES = ["这个还能便宜点吗", "包邮吗", "还在吗", "电池健康多少", "包邮吗？", "成色怎么样"]
+
+
+class StandinServer:
+    def __init__(self, push_interval=2.0, llm_delay=0.0):
+        self.push_interval = push_interval
+        self.llm_delay = llm_delay
+        self.counter = itertools.count(1)
+        self.stats = {"connections": 0, "pushed": 0, "sent_by_client": 0, "acks": 0, "llm_calls": 0}
+
+    def _sync_frame(self, buyer_id):
+        n = next(self.counter)
+        text = BUYER_MESSAGES[n % len(BUYER_MESSAGES)]
+        message = {"1": {
+            "2": f"{900000 + buyer_id}@goofish",
+            "3": f"standin-{n}.PNM",
+            "5": int(time.time() * 1000),
+            "10": {
+                "reminderTitle": f"买家{buyer_id}",
+                "senderUserId": str(800000 + buyer_id),
+                "reminderContent": text,
+                "detailNotice": text,
+                "reminderUrl": "fleamarket://message_chat?itemId=100000001&peerUserId=1",
+            },
+        }}
+        data = base64.b64encode(json.dumps(message, ensure_ascii=False).encode("utf-8")).decode("utf-8")
+        return {
+            "lwp": "/s/para",
+            "headers": {"mid": f"{n} 0", "sid": "standin"},
+            "body": {"syncPushPackage": {"data": [{"data": data, "pts": int(time.time() * 1000) * 1000}]}},
+        }
+
+    async def _push_loop(self, ws):
+        buyer_ids = itertools.cycle(range(5))
+        while not ws.closed:
+            await asyncio.sleep(self.push_interval)
+            await ws.send_str(json.dumps(self._sync_frame(next(buyer_ids)), ensure_ascii=False))
+            self.stats["pushed"] += 1
+
+    async def handle_ws(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.stats["connections"] += 1
+        push_task = None
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+                frame = json.loads(msg.data)
+                if "code" in frame:
+                    self.stats["acks"] += 1
+                    continue
+                lwp = frame.get("lwp")
+                mid = frame.get("headers", {}).get("mid")
+                if lwp == "/r/MessageSend/sendByReceiverScope":
+                    self.stats["sent_by_client"] += 1
+                await ws.send_str(json.dumps({"code": 200, "headers": {"mid": mid}}))
+                if lwp == "/reg" and push_task is None:
+                    push_task = asyncio.create_task(self._push_loop(ws))
+        finally:
+            if push_task:
+                push_task.cancel()
+        return ws
+
+    async def handle_mtop(self, request):
+        api = request.match_info["api"]
+        if "login.token" in api:
+            data = {"accessToken": f"standin-token-{int(time.time())}"}
+        else:
+            data = {"itemDO": {"title": "替身商品", "soldPrice": "100", "desc": "九成新，无拆修", "categoryName": "数码"}}
+        return web.json_response({"api": api, "ret": ["SUCCESS::调用成功"], "data": data})
+
+    async def handle_chat(self, request):
+        body = await request.json()
+        self.stats["llm_calls"] += 1
+        await asyncio.sleep(self.llm_delay)
+        content = "好的，亲~"
+        if body.get("response_format", {}).get("type") == "json_object":
+            content = json.dumps({"intent": "default", "reply": content}, ensure_ascii=False)
+        return web.json_response({
+            "id": f"standin-{next(self.counter)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "standin"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+    async def handle_stats(self, request):
+        return web.json_response(self.stats)
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/ws", self.handle_ws)
+        app.router.add_post("/h5/{api}/1.0/", self.handle_mtop)
+        app.router.add_post("/v1/chat/completions", self.handle_chat)
+        app.router.add_get("/stats", self.handle_stats)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="闲鱼本地替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--push-interval", type=float, default=2.0, help="每个连接推送一条买家消息的间隔（秒）")
+    parser.add_argument("--llm-delay", type=float, default=0.0, help="模拟大模型单次调用耗时（秒）")
+    args = parser.parse_args()
+    web.run_app(StandinServer(args.push_interval, args.llm_delay).app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()